@@ -62,6 +62,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'users.middleware.LastSeenMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -144,9 +145,9 @@ AUTH_USER_MODEL = 'users.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE-SIZE': 4,
+    'PAGE_SIZE': 4,
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.ClaimsJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
@@ -156,6 +157,9 @@ REST_FRAMEWORK = {
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=500),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    # В токены записываются роль и активность пользователя, чтобы не запрашивать его из БД на каждый запрос
+    'TOKEN_OBTAIN_SERIALIZER': 'users.serializers.ClaimsTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'users.serializers.ClaimsTokenRefreshSerializer',
 }
 
 # CORS settings
@@ -172,6 +176,47 @@ CORS_ALLOW_ALL_ORIGINS = False
 # Stripe API-settings
 STRIPE_PK = os.getenv('STRIPE_PUBLISH_KEY')
 STRIPE_SK = os.getenv('STRIPE_SECRET_KEY')
+STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
+
+# Клиент Stripe (education/stripe_client.py): таймауты соединения и чтения (в секундах) и размер пула соединений
+STRIPE_CONNECT_TIMEOUT = 3
+STRIPE_READ_TIMEOUT = 10
+STRIPE_POOL_SIZE = 10
+# Повторы при сетевых ошибках и ответах 5xx: количество, задержка первого (удваивается) и наибольшая (в секундах)
+STRIPE_MAX_RETRIES = 2
+STRIPE_RETRY_DELAY = 0.5
+STRIPE_MAX_RETRY_DELAY = 4
+# Предохранитель: доля ошибок среди последних запросов, при которой запросы отклоняются (и на сколько секунд)
+STRIPE_BREAKER_WINDOW = 20
+STRIPE_BREAKER_MIN_CALLS = 10
+STRIPE_BREAKER_ERROR_RATE = 0.5
+STRIPE_BREAKER_RESET_TIMEOUT = 30
+
+# Кеширование: Redis, если он включен в переменных окружения, иначе локальный кеш в памяти процесса
+CACHE_ENABLED = os.getenv('CACHE_ENABLED') == 'True'
+
+if CACHE_ENABLED:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_LOCATION'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Время жизни закешированных ответов списка и просмотра курсов (в секундах)
+COURSE_CACHE_TIMEOUT = 60 * 5
+
+# Как часто обновляется время последнего захода пользователя (в секундах)
+LAST_SEEN_INTERVAL = 60 * 5
+
+# Время жизни закешированного набора курсов, которыми владеет пользователь (в секундах), 0 - не кешировать
+OWNERSHIP_CACHE_TIMEOUT = 60 * 5
 
 CELERY_BROKER_URL = os.getenv('CACHE_LOCATION')
 CELERY_RESULT_BACKEND = os.getenv('CACHE_LOCATION')
@@ -180,6 +225,38 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'user_ban',
         'schedule': timedelta(minutes=1)
     },
+    'last_seen_flush': {
+        'task': 'last_seen_flush',
+        'schedule': timedelta(minutes=1)
+    },
+    'payments_rollup': {
+        'task': 'payments_rollup',
+        'schedule': timedelta(minutes=5)
+    },
+    'outbox_dispatch': {
+        'task': 'outbox_dispatch',
+        'schedule': timedelta(seconds=10)
+    },
+    'course_digest': {
+        'task': 'course_digest',
+        'schedule': timedelta(days=1)
+    },
+    'outbox_purge': {
+        'task': 'outbox_purge',
+        'schedule': timedelta(days=1)
+    },
+    'stripe_events_process': {
+        'task': 'stripe_events_process',
+        'schedule': timedelta(seconds=10)
+    },
+    'stripe_events_purge': {
+        'task': 'stripe_events_purge',
+        'schedule': timedelta(days=1)
+    },
+    'idempotency_purge': {
+        'task': 'idempotency_purge',
+        'schedule': timedelta(hours=1)
+    },
 }
 
 
@@ -190,3 +267,46 @@ EMAIL_PORT = 465
 EMAIL_USE_SSL = True
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')  # пароль приложения яндекс
+
+# Количество писем в одной подзадаче рассылки (одно SMTP-соединение на пачку)
+NOTIFY_CHUNK_SIZE = 100
+# Задержка первого повтора отправки пачки (в секундах), далее удваивается
+NOTIFY_RETRY_DELAY = 10
+# Окно объединения изменений уроков курса в одну рассылку (в секундах)
+NOTIFY_WINDOW = 60 * 5
+# Срок хранения изменений курсов, уже учтенных в ежедневной сводке
+DIGEST_EVENT_RETENTION = timedelta(days=7)
+
+# Фоновые задачи с отметкой обработки берут только строки старше этого запаса: транзакции, начатые раньше,
+# успевают зафиксироваться, и строка не окажется позади уже сдвинутой отметки
+WATERMARK_SAFETY_LAG = timedelta(minutes=5)
+
+# Сессии оплаты Stripe: задержка первого повтора создания (в секундах, далее удваивается) и количество повторов
+CHECKOUT_RETRY_DELAY = 2
+CHECKOUT_MAX_RETRIES = 5
+# Наибольшее время ожидания готовности сессии оплаты в запросе статуса ?wait= (в секундах)
+CHECKOUT_MAX_WAIT = 20
+
+# Срок хранения ключей идемпотентности запросов (Idempotency-Key)
+IDEMPOTENCY_KEY_TTL = timedelta(days=1)
+# Сколько повтор запроса ждет ответа на первый запрос с тем же ключом (в секундах), дальше - 409 Conflict
+IDEMPOTENCY_WAIT = 30
+IDEMPOTENCY_POLL_INTERVAL = 0.1
+# Аренда ключа первым запросом: если ответ не сохранен за это время (процесс завершился аварийно),
+# повтор занимает ключ и выполняет запрос заново. Должна быть больше наибольшего времени запроса с обращением к Stripe
+IDEMPOTENCY_LEASE = timedelta(minutes=5)
+
+# События Stripe: размер пачки обработки и срок хранения обработанных событий (повторы webhook отбрасываются по id)
+STRIPE_EVENTS_BATCH_SIZE = 500
+STRIPE_EVENT_RETENTION = timedelta(days=30)
+
+# Outbox: размер пачки и количество пачек за один запуск диспетчера
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_BATCHES = 50
+# Время аренды захваченного события (в секундах) - после него событие может захватить другой диспетчер
+OUTBOX_LEASE = 60 * 5
+# Повторы после ошибки: задержка первого повтора (в секундах, далее удваивается) и количество попыток
+OUTBOX_RETRY_DELAY = 30
+OUTBOX_MAX_ATTEMPTS = 8
+# Срок хранения обработанных событий
+OUTBOX_RETENTION = timedelta(days=7)
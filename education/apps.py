@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class EducationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'education'
+
+    def ready(self):
+        # Подключаем обработчики сигналов моделей
+        import education.signals  # noqa: F401
+
+        # Общий пул соединений, таймауты и предохранитель для запросов к Stripe
+        from education.stripe_client import configure_stripe
+        configure_stripe()
@@ -0,0 +1,137 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Max
+from django.db.models.functions import Greatest
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from education import metrics
+
+COURSES_VERSION_KEY = 'courses:version'
+
+
+def get_version(key):
+    """ Текущая версия данных по ключу, входит в ключи закешированных значений, зависящих от этих данных """
+
+    return cache.get_or_set(key, time.time_ns, timeout=None)
+
+
+def bump_version(key):
+    """ Смена версии данных - все ранее закешированные значения с прежней версией перестают читаться """
+
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Версии в кеше нет (вытеснена или кеш перезапущен) - берем новое уникальное значение
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def get_courses_version():
+    """ Текущая версия данных курсов, входит в ключ каждого закешированного ответа """
+
+    return get_version(COURSES_VERSION_KEY)
+
+
+def bump_courses_version():
+    """ Смена версии данных курсов - все ранее закешированные ответы перестают читаться """
+
+    bump_version(COURSES_VERSION_KEY)
+
+
+def get_response_cache_key(request, prefix):
+    """ Ключ ответа: версия данных, пользователь с его ролью и полный адрес запроса с параметрами """
+
+    user = request.user
+    raw_key = f'{get_courses_version()}:{user.pk}:{getattr(user, "role", "")}:{request.build_absolute_uri()}'
+    return f'{prefix}:{hashlib.md5(raw_key.encode()).hexdigest()}'
+
+
+class CachedResponseMixin:
+    """ Миксин для ViewSet - кеширование ответов list и retrieve для каждого пользователя отдельно """
+
+    cache_prefix = 'courses:response'
+    cache_metric = 'course_cache'
+    cache_timeout = settings.COURSE_CACHE_TIMEOUT
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        """ Возвращаем ответ из кеша, а если его нет - формируем и сохраняем успешный ответ """
+
+        key = get_response_cache_key(request, self.cache_prefix)
+        data = cache.get(key)
+        if data is not None:
+            metrics.incr(f'{self.cache_metric}.hit')
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        metrics.incr(f'{self.cache_metric}.miss')
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, self.cache_timeout)
+        response['X-Cache'] = 'MISS'
+        return response
+
+
+class ConditionalGetMixin:
+    """
+    Миксин для представлений с моделями, у которых есть updated_at - условные GET-запросы:
+    валидаторы ETag и Last-Modified считаются одним запросом MAX(updated_at) и COUNT(*) до сериализации,
+    и на If-None-Match / If-Modified-Since без изменений отдается 304 Not Modified.
+    Если в ответе выводятся поля связанных моделей (название курса урока, имя владельца курса),
+    их updated_at тоже входит в MAX через conditional_related_fields
+    """
+
+    # Связи, данные которых выводятся в ответе, - у связанных моделей тоже должно быть поле updated_at
+    conditional_related_fields = ()
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.get_conditional_response(queryset, False, super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            **{self.lookup_field: kwargs[lookup_url_kwarg]}
+        )
+        return self.get_conditional_response(queryset, True, super().retrieve, request, *args, **kwargs)
+
+    def get_conditional_response(self, queryset, detail, handler, request, *args, **kwargs):
+        stats = queryset.order_by().aggregate(last_modified=Max(self.get_modified_expression()), count=Count('pk'))
+        # Несуществующий или недоступный объект - отдаем обычный ответ 404
+        if detail and not stats['count']:
+            return handler(request, *args, **kwargs)
+
+        last_modified = int(stats['last_modified'].timestamp()) if stats['last_modified'] else None
+        # Ответ зависит от пользователя (доступные объекты, статус подписки) и параметров запроса
+        raw_etag = f'{request.user.pk}:{getattr(request.user, "role", "")}:{request.get_full_path()}:' \
+                   f'{stats["last_modified"]}:{stats["count"]}'
+        etag = quote_etag(hashlib.md5(raw_etag.encode()).hexdigest())
+
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def get_modified_expression(self):
+        """ Время изменения строки с учетом связанных строк (GREATEST в PostgreSQL пропускает NULL) """
+
+        if not self.conditional_related_fields:
+            return F('updated_at')
+        return Greatest('updated_at', *(f'{field}__updated_at' for field in self.conditional_related_fields))
@@ -0,0 +1,64 @@
+import time
+
+import stripe
+from django.core.cache import cache
+
+from education import metrics
+from education.models import Payments
+from education.services import create_session, get_price_id
+
+# Отметка о завершении создания сессии: ожидающие запросы статуса читают платеж из БД только после нее
+CHECKOUT_DONE_KEY = 'checkout:done:{}'
+CHECKOUT_DONE_TIMEOUT = 60
+CHECKOUT_POLL_INTERVAL = 0.25
+# Даже без отметки (например, кеш не общий для процессов) платеж перечитывается раз в секунду
+CHECKOUT_DB_POLL_INTERVAL = 1
+
+# Ошибки Stripe, после которых создание сессии стоит повторить
+RETRYABLE_ERRORS = (stripe.error.APIConnectionError, stripe.error.APIError, stripe.error.RateLimitError)
+
+
+def prefers_async(request):
+    """ Клиент просит ответить сразу, не дожидаясь Stripe (заголовок Prefer: respond-async, RFC 7240) """
+
+    preferences = request.headers.get('Prefer', '').replace(';', ',').split(',')
+    return 'respond-async' in (preference.strip().lower() for preference in preferences)
+
+
+def checkout_payment(payment):
+    """ Создание сессии оплаты Stripe для платежа и сохранение ссылки на оплату """
+
+    session = create_session(get_price_id(payment), client_reference_id=str(payment.pk),
+                             idempotency_key=f'payment-{payment.pk}-checkout')
+    set_checkout(payment, checkout_status=Payments.CHECKOUT_READY, payment_url=session['url'],
+                 stripe_session_id=session['id'])
+    metrics.incr('checkout.ready')
+
+
+def fail_checkout(payment):
+    """ Создать сессию оплаты не удалось """
+
+    set_checkout(payment, checkout_status=Payments.CHECKOUT_FAILED)
+    metrics.incr('checkout.failed')
+
+
+def set_checkout(payment, **changes):
+    """ Запись результата создания сессии и отметка для ожидающих запросов статуса """
+
+    Payments.objects.filter(pk=payment.pk).update(**changes)
+    for field, value in changes.items():
+        setattr(payment, field, value)
+    cache.set(CHECKOUT_DONE_KEY.format(payment.pk), True, CHECKOUT_DONE_TIMEOUT)
+
+
+def wait_for_checkout(payment, timeout):
+    """ Ожидание готовности сессии оплаты не дольше timeout секунд (long polling) """
+
+    deadline = time.monotonic() + timeout
+    db_polled = time.monotonic()
+    while payment.checkout_status == Payments.CHECKOUT_PENDING and time.monotonic() < deadline:
+        time.sleep(max(0, min(CHECKOUT_POLL_INTERVAL, deadline - time.monotonic())))
+        if cache.get(CHECKOUT_DONE_KEY.format(payment.pk)) or time.monotonic() - db_polled >= CHECKOUT_DB_POLL_INTERVAL:
+            payment.refresh_from_db(fields=['checkout_status', 'payment_url', 'stripe_session_id'])
+            db_polled = time.monotonic()
+    return payment
@@ -0,0 +1,104 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.relations import PrimaryKeyRelatedField, SlugRelatedField
+from rest_framework.response import Response
+
+
+class CompiledSerializer:
+    """
+    Сериализация только для чтения без создания экземпляров моделей:
+    строки берутся из .values(), для каждого поля заранее подготовлены колонка и функция преобразования.
+    Результат совпадает с выводом исходного ModelSerializer
+    """
+
+    def __init__(self, accessors):
+        self.accessors = accessors
+        self.lookups = [lookup for _, lookup, _ in accessors if lookup is not None]
+
+    def to_representation(self, row):
+        data = {}
+        for name, lookup, convert in self.accessors:
+            value = convert if lookup is None else row[lookup]
+            if lookup is not None and value is not None and convert is not None:
+                value = convert(value)
+            data[name] = value
+        return data
+
+
+def compile_serializer(serializer):
+    """ Подготовка CompiledSerializer по полям сериализатора, None - если поля не поддерживаются """
+
+    model = serializer.Meta.model
+    accessors = []
+    for name, field in serializer.fields.items():
+        accessor = _compile_field(model, field, serializer.context)
+        if accessor is None:
+            return None
+        accessors.append((name, *accessor))
+    return CompiledSerializer(accessors)
+
+
+def _compile_field(model, field, context):
+    """ Колонка .values() и функция преобразования значения для одного поля сериализатора """
+
+    if field.write_only or '.' in field.source or field.source == '*':
+        return None
+    if isinstance(field, (serializers.SerializerMethodField, serializers.BaseSerializer)):
+        return None
+
+    try:
+        model_field = model._meta.get_field(field.source)
+    except FieldDoesNotExist:
+        # Атрибут класса модели, который не является полем (например, username = None у User)
+        attribute = getattr(model, field.source, None)
+        if isinstance(field, serializers.ReadOnlyField) and not callable(attribute) and \
+                not isinstance(attribute, property):
+            return None, attribute
+        return None
+
+    if isinstance(field, SlugRelatedField):
+        return f'{field.source}__{field.slug_field}', None
+    if isinstance(field, PrimaryKeyRelatedField):
+        return (field.source, None) if field.pk_field is None else None
+    if model_field.is_relation:
+        return None
+    if isinstance(field, serializers.FileField):
+        return field.source, _file_url(model_field.storage, field, context)
+    return field.source, field.to_representation
+
+
+def _file_url(storage, field, context):
+    """ Преобразование имени файла в ссылку так же, как это делает FileField/ImageField из DRF """
+
+    use_url = getattr(field, 'use_url', True)
+    request = context.get('request')
+
+    def convert(name):
+        if not name:
+            return None
+        if not use_url:
+            return name
+        url = storage.url(name)
+        return request.build_absolute_uri(url) if request is not None else url
+
+    return convert
+
+
+class CompiledListMixin:
+    """ Миксин для ListAPIView - ответ на GET-запрос списка собирается быстрым CompiledSerializer """
+
+    def list(self, request, *args, **kwargs):
+        compiled = compile_serializer(self.get_serializer())
+        if compiled is None:
+            return super().list(request, *args, **kwargs)
+
+        # Поля курсорной сортировки нужны пагинатору для ссылок на соседние страницы
+        lookups = set(compiled.lookups) | {field.lstrip('-') for field in getattr(self, 'cursor_ordering', ())}
+        queryset = self.filter_queryset(self.get_queryset()).values(*lookups)
+
+        page = self.paginate_queryset(queryset)
+        rows = page if page is not None else queryset
+        data = [compiled.to_representation(row) for row in rows]
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
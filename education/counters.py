@@ -0,0 +1,112 @@
+from django.db import transaction
+from django.db.models import Count, F, Func, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from education.caching import bump_courses_version
+from education.models import Course, Lesson, Payments, Subscription
+
+
+def get_counted_state(instance):
+    """
+    Снимок полей строки, от которых зависят счетчики курса.
+    Читаем только загруженные поля (__dict__), чтобы не вызывать догрузку отложенных полей
+    """
+
+    values = instance.__dict__
+    if isinstance(instance, Lesson):
+        fields = ('course_id',)
+    elif isinstance(instance, Subscription):
+        fields = ('course_id', 'is_subscribed')
+    else:
+        fields = ('course_id', 'lesson_id', 'amount', 'payment_status')
+    if any(field not in values for field in fields):
+        return None
+    return tuple(values[field] for field in fields)
+
+
+def get_contributions(model, state):
+    """ Курс строки и ее вклад в счетчики этого курса в виде (id курса, {поле счетчика: величина}) """
+
+    if state is None:
+        return None, {}
+    if model is Lesson:
+        course_id, = state
+        return course_id, {'lessons_count': 1}
+    if model is Subscription:
+        course_id, is_subscribed = state
+        return course_id, {'subscribers_count': 1} if is_subscribed else {}
+
+    course_id, lesson_id, amount, payment_status = state
+    # В выручку входят только оплаченные платежи, попытки оплаты без результата не учитываются
+    if not amount or payment_status != Payments.PAYMENT_PAID:
+        return None, {}
+    # Оплата урока засчитывается в выручку курса, к которому относится урок
+    if not course_id and lesson_id:
+        course_id = Lesson.objects.filter(pk=lesson_id).values_list('course_id', flat=True).first()
+    return course_id, {'revenue_total': amount}
+
+
+def shift_course_counters(model, old_state, new_state):
+    """
+    Атомарное изменение счетчиков курсов через F() на разницу между старым и новым вкладом строки.
+    Тем же UPDATE обновляется дата изменения курса, так как изменились данные, которые выводятся в курсе
+    """
+
+    shift_course_counters_bulk(model, [(old_state, new_state)])
+
+
+def shift_course_counters_bulk(model, changes):
+    """
+    Изменение счетчиков по списку (старое состояние, новое состояние) строк - для массовых изменений
+    (bulk_update не вызывает сигналы): разницы суммируются, и каждый курс обновляется одним UPDATE.
+    Счетчики выводятся в закешированных ответах по курсам, поэтому при их изменении после фиксации
+    транзакции меняется версия кеша курсов
+    """
+
+    deltas = {}
+    for old_state, new_state in changes:
+        for sign, state in ((-1, old_state), (1, new_state)):
+            course_id, values = get_contributions(model, state)
+            if course_id is None:
+                continue
+            course_deltas = deltas.setdefault(course_id, {})
+            for field, value in values.items():
+                course_deltas[field] = course_deltas.get(field, 0) + sign * value
+
+    now = timezone.now()
+    shifted = False
+    # Курсы обновляются в порядке id, чтобы параллельные обновления не блокировали друг друга крест-накрест
+    for course_id, course_deltas in sorted(deltas.items()):
+        changes = {field: F(field) + value for field, value in course_deltas.items() if value}
+        Course.objects.filter(pk=course_id).update(updated_at=now, **changes)
+        shifted = shifted or bool(changes)
+    if shifted:
+        transaction.on_commit(bump_courses_version)
+
+
+def recount_course_counters(queryset=None):
+    """ Полный пересчет счетчиков курсов одним UPDATE с подзапросами - исправление расхождений """
+
+    if queryset is None:
+        queryset = Course.objects.all()
+
+    lessons = Lesson.objects.filter(course=OuterRef('pk')).order_by().values('course').annotate(
+        total=Count('pk')
+    ).values('total')
+    subscribers = Subscription.objects.filter(course=OuterRef('pk'), is_subscribed=True).order_by().values(
+        'course'
+    ).annotate(total=Count('pk')).values('total')
+    revenue = Payments.objects.filter(
+        Q(course=OuterRef('pk')) | Q(course__isnull=True, lesson__course=OuterRef('pk')),
+        payment_status=Payments.PAYMENT_PAID,
+    ).order_by().annotate(
+        total=Func(F('amount'), function='SUM', output_field=IntegerField())
+    ).values('total')
+
+    transaction.on_commit(bump_courses_version)
+    return queryset.update(
+        lessons_count=Coalesce(Subquery(lessons), 0),
+        subscribers_count=Coalesce(Subquery(subscribers), 0),
+        revenue_total=Coalesce(Subquery(revenue), 0),
+    )
@@ -1,5 +1,5 @@
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, get_connection, send_mail
 
 
 def send_mail_task(subject, message, recipient_list):
@@ -17,3 +17,34 @@ def send_mail_task(subject, message, recipient_list):
     except Exception as e:
         print(f'Ошибка отправки {e}')
         raise
+
+
+class MailChunkError(Exception):
+    """ Ошибка отправки пачки писем - хранит количество писем, отправленных до ошибки """
+
+    def __init__(self, sent, error):
+        super().__init__(str(error))
+        self.sent = sent
+        self.error = error
+
+
+def send_mail_chunk(subject, items):
+    '''
+    Отправляет пачку персональных e-mail через одно SMTP-соединение (send_messages)
+    :param subject: заголовок сообщений
+    :param items: список пар [e-mail получателя, текст сообщения]
+    :return: количество отправленных сообщений
+    '''
+
+    from_email = settings.EMAIL_HOST_USER
+    sent = 0
+
+    try:
+        with get_connection(fail_silently=False) as connection:
+            for recipient, message in items:
+                # Письма отправляются по одному, чтобы при ошибке повторить только неотправленные
+                connection.send_messages([EmailMessage(subject, message, from_email, [recipient])])
+                sent += 1
+    except Exception as e:
+        raise MailChunkError(sent, e) from e
+    return sent
@@ -0,0 +1,55 @@
+import csv
+import json
+
+from education.compiled_serializers import compile_serializer
+
+# Количество строк, которое за раз читается из серверного курсора БД
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class Echo:
+    """ Псевдо-файл для csv.writer: строка не копится в буфере, а сразу возвращается """
+
+    def write(self, value):
+        return value
+
+
+def iter_export_rows(queryset, serializer):
+    """
+    Строки выгрузки в формате сериализатора: данные читаются серверным курсором (.iterator)
+    пачками по EXPORT_CHUNK_SIZE, поэтому память не зависит от количества строк
+    """
+
+    compiled = compile_serializer(serializer)
+    for row in queryset.values(*compiled.lookups).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield compiled.to_representation(row)
+
+
+def iter_ndjson(rows):
+    """ Каждая строка - отдельный JSON-объект на своей строке """
+
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+def iter_csv(rows, field_names):
+    """ CSV с заголовком из имен полей сериализатора """
+
+    writer = csv.writer(Echo())
+    yield writer.writerow(field_names)
+    for row in rows:
+        yield writer.writerow([row[name] for name in field_names])
+
+
+def iter_export(queryset, serializer, export_format):
+    """ Поток строк выгрузки в нужном формате """
+
+    rows = iter_export_rows(queryset, serializer)
+    if export_format == 'csv':
+        return iter_csv(rows, list(serializer.fields))
+    return iter_ndjson(rows)
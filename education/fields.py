@@ -0,0 +1,33 @@
+import hashlib
+
+from django.db import models
+
+
+def get_content_hash(*values):
+    """ SHA-256 от значений полей, разделенных нулевым символом (его нет в тексте названий и описаний) """
+
+    return hashlib.sha256('\x00'.join(str(value) for value in values).encode()).hexdigest()
+
+
+class ContentHashField(models.CharField):
+    """
+    Поле с хешем содержимого других полей модели (source_fields) для проверки уникальности по индексу.
+    Значение считается при каждом сохранении, в том числе в bulk_create - так же, как auto_now у даты
+    """
+
+    def __init__(self, *args, source_fields=(), **kwargs):
+        self.source_fields = tuple(source_fields)
+        kwargs['max_length'] = 64
+        kwargs.setdefault('editable', False)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        del kwargs['max_length']
+        kwargs['source_fields'] = self.source_fields
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        value = get_content_hash(*(getattr(model_instance, field) for field in self.source_fields))
+        setattr(model_instance, self.attname, value)
+        return value
@@ -0,0 +1,26 @@
+import django_filters
+
+from education.models import Payments, PaymentsDailyRollup
+
+
+class PaymentsFilter(django_filters.FilterSet):
+    """
+    Фильтр платежей по курсу, уроку, владельцу, способу оплаты
+    и диапазону дат (?payment_date_after=...&payment_date_before=...)
+    """
+
+    payment_date = django_filters.IsoDateTimeFromToRangeFilter()
+
+    class Meta:
+        model = Payments
+        fields = ('course', 'lesson', 'owner', 'payment_method', 'payment_date',)
+
+
+class PaymentsRollupFilter(django_filters.FilterSet):
+    """ Фильтр дневных итогов выручки по курсу, уроку, способу оплаты и диапазону дней (?day_after=...&day_before=...) """
+
+    day = django_filters.DateFromToRangeFilter()
+
+    class Meta:
+        model = PaymentsDailyRollup
+        fields = ('course', 'lesson', 'payment_method', 'day',)
@@ -0,0 +1,128 @@
+import json
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from education import metrics
+from education.fields import get_content_hash
+from education.models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+# Заголовки ответа, которые сохраняются вместе с телом и повторяются в ответе на повтор запроса
+REPLAYED_HEADERS = ('Location', 'Preference-Applied')
+
+
+def get_request_hash(request):
+    """ Хеш метода, адреса и тела запроса """
+
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return get_content_hash(request.method, request.path, body)
+
+
+def replay_response(record):
+    """ Сохраненный ответ на первый запрос с этим ключом """
+
+    metrics.incr('idempotency.replayed')
+    response = Response(record.response_body, status=record.response_status, headers=record.response_headers)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+class IdempotentCreateMixin:
+    """
+    Миксин для CreateAPIView - поддержка заголовка Idempotency-Key. Ключ вставляется в таблицу с уникальным
+    индексом (пользователь, ключ) в одной транзакции с созданием объекта, обращения к внешним сервисам
+    (finalize_create) выполняются после ее фиксации, затем сохраняется ответ. Параллельный повтор ждет,
+    пока первый запрос не сохранит ответ, и получает его. Если первый запрос упал, ключ освобождается,
+    а если процесс первого запроса завершился аварийно, повтор занимает ключ после IDEMPOTENCY_LEASE
+    """
+
+    def create(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            serializer = self.get_serializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            self.perform_create(serializer)
+            return self.finalize_create(serializer)
+        if not key or len(key) > IdempotencyKey._meta.get_field('key').max_length:
+            raise ValidationError({IDEMPOTENCY_HEADER: 'Укажите ключ длиной от 1 до 255 символов'})
+
+        request_hash = get_request_hash(request)
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT
+        while True:
+            record = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+            if record is not None:
+                if record.request_hash != request_hash:
+                    metrics.incr('idempotency.mismatch')
+                    return Response(
+                        {'detail': f'Ключ {IDEMPOTENCY_HEADER} уже использован для запроса с другими данными'},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    )
+                if record.response_status is not None:
+                    return replay_response(record)
+                # Ответ не сохранен дольше аренды ключа - первый запрос уже не завершится, запрос выполняется заново.
+                # Запись удаляется по id только без ответа: из параллельных повторов ключ займет один
+                if record.created_at < timezone.now() - settings.IDEMPOTENCY_LEASE:
+                    if IdempotencyKey.objects.filter(pk=record.pk, response_status__isnull=True).delete()[0]:
+                        metrics.incr('idempotency.lease_expired')
+                    continue
+                # Первый запрос с этим ключом еще выполняется - ждем его ответа
+                if time.monotonic() >= deadline:
+                    metrics.incr('idempotency.conflict')
+                    return Response({'detail': f'Запрос с этим ключом {IDEMPOTENCY_HEADER} еще выполняется'},
+                                    status=status.HTTP_409_CONFLICT)
+                time.sleep(settings.IDEMPOTENCY_POLL_INTERVAL)
+                continue
+
+            try:
+                with transaction.atomic():
+                    # Параллельный запрос с тем же ключом ждет на уникальном индексе до фиксации транзакции
+                    record = IdempotencyKey.objects.create(user=request.user, key=key, request_hash=request_hash)
+                    serializer = self.get_serializer(data=request.data)
+                    serializer.is_valid(raise_exception=True)
+                    self.perform_create(serializer)
+            except IntegrityError as error:
+                if 'idempotency_user_key_unique' not in str(error):
+                    raise
+                # Ключ успел занять параллельный запрос - читаем его запись заново
+                continue
+            break
+
+        try:
+            response = self.finalize_create(serializer)
+        except Exception:
+            # Ключ освобождается: повтор запроса выполнится заново
+            record.delete()
+            raise
+        if not status.is_success(response.status_code):
+            record.delete()
+            return response
+
+        # Обновление по id без ошибки, если ключ уже занял повтор после истечения аренды
+        IdempotencyKey.objects.filter(pk=record.pk).update(
+            response_status=response.status_code,
+            response_body=json.loads(JSONRenderer().render(response.data)),
+            response_headers={name: response[name] for name in REPLAYED_HEADERS if response.has_header(name)},
+        )
+        return response
+
+    def finalize_create(self, serializer):
+        """ Ответ на создание объекта, вызывается после фиксации транзакции """
+
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+
+def purge_idempotency_keys():
+    """ Удаление ключей идемпотентности старше IDEMPOTENCY_KEY_TTL """
+
+    deleted, _ = IdempotencyKey.objects.filter(
+        created_at__lt=timezone.now() - settings.IDEMPOTENCY_KEY_TTL
+    ).delete()
+    return deleted
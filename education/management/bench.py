@@ -0,0 +1,18 @@
+from django.core.management import CommandError
+from django.db import connection
+
+
+def add_database_argument(parser):
+    """ Обязательный параметр --database: замер пишет в БД большие объемы данных """
+
+    parser.add_argument('--database', required=True,
+                        help='имя БД для замера (NAME из настроек), защита от запуска на рабочей БД')
+
+
+def check_bench_database(name):
+    """ Замер выполняется, только если явно указанное имя совпадает с БД из настроек """
+
+    configured = connection.settings_dict['NAME']
+    if name != configured:
+        raise CommandError(f'Замер выполняется в БД "{configured}" из настроек, а указана "{name}". '
+                           f'Запустите замер на отдельной БД и укажите ее имя в --database')
@@ -0,0 +1,145 @@
+import re
+
+from django.core.management import BaseCommand
+from django.db import connection, transaction
+
+from education.management.bench import add_database_argument, check_bench_database
+from education.models import Course, Lesson, Payments, Subscription
+from users.models import User
+
+# Модели, индексы и ограничения которых сравниваются
+INDEXED_MODELS = (Course, Lesson, Payments, Subscription)
+
+
+class Command(BaseCommand):
+    """
+    Класс для замера планов горячих запросов (EXPLAIN ANALYZE) с составными индексами и без них.
+    Данные создаются, а индексы удаляются внутри транзакции, которая откатывается в конце.
+    Удаление индексов держит ACCESS EXCLUSIVE блокировки таблиц до отката, поэтому замер выполняется
+    только на явно указанной отдельной БД (--database)
+    """
+
+    help = 'Планы и время горячих запросов к платежам, урокам, курсам и подпискам до и после индексов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200_000, help='количество платежей и уроков')
+        parser.add_argument('--owners', type=int, default=1000, help='количество пользователей')
+        parser.add_argument('--repeat', type=int, default=3, help='количество повторов, берется лучший')
+        parser.add_argument('--plans', help='файл для сохранения полных планов запросов')
+        add_database_argument(parser)
+
+    def handle(self, *args, **options):
+        check_bench_database(options['database'])
+        with transaction.atomic():
+            owner, course, lesson = self.seed(options['rows'], options['owners'])
+            queries = self.get_queries(owner, course, lesson)
+
+            after = self.explain_all(queries, options['repeat'])
+            self.drop_indexes()
+            before = self.explain_all(queries, options['repeat'])
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'{"запрос":<28}{"без индексов, мс":>18}{"с индексами, мс":>18}  план с индексами')
+        for name in queries:
+            self.stdout.write(
+                f'{name:<28}{before[name][0]:>18.2f}{after[name][0]:>18.2f}  {self.get_scan(after[name][1])}'
+            )
+
+        if options['plans']:
+            with open(options['plans'], 'w') as file:
+                for name in queries:
+                    file.write(f'== {name} (без индексов)\n{before[name][1]}\n\n')
+                    file.write(f'== {name} (с индексами)\n{after[name][1]}\n\n')
+            self.stdout.write(f'Планы сохранены в {options["plans"]}')
+
+    @staticmethod
+    def seed(rows, owners):
+        """ Пользователи, курсы, уроки, подписки и платежи, равномерно распределенные между пользователями """
+
+        users = User.objects.bulk_create(
+            User(email=f'bench-index-{number}@lms.local', first_name=f'Bench {number}') for number in range(owners)
+        )
+        courses = Course.objects.bulk_create(
+            Course(name=f'Course {number}', description='Bench', owner=users[number % owners])
+            for number in range(owners)
+        )
+        lessons = Lesson.objects.bulk_create(
+            Lesson(name=f'Lesson {number}', description='Bench', course=courses[number % owners],
+                   owner=users[number % owners])
+            for number in range(rows)
+        )
+        Subscription.objects.bulk_create(
+            Subscription(user=user, course=courses[(number + 1) % owners], is_subscribed=True)
+            for number, user in enumerate(users)
+        )
+        Payments.objects.bulk_create(
+            (
+                Payments(
+                    course=courses[number % owners] if number % 2 else None,
+                    lesson=None if number % 2 else lessons[number],
+                    amount=number % 1000,
+                    payment_method='cash' if number % 3 else 'transfer',
+                    owner=users[number % owners],
+                )
+                for number in range(rows)
+            ),
+            batch_size=10_000,
+        )
+        with connection.cursor() as cursor:
+            # Отложенные проверки внешних ключей выполняем сразу, иначе удалить индексы в этой транзакции нельзя
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            for model in INDEXED_MODELS:
+                cursor.execute(f'ANALYZE {model._meta.db_table}')
+        return users[0], courses[1], lessons[0]
+
+    @staticmethod
+    def get_queries(owner, course, lesson):
+        """ Горячие запросы представлений: фильтр и сортировка первой страницы списка """
+
+        payments = Payments.objects.order_by('payment_date', 'id')
+        return {
+            'payments': payments[:100],
+            'payments?owner': payments.filter(owner=owner)[:100],
+            'payments?course': payments.filter(course=course)[:100],
+            'payments?lesson': payments.filter(lesson=lesson)[:100],
+            'payments?payment_method': payments.filter(payment_method='transfer')[:100],
+            'lessons?owner': Lesson.objects.filter(owner=owner).order_by('id')[:100],
+            'lessons?course': Lesson.objects.filter(course=course).order_by('id')[:100],
+            'courses?owner': Course.objects.filter(owner=owner).order_by('id')[:100],
+            'subscription(user, course)': Subscription.objects.filter(user=owner, course=course),
+        }
+
+    @staticmethod
+    def explain_all(queries, repeat):
+        """ Лучшее время выполнения и план каждого запроса """
+
+        results = {}
+        for name, queryset in queries.items():
+            plans = [queryset.explain(analyze=True) for _ in range(repeat)]
+            timings = [float(re.search(r'Execution Time: ([\d.]+) ms', plan).group(1)) for plan in plans]
+            results[name] = min(timings), plans[timings.index(min(timings))]
+        return results
+
+    @staticmethod
+    def drop_indexes():
+        """ Удаление составных индексов и ограничений уникальности (откатится вместе с транзакцией) """
+
+        with connection.schema_editor(atomic=False) as schema_editor:
+            for model in INDEXED_MODELS:
+                for index in model._meta.indexes:
+                    schema_editor.remove_index(model, index)
+                for constraint in model._meta.constraints:
+                    schema_editor.remove_constraint(model, constraint)
+        with connection.cursor() as cursor:
+            for model in INDEXED_MODELS:
+                cursor.execute(f'ANALYZE {model._meta.db_table}')
+
+    @staticmethod
+    def get_scan(plan):
+        """ Первый узел плана со способом чтения таблицы """
+
+        for line in plan.splitlines():
+            if 'Scan' in line:
+                return line.strip().lstrip('-> ').split('  (')[0]
+        return plan.splitlines()[0]
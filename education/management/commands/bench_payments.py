@@ -0,0 +1,115 @@
+import time
+import tracemalloc
+
+from django.core.management import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from education.management.bench import add_database_argument, check_bench_database
+from education.models import Course, Lesson, Payments
+from users.models import User, UserRoles
+
+BENCH_EMAIL = 'bench-moderator@lms.local'
+
+
+class Command(BaseCommand):
+    """
+    Класс для замера списка платежей на большой таблице:
+    количество запросов, пиковая память и время ответа на разных глубинах страниц.
+    Работает только с явно указанной БД (--database), созданные данные удаляются после замера
+    """
+
+    help = 'Замер списка платежей (payments/) на большой таблице платежей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='размер таблицы платежей')
+        parser.add_argument('--batch', type=int, default=10_000, help='размер пачки при заполнении таблицы')
+        parser.add_argument('--per-page', type=int, default=100, help='размер страницы')
+        add_database_argument(parser)
+
+    def handle(self, *args, **options):
+        check_bench_database(options['database'])
+        moderator, _ = User.objects.get_or_create(
+            email=BENCH_EMAIL,
+            defaults={'first_name': 'Bench', 'role': UserRoles.MODERATOR},
+        )
+        course, _ = Course.objects.get_or_create(name='Bench course', description='Bench', owner=moderator)
+        lesson, _ = Lesson.objects.get_or_create(course=course, name='Bench lesson', description='Bench',
+                                                 owner=moderator)
+
+        try:
+            self.seed(options['rows'], options['batch'], course, lesson, moderator)
+            self.measure_all(moderator, options['per_page'])
+        finally:
+            self.cleanup(moderator)
+
+    def measure_all(self, moderator, per_page):
+        """ Замер страниц в начале, середине и конце таблицы и курсорного режима """
+
+        client = APIClient()
+        client.force_authenticate(moderator)
+        url = reverse('education:payments_list')
+        last_page = max(Payments.objects.count() // per_page, 1)
+
+        self.stdout.write(f'{"запрос":<45}{"запросов":>10}{"память, КБ":>14}{"время, мс":>12}')
+        for page in (1, last_page // 2 or 1, last_page):
+            self.measure(client, f'{url}?per_page={per_page}&page={page}')
+
+        # Курсорный режим: первая страница и переход к следующей
+        response = self.measure(client, f'{url}?per_page={per_page}&cursor=')
+        if response.data.get('next'):
+            self.measure(client, response.data['next'])
+
+    def cleanup(self, moderator):
+        """
+        Удаление созданных платежей одним DELETE без загрузки строк и сигналов (их может быть миллион),
+        затем пользователя замера вместе с его курсом и уроком
+        """
+
+        table = connection.ops.quote_name(Payments._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {table} WHERE owner_id = %s', [moderator.pk])
+            deleted = cursor.rowcount
+        Course.objects.filter(owner=moderator).delete()
+        moderator.delete()
+        self.stdout.write(f'Удалено платежей замера: {deleted}')
+
+    def seed(self, rows, batch, course, lesson, owner):
+        """ Заполнение таблицы платежей до нужного размера пачками через bulk_create """
+
+        missing = rows - Payments.objects.count()
+        while missing > 0:
+            size = min(batch, missing)
+            Payments.objects.bulk_create(
+                Payments(
+                    course=course if number % 2 else None,
+                    lesson=None if number % 2 else lesson,
+                    amount=number % 1000,
+                    payment_method='cash' if number % 3 else 'transfer',
+                    owner=owner,
+                )
+                for number in range(size)
+            )
+            missing -= size
+            self.stdout.write(f'Осталось создать платежей: {missing}')
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {Payments._meta.db_table}')
+
+    def measure(self, client, url):
+        """ Один запрос списка с замером количества запросов к БД, пиковой памяти и времени """
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(url)
+            response.render()
+        elapsed = (time.perf_counter() - started) * 1000
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        label = url.split('?', 1)[-1][:44]
+        self.stdout.write(f'{label:<45}{len(context):>10}{peak // 1024:>14}{elapsed:>12.1f}')
+        return response
@@ -0,0 +1,93 @@
+import time
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from education.compiled_serializers import compile_serializer
+from education.management.bench import add_database_argument, check_bench_database
+from education.models import Course, Lesson, Payments
+from education.serializers import LessonSerializer, PaymentsSerializer
+from users.models import User
+from users.serializers import PublicUserSerializer
+
+
+class Command(BaseCommand):
+    """
+    Класс для микро-замера скорости сериализации списков (строк в секунду):
+    ModelSerializer по моделям против CompiledSerializer по строкам .values().
+    Строки создаются в транзакции, которая откатывается в конце, но до отката держат блокировки и раздувают
+    таблицы, поэтому замер выполняется только на явно указанной отдельной БД (--database)
+    """
+
+    help = 'Сравнение скорости ModelSerializer и CompiledSerializer на списках уроков, платежей и пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help='количество строк каждой модели')
+        parser.add_argument('--repeat', type=int, default=3, help='количество повторов, берется лучший')
+        add_database_argument(parser)
+
+    def handle(self, *args, **options):
+        check_bench_database(options['database'])
+        rows, repeat = options['rows'], options['repeat']
+        context = {'request': Request(APIRequestFactory().get('/'))}
+
+        # Данные для замера создаются в транзакции, которая откатывается в конце
+        with transaction.atomic():
+            self.seed(rows)
+            cases = (
+                ('lessons', LessonSerializer, Lesson.objects.select_related('course').order_by('pk')),
+                ('payments', PaymentsSerializer,
+                 Payments.objects.select_related('course', 'lesson', 'owner').order_by('pk')),
+                ('users', PublicUserSerializer, User.objects.order_by('pk')),
+            )
+
+            self.stdout.write(f'{"список":<12}{"ModelSerializer":>20}{"Compiled":>20}{"ускорение":>12}')
+            for name, serializer_class, queryset in cases:
+                queryset = queryset[:rows]
+                model_rate = self.measure(
+                    repeat, rows,
+                    lambda: serializer_class(queryset.all(), many=True, context=context).data
+                )
+                compiled = compile_serializer(serializer_class(context=context))
+                compiled_rate = self.measure(
+                    repeat, rows,
+                    lambda: [compiled.to_representation(row) for row in queryset.values(*compiled.lookups)]
+                )
+                self.stdout.write(
+                    f'{name:<12}{model_rate:>16.0f} r/s{compiled_rate:>16.0f} r/s{compiled_rate / model_rate:>11.1f}x'
+                )
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def seed(rows):
+        """ Создание строк для замера """
+
+        owner = User.objects.create(email='bench-serializers@lms.local', first_name='Bench')
+        course = Course.objects.create(name='Bench serializers', description='Bench', owner=owner)
+        lessons = Lesson.objects.bulk_create(
+            Lesson(course=course, name=f'Lesson {number}', description='Bench', owner=owner,
+                   preview='lessons/bench.png', video_url='https://youtube.com')
+            for number in range(rows)
+        )
+        Payments.objects.bulk_create(
+            Payments(course=course, lesson=lessons[number], amount=number, owner=owner)
+            for number in range(rows)
+        )
+        User.objects.bulk_create(
+            User(email=f'bench-{number}@lms.local', first_name=f'User {number}')
+            for number in range(rows)
+        )
+
+    @staticmethod
+    def measure(repeat, rows, serialize):
+        """ Лучшая скорость из нескольких повторов, вместе с чтением строк из БД """
+
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            serialize()
+            timings.append(time.perf_counter() - started)
+        return rows / min(timings)
@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+from django.core.management import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from education.email_sender import send_mail_chunk, send_mail_task
+
+
+class CountingHandler:
+    """ Обработчик локального SMTP-сервера: считает письма и имитирует задержку установки соединения """
+
+    def __init__(self, handshake_delay):
+        self.handshake_delay = handshake_delay
+        self.received = 0
+        self.connections = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        # Приветствие отправляется один раз на соединение - здесь имитируем TLS и авторизацию
+        self.connections += 1
+        session.host_name = hostname
+        await asyncio.sleep(self.handshake_delay)
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received += 1
+        return '250 Message accepted for delivery'
+
+
+class Command(BaseCommand):
+    """
+    Класс для замера скорости рассылки (писем в секунду) на локальном SMTP-сервере aiosmtpd:
+    отдельное соединение на каждое письмо против пачек через одно соединение
+    """
+
+    help = 'Сравнение скорости рассылки по одному письму и пачками (нужен пакет aiosmtpd)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000, help='количество писем')
+        parser.add_argument('--chunk', type=int, default=100, help='количество писем в пачке')
+        parser.add_argument('--handshake-ms', type=float, default=20,
+                            help='задержка установки соединения (TLS и авторизация), мс')
+        parser.add_argument('--port', type=int, default=8025, help='порт локального SMTP-сервера')
+
+    def handle(self, *args, **options):
+        try:
+            from aiosmtpd.controller import Controller
+        except ImportError:
+            raise CommandError('Для замера нужен локальный SMTP-сервер: pip install aiosmtpd')
+
+        handler = CountingHandler(options['handshake_ms'] / 1000)
+        controller = Controller(handler, hostname='127.0.0.1', port=options['port'])
+        controller.start()
+
+        messages, chunk = options['messages'], options['chunk']
+        items = [[f'subscriber-{number}@lms.local', f'Сообщение {number}'] for number in range(messages)]
+        email_settings = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1', EMAIL_PORT=options['port'], EMAIL_USE_SSL=False, EMAIL_USE_TLS=False,
+            EMAIL_HOST_USER='bench@lms.local', EMAIL_HOST_PASSWORD='',
+        )
+
+        try:
+            with email_settings:
+                self.stdout.write(f'{"способ":<24}{"писем":>8}{"соединений":>12}{"писем/с":>10}')
+                self.measure('по одному письму', handler, messages, lambda: [
+                    send_mail_task('Bench', message, [email]) for email, message in items
+                ])
+                self.measure(f'пачками по {chunk}', handler, messages, lambda: [
+                    send_mail_chunk('Bench', items[start:start + chunk]) for start in range(0, messages, chunk)
+                ])
+        finally:
+            controller.stop()
+
+    def measure(self, name, handler, messages, send):
+        """ Скорость одного способа рассылки и количество открытых соединений """
+
+        handler.received = handler.connections = 0
+        started = time.perf_counter()
+        send()
+        elapsed = time.perf_counter() - started
+
+        if handler.received != messages:
+            raise CommandError(f'Сервер получил {handler.received} писем из {messages}')
+        self.stdout.write(f'{name:<24}{messages:>8}{handler.connections:>12}{messages / elapsed:>10.0f}')
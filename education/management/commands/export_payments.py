@@ -0,0 +1,46 @@
+from django.core.management import BaseCommand, CommandError
+
+from education.exports import EXPORT_FORMATS, iter_export
+from education.filters import PaymentsFilter
+from education.models import Payments
+from education.serializers import PaymentsSerializer
+
+
+class Command(BaseCommand):
+    """ Класс для потоковой выгрузки платежей в файл NDJSON или CSV с теми же фильтрами, что и в API """
+
+    help = 'Выгрузка платежей в NDJSON или CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='ndjson', help='формат выгрузки')
+        parser.add_argument('--output', help='файл для выгрузки, по умолчанию вывод в консоль')
+        parser.add_argument('--course', help='id курса')
+        parser.add_argument('--lesson', help='id урока')
+        parser.add_argument('--owner', help='id владельца платежа')
+        parser.add_argument('--payment-method', help='способ оплаты')
+        parser.add_argument('--date-after', help='платежи начиная с даты (ISO 8601)')
+        parser.add_argument('--date-before', help='платежи до даты (ISO 8601)')
+
+    def handle(self, *args, **options):
+        data = {
+            'course': options['course'],
+            'lesson': options['lesson'],
+            'owner': options['owner'],
+            'payment_method': options['payment_method'],
+            'payment_date_after': options['date_after'],
+            'payment_date_before': options['date_before'],
+        }
+        filterset = PaymentsFilter(
+            data={key: value for key, value in data.items() if value is not None},
+            queryset=Payments.objects.all()
+        )
+        if not filterset.is_valid():
+            raise CommandError(filterset.errors.as_text())
+
+        chunks = iter_export(filterset.qs.order_by('id'), PaymentsSerializer(), options['format'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as file:
+                file.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
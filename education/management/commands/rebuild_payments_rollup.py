@@ -0,0 +1,17 @@
+from django.core.management import BaseCommand
+
+from education.rollups import PAYMENTS_ROLLUP_BATCH_SIZE, rebuild_payments_rollup
+
+
+class Command(BaseCommand):
+    """ Класс для полного пересчета дневных итогов выручки по платежам """
+
+    help = 'Пересчет дневных итогов выручки с нуля по всем платежам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=PAYMENTS_ROLLUP_BATCH_SIZE,
+                            help='количество платежей в одной транзакции')
+
+    def handle(self, *args, **options):
+        processed = rebuild_payments_rollup(options['batch'])
+        self.stdout.write(self.style.SUCCESS(f'Итоги пересчитаны, обработано платежей: {processed}'))
@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from education.webhooks import reconcile_payments
+
+
+class Command(BaseCommand):
+    """ Класс для сверки статусов платежей с сессиями оплаты Stripe (восстановление пропущенных событий) """
+
+    help = 'Обновление статусов платежей по сессиям оплаты Stripe за последние дни'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=3, help='за сколько последних дней сверять сессии оплаты')
+
+    def handle(self, *args, **options):
+        sessions, updated = reconcile_payments(timezone.now() - timedelta(days=options['days']))
+        self.stdout.write(self.style.SUCCESS(f'Проверено сессий оплаты: {sessions}, обновлено платежей: {updated}'))
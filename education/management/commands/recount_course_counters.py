@@ -0,0 +1,21 @@
+from django.core.management import BaseCommand
+
+from education.counters import recount_course_counters
+from education.models import Course
+
+
+class Command(BaseCommand):
+    """ Класс для полного пересчета счетчиков курсов (уроки, подписчики, выручка) """
+
+    help = 'Пересчет денормализованных счетчиков курсов для исправления расхождений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course', type=int, action='append', help='id курса (можно указать несколько)')
+
+    def handle(self, *args, **options):
+        queryset = Course.objects.all()
+        if options['course']:
+            queryset = queryset.filter(pk__in=options['course'])
+
+        updated = recount_course_counters(queryset)
+        self.stdout.write(f'Пересчитаны счетчики курсов: {updated}')
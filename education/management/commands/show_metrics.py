@@ -0,0 +1,28 @@
+from django.core.management import BaseCommand
+
+from education.metrics import get_metrics, reset_metrics
+
+
+class Command(BaseCommand):
+    """ Класс для вывода счетчиков метрик (попадания в кеш, отправленные письма и т.д.) """
+
+    help = 'Вывод накопленных метрик сервиса'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='сбросить метрики после вывода')
+
+    def handle(self, *args, **options):
+        collected = get_metrics()
+        for name, value in collected.items():
+            self.stdout.write(f'{name}: {value}')
+
+        # Для счетчиков кеша выводим долю попаданий, чтобы подбирать время жизни кеша
+        for name in collected:
+            if name.endswith('.hit'):
+                prefix = name[:-len('.hit')]
+                total = collected[name] + collected.get(f'{prefix}.miss', 0)
+                if total:
+                    self.stdout.write(f'{prefix}.hit_ratio: {collected[name] / total:.2%}')
+
+        if options['reset']:
+            reset_metrics()
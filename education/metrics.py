@@ -0,0 +1,51 @@
+from django.core.cache import cache
+
+METRICS_KEY_PREFIX = 'metrics:'
+METRICS_INDEX_KEY = 'metrics:__names__'
+
+
+def incr(name, value=1):
+    """ Увеличение счетчика метрики, хранится в общем кеше, чтобы его видели все процессы """
+
+    key = f'{METRICS_KEY_PREFIX}{name}'
+    if cache.add(key, value, timeout=None):
+        _register(name)
+        return value
+    try:
+        return cache.incr(key, value)
+    except ValueError:
+        # Ключ успел пропасть из кеша между add и incr
+        cache.set(key, value, timeout=None)
+        return value
+
+
+def set_gauge(name, value):
+    """ Запись текущего значения метрики (например, отставания очереди) """
+
+    key = f'{METRICS_KEY_PREFIX}{name}'
+    if cache.get(key) is None:
+        _register(name)
+    cache.set(key, value, timeout=None)
+
+
+def get_metrics():
+    """ Получение всех записанных метрик в виде словаря {имя: значение} """
+
+    names = cache.get(METRICS_INDEX_KEY, [])
+    values = cache.get_many([f'{METRICS_KEY_PREFIX}{name}' for name in names])
+    return {name: values.get(f'{METRICS_KEY_PREFIX}{name}', 0) for name in sorted(names)}
+
+
+def reset_metrics():
+    """ Сброс всех метрик """
+
+    names = cache.get(METRICS_INDEX_KEY, [])
+    cache.delete_many([f'{METRICS_KEY_PREFIX}{name}' for name in names] + [METRICS_INDEX_KEY])
+
+
+def _register(name):
+    """ Добавление имени метрики в список, по которому метрики выводятся командой show_metrics """
+
+    names = cache.get(METRICS_INDEX_KEY, [])
+    if name not in names:
+        cache.set(METRICS_INDEX_KEY, [*names, name], timeout=None)
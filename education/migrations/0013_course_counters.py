@@ -0,0 +1,58 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:42
+
+from django.db import migrations, models
+from django.db.models import Count, F, Func, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_course_counters(apps, schema_editor):
+    """ Первичное заполнение счетчиков курсов по существующим урокам, подпискам и платежам """
+
+    Course = apps.get_model('education', 'Course')
+    Lesson = apps.get_model('education', 'Lesson')
+    Payments = apps.get_model('education', 'Payments')
+    Subscription = apps.get_model('education', 'Subscription')
+
+    lessons = Lesson.objects.filter(course=OuterRef('pk')).order_by().values('course').annotate(
+        total=Count('pk')
+    ).values('total')
+    subscribers = Subscription.objects.filter(course=OuterRef('pk'), is_subscribed=True).order_by().values(
+        'course'
+    ).annotate(total=Count('pk')).values('total')
+    revenue = Payments.objects.filter(
+        Q(course=OuterRef('pk')) | Q(course__isnull=True, lesson__course=OuterRef('pk'))
+    ).order_by().annotate(
+        total=Func(F('amount'), function='SUM', output_field=IntegerField())
+    ).values('total')
+
+    Course.objects.update(
+        lessons_count=Coalesce(Subquery(lessons), 0),
+        subscribers_count=Coalesce(Subquery(subscribers), 0),
+        revenue_total=Coalesce(Subquery(revenue), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('education', '0012_alter_payments_amount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='lessons_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='количество уроков'),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='revenue_total',
+            field=models.BigIntegerField(default=0, verbose_name='сумма оплат'),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='subscribers_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='количество подписчиков'),
+        ),
+        migrations.RunPython(fill_course_counters, migrations.RunPython.noop),
+    ]
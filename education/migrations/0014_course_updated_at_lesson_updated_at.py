@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:10
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('education', '0013_course_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now,
+                                       verbose_name='дата изменения'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now,
+                                       verbose_name='дата изменения'),
+            preserve_default=False,
+        ),
+    ]
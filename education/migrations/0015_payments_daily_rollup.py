@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('education', '0014_course_updated_at_lesson_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='название')),
+                ('processed_until', models.DateTimeField(blank=True, null=True, verbose_name='обработано до')),
+            ],
+            options={
+                'verbose_name': 'отметка обработки',
+                'verbose_name_plural': 'отметки обработки',
+            },
+        ),
+        migrations.CreateModel(
+            name='PaymentsDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='день')),
+                ('payment_method', models.CharField(choices=[('cash', 'Наличные'), ('transfer', 'Перевод на счет')], max_length=20, verbose_name='способ оплаты')),
+                ('payments_count', models.PositiveIntegerField(default=0, verbose_name='количество платежей')),
+                ('amount_total', models.BigIntegerField(default=0, verbose_name='сумма платежей')),
+                ('course', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='education.course', verbose_name='курс')),
+                ('lesson', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='education.lesson', verbose_name='урок')),
+            ],
+            options={
+                'verbose_name': 'сумма платежей за день',
+                'verbose_name_plural': 'суммы платежей за день',
+                'indexes': [models.Index(fields=['day', 'course'], name='rollup_day_course_idx')],
+            },
+        ),
+    ]
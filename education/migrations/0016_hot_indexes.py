@@ -0,0 +1,78 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:50
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicate_subscriptions(apps, schema_editor):
+    """
+    Удаление повторных подписок пользователя на один курс перед добавлением ограничения уникальности:
+    остается последняя подписка, активная - если такая есть. Затем пересчитываются подписчики затронутых курсов
+    """
+
+    Course = apps.get_model('education', 'Course')
+    Subscription = apps.get_model('education', 'Subscription')
+
+    duplicates = Subscription.objects.filter(course__isnull=False).values('user', 'course').annotate(
+        total=Count('pk')
+    ).filter(total__gt=1)
+
+    course_ids = set()
+    for duplicate in duplicates:
+        subscriptions = Subscription.objects.filter(user=duplicate['user'], course=duplicate['course'])
+        keep = subscriptions.order_by('-is_subscribed', '-pk').values_list('pk', flat=True).first()
+        subscriptions.exclude(pk=keep).delete()
+        course_ids.add(duplicate['course'])
+
+    subscribers = Subscription.objects.filter(course=OuterRef('pk'), is_subscribed=True).order_by().values(
+        'course'
+    ).annotate(total=Count('pk')).values('total')
+    Course.objects.filter(pk__in=course_ids).update(subscribers_count=Coalesce(Subquery(subscribers), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('education', '0015_payments_daily_rollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['owner', 'id'], name='course_owner_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lesson',
+            index=models.Index(fields=['owner', 'id'], name='lesson_owner_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lesson',
+            index=models.Index(fields=['course', 'id'], name='lesson_course_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payments',
+            index=models.Index(fields=['payment_date', 'id'], name='payments_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payments',
+            index=models.Index(fields=['owner', 'payment_date', 'id'], name='payments_owner_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payments',
+            index=models.Index(fields=['course', 'payment_date', 'id'], name='payments_course_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payments',
+            index=models.Index(fields=['lesson', 'payment_date', 'id'], name='payments_lesson_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payments',
+            index=models.Index(fields=['payment_method', 'payment_date', 'id'], name='payments_method_date_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_subscriptions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='subscription',
+            constraint=models.UniqueConstraint(fields=('user', 'course'), name='subscription_user_course_unique'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:53
+
+from django.db import migrations
+import education.fields
+from education.fields import get_content_hash
+
+
+def fill_content_hash(apps, schema_editor):
+    """
+    Заполнение хеша названия и описания у существующих курсов и уроков.
+    У повторов с тем же названием и описанием хеш остается пустым, чтобы можно было создать уникальный индекс
+    """
+
+    for model_name in ('Course', 'Lesson'):
+        model = apps.get_model('education', model_name)
+        seen, changed = set(), []
+        for instance in model.objects.only('pk', 'name', 'description').order_by('pk').iterator(chunk_size=2000):
+            content_hash = get_content_hash(instance.name, instance.description)
+            if content_hash in seen:
+                continue
+            seen.add(content_hash)
+            instance.content_hash = content_hash
+            changed.append(instance)
+        model.objects.bulk_update(changed, ['content_hash'], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('education', '0016_hot_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='content_hash',
+            field=education.fields.ContentHashField(blank=True, editable=False, null=True, source_fields=('name', 'description'), verbose_name='хеш содержимого'),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='content_hash',
+            field=education.fields.ContentHashField(blank=True, editable=False, null=True, source_fields=('name', 'description'), verbose_name='хеш содержимого'),
+        ),
+        migrations.RunPython(fill_content_hash, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='course',
+            name='content_hash',
+            field=education.fields.ContentHashField(blank=True, editable=False, null=True, source_fields=('name', 'description'), unique=True, verbose_name='хеш содержимого'),
+        ),
+        migrations.AlterField(
+            model_name='lesson',
+            name='content_hash',
+            field=education.fields.ContentHashField(blank=True, editable=False, null=True, source_fields=('name', 'description'), unique=True, verbose_name='хеш содержимого'),
+        ),
+    ]
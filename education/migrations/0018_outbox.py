@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:01
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('education', '0017_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Outbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic', models.CharField(max_length=50, verbose_name='тип события')),
+                ('key', models.CharField(max_length=100, verbose_name='ключ объединения')),
+                ('payload', models.JSONField(default=dict, verbose_name='данные события')),
+                ('status', models.CharField(choices=[('pending', 'ожидает'), ('in_progress', 'в обработке'), ('done', 'обработано'), ('failed', 'ошибка')], default='pending', max_length=20, verbose_name='статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='количество попыток')),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='доступно с')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='последняя ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='дата создания')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='дата обработки')),
+            ],
+            options={
+                'verbose_name': 'исходящее событие',
+                'verbose_name_plural': 'исходящие события',
+                'indexes': [models.Index(condition=models.Q(('status__in', ['pending', 'in_progress'])), fields=['available_at'], name='outbox_due_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='outbox',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('topic', 'key'), name='outbox_pending_topic_key_unique'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('education', '0018_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscription',
+            name='delivery_mode',
+            field=models.CharField(choices=[('immediate', 'сразу'), ('digest', 'ежедневная сводка')], default='immediate', max_length=20, verbose_name='способ уведомления'),
+        ),
+        migrations.CreateModel(
+            name='CourseChangeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='дата изменения')),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='change_events', to='education.course', verbose_name='курс')),
+            ],
+            options={
+                'verbose_name': 'изменение курса',
+                'verbose_name_plural': 'изменения курсов',
+                'indexes': [models.Index(fields=['changed_at'], name='course_change_at_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('education', '0019_subscription_delivery_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='stripe_price_amount',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='сумма цены в Stripe'),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='stripe_price_id',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='id цены в Stripe'),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='stripe_product_id',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='id продукта в Stripe'),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='stripe_price_amount',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='сумма цены в Stripe'),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='stripe_price_id',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='id цены в Stripe'),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='stripe_product_id',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='id продукта в Stripe'),
+        ),
+    ]
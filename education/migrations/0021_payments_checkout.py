@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('education', '0020_stripe_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payments',
+            name='checkout_status',
+            field=models.CharField(blank=True, choices=[('pending', 'создается'), ('ready', 'готова'), ('failed', 'ошибка')], max_length=10, null=True, verbose_name='статус сессии оплаты'),
+        ),
+        migrations.AddField(
+            model_name='payments',
+            name='payment_url',
+            field=models.URLField(blank=True, max_length=1000, null=True, verbose_name='ссылка на оплату'),
+        ),
+        migrations.AddField(
+            model_name='payments',
+            name='stripe_session_id',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='id сессии оплаты в Stripe'),
+        ),
+    ]
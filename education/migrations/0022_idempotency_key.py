@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:14
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('education', '0021_payments_checkout'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, verbose_name='ключ идемпотентности')),
+                ('request_hash', models.CharField(max_length=64, verbose_name='хеш запроса')),
+                ('response_status', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='код ответа')),
+                ('response_body', models.JSONField(blank=True, null=True, verbose_name='тело ответа')),
+                ('response_headers', models.JSONField(default=dict, verbose_name='заголовки ответа')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='дата создания')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='пользователь')),
+            ],
+            options={
+                'verbose_name': 'ключ идемпотентности',
+                'verbose_name_plural': 'ключи идемпотентности',
+                'indexes': [models.Index(fields=['created_at'], name='idempotency_created_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='idempotencykey',
+            constraint=models.UniqueConstraint(fields=('user', 'key'), name='idempotency_user_key_unique'),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:17
+
+from django.db import migrations, models
+from django.db.models import F, Func, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+
+def recount_paid_revenue(apps, schema_editor):
+    """ Пересчет выручки курсов только по оплаченным платежам (раньше учитывались все попытки оплаты) """
+
+    Course = apps.get_model('education', 'Course')
+    Payments = apps.get_model('education', 'Payments')
+
+    revenue = Payments.objects.filter(
+        Q(course=OuterRef('pk')) | Q(course__isnull=True, lesson__course=OuterRef('pk')),
+        payment_status='paid',
+    ).order_by().annotate(
+        total=Func(F('amount'), function='SUM', output_field=IntegerField())
+    ).values('total')
+
+    Course.objects.update(revenue_total=Coalesce(Subquery(revenue), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('education', '0022_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True, verbose_name='id события в Stripe')),
+                ('type', models.CharField(max_length=100, verbose_name='тип события')),
+                ('payload', models.JSONField(verbose_name='данные события')),
+                ('received_at', models.DateTimeField(auto_now_add=True, verbose_name='дата получения')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='дата обработки')),
+            ],
+            options={
+                'verbose_name': 'событие Stripe',
+                'verbose_name_plural': 'события Stripe',
+            },
+        ),
+        migrations.AddField(
+            model_name='payments',
+            name='paid_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='дата поступления оплаты'),
+        ),
+        migrations.AddField(
+            model_name='payments',
+            name='payment_status',
+            field=models.CharField(blank=True, choices=[('unpaid', 'не оплачен'), ('paid', 'оплачен'), ('failed', 'оплата не прошла'), ('expired', 'сессия оплаты истекла')], max_length=10, null=True, verbose_name='статус оплаты'),
+        ),
+        migrations.AddField(
+            model_name='payments',
+            name='status_changed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='дата изменения статуса оплаты'),
+        ),
+        migrations.AddIndex(
+            model_name='payments',
+            index=models.Index(fields=['stripe_session_id'], name='payments_session_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payments',
+            index=models.Index(condition=models.Q(('payment_status', 'paid')), fields=['status_changed_at'], name='payments_paid_changed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stripeevent',
+            index=models.Index(condition=models.Q(('processed_at__isnull', True)), fields=['received_at'], name='stripe_event_pending_idx'),
+        ),
+        migrations.RunPython(recount_paid_revenue, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:41
+
+from django.db import migrations
+
+from education.fields import get_content_hash
+
+
+def rename_content_duplicates(apps, schema_editor):
+    """
+    Повторы курсов и уроков с тем же названием и описанием остались после 0017 без хеша, и изменить их было нельзя:
+    при сохранении хеш пересчитывается и совпадает с хешем первой записи. Повтор получает номер в скобках
+    после названия (первый свободный), и хеш заполняется
+    """
+
+    for model_name in ('Course', 'Lesson'):
+        model = apps.get_model('education', model_name)
+        max_length = model._meta.get_field('name').max_length
+        duplicates = list(model.objects.filter(content_hash__isnull=True).only('pk', 'name', 'description').order_by(
+            'pk'
+        ))
+        for instance in duplicates:
+            number = 1
+            while True:
+                number += 1
+                suffix = f' ({number})'
+                name = instance.name[:max_length - len(suffix)] + suffix
+                content_hash = get_content_hash(name, instance.description)
+                if not model.objects.filter(content_hash=content_hash).exists():
+                    break
+            model.objects.filter(pk=instance.pk).update(name=name, content_hash=content_hash)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('education', '0023_stripe_events'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_content_duplicates, migrations.RunPython.noop),
+    ]
@@ -2,6 +2,8 @@ from django.conf import settings
 from django.db import models
 from django.utils import timezone
 
+from education.fields import ContentHashField
+
 NULLABLE = {'blank': True, 'null': True}
 
 
@@ -16,6 +18,23 @@ class Course(models.Model):
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name='владелец курса',
                               **NULLABLE)
 
+    # Денормализованные счетчики, обновляются сигналами уроков, подписок и платежей (см. education/counters.py)
+    lessons_count = models.PositiveIntegerField(default=0, verbose_name='количество уроков')
+    subscribers_count = models.PositiveIntegerField(default=0, verbose_name='количество подписчиков')
+    revenue_total = models.BigIntegerField(default=0, verbose_name='сумма оплат')
+
+    # Обновляется и при изменении уроков, подписок и платежей курса (см. education/counters.py)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='дата изменения')
+
+    # Хеш названия и описания - уникальность курса проверяется по индексу, а не сравнением текстов
+    content_hash = ContentHashField(source_fields=('name', 'description'), unique=True, verbose_name='хеш содержимого',
+                                    **NULLABLE)
+
+    # Продукт и цена в Stripe создаются при первой оплате, новая цена - только при изменении amount
+    stripe_product_id = models.CharField(max_length=255, verbose_name='id продукта в Stripe', **NULLABLE)
+    stripe_price_id = models.CharField(max_length=255, verbose_name='id цены в Stripe', **NULLABLE)
+    stripe_price_amount = models.PositiveIntegerField(verbose_name='сумма цены в Stripe', **NULLABLE)
+
     def __str__(self):
         return f'{self.name}, {self.description}, {self.preview}'
 
@@ -24,6 +43,10 @@ class Course(models.Model):
 
         verbose_name = "курс"
         verbose_name_plural = "курсы"
+        indexes = [
+            # Курсы владельца в порядке id (список курсов и курсорная пагинация)
+            models.Index(fields=['owner', 'id'], name='course_owner_id_idx'),
+        ]
 
 
 class Lesson(models.Model):
@@ -39,6 +62,17 @@ class Lesson(models.Model):
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name='владелец урока',
                               **NULLABLE)
 
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='дата изменения')
+
+    # Хеш названия и описания - уникальность урока проверяется по индексу, а не сравнением текстов
+    content_hash = ContentHashField(source_fields=('name', 'description'), unique=True, verbose_name='хеш содержимого',
+                                    **NULLABLE)
+
+    # Продукт и цена в Stripe создаются при первой оплате, новая цена - только при изменении amount
+    stripe_product_id = models.CharField(max_length=255, verbose_name='id продукта в Stripe', **NULLABLE)
+    stripe_price_id = models.CharField(max_length=255, verbose_name='id цены в Stripe', **NULLABLE)
+    stripe_price_amount = models.PositiveIntegerField(verbose_name='сумма цены в Stripe', **NULLABLE)
+
     def __str__(self):
         return f'{self.name}, {self.description}, {self.preview}'
 
@@ -47,6 +81,11 @@ class Lesson(models.Model):
 
         verbose_name = "урок"
         verbose_name_plural = "уроки"
+        indexes = [
+            # Уроки владельца или курса в порядке id (список уроков и курсорная пагинация)
+            models.Index(fields=['owner', 'id'], name='lesson_owner_id_idx'),
+            models.Index(fields=['course', 'id'], name='lesson_course_id_idx'),
+        ]
 
 
 class Payments(models.Model):
@@ -57,6 +96,26 @@ class Payments(models.Model):
         ('transfer', 'Перевод на счет'),
     )
 
+    CHECKOUT_PENDING = 'pending'
+    CHECKOUT_READY = 'ready'
+    CHECKOUT_FAILED = 'failed'
+    CHECKOUT_STATUSES = (
+        (CHECKOUT_PENDING, 'создается'),
+        (CHECKOUT_READY, 'готова'),
+        (CHECKOUT_FAILED, 'ошибка'),
+    )
+
+    PAYMENT_UNPAID = 'unpaid'
+    PAYMENT_PAID = 'paid'
+    PAYMENT_FAILED = 'failed'
+    PAYMENT_EXPIRED = 'expired'
+    PAYMENT_STATUSES = (
+        (PAYMENT_UNPAID, 'не оплачен'),
+        (PAYMENT_PAID, 'оплачен'),
+        (PAYMENT_FAILED, 'оплата не прошла'),
+        (PAYMENT_EXPIRED, 'сессия оплаты истекла'),
+    )
+
     course = models.ForeignKey(Course, on_delete=models.CASCADE, **NULLABLE, related_name='payments')
     lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE, **NULLABLE, related_name='payments')
 
@@ -68,6 +127,18 @@ class Payments(models.Model):
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name='владелец платежа',
                               related_name='payment_user', **NULLABLE)
 
+    # Сессия оплаты Stripe, создается при запросе или задачей (см. education/checkout.py), пусто - оплата без Stripe
+    checkout_status = models.CharField(max_length=10, choices=CHECKOUT_STATUSES, verbose_name='статус сессии оплаты',
+                                       **NULLABLE)
+    payment_url = models.URLField(max_length=1000, verbose_name='ссылка на оплату', **NULLABLE)
+    stripe_session_id = models.CharField(max_length=255, verbose_name='id сессии оплаты в Stripe', **NULLABLE)
+    # Результат оплаты по событиям Stripe (см. education/webhooks.py), пусто - событий еще не было
+    payment_status = models.CharField(max_length=10, choices=PAYMENT_STATUSES, verbose_name='статус оплаты',
+                                      **NULLABLE)
+    paid_at = models.DateTimeField(verbose_name='дата поступления оплаты', **NULLABLE)
+    # Время записи статуса оплаты в БД (а не события Stripe) - по нему дневные итоги забирают новые оплаты
+    status_changed_at = models.DateTimeField(verbose_name='дата изменения статуса оплаты', **NULLABLE)
+
     def __str__(self):
         return f'{self.lesson if self.lesson else self.course} - {self.amount}'
 
@@ -76,15 +147,37 @@ class Payments(models.Model):
 
         verbose_name = 'платеж'
         verbose_name_plural = 'платежи'
+        indexes = [
+            # Фильтры списка платежей с сортировкой по умолчанию (payment_date, id)
+            models.Index(fields=['payment_date', 'id'], name='payments_date_id_idx'),
+            models.Index(fields=['owner', 'payment_date', 'id'], name='payments_owner_date_idx'),
+            models.Index(fields=['course', 'payment_date', 'id'], name='payments_course_date_idx'),
+            models.Index(fields=['lesson', 'payment_date', 'id'], name='payments_lesson_date_idx'),
+            models.Index(fields=['payment_method', 'payment_date', 'id'], name='payments_method_date_idx'),
+            # Поиск платежа по сессии оплаты из событий Stripe
+            models.Index(fields=['stripe_session_id'], name='payments_session_idx'),
+            # Оплаченные платежи в порядке записи статуса для дневных итогов
+            models.Index(fields=['status_changed_at'], condition=models.Q(payment_status='paid'),
+                         name='payments_paid_changed_idx'),
+        ]
 
 
 class Subscription(models.Model):
     """ Модель подписки пользователя на обновления курса """
 
+    DELIVERY_IMMEDIATE = 'immediate'
+    DELIVERY_DIGEST = 'digest'
+    DELIVERY_MODES = (
+        (DELIVERY_IMMEDIATE, 'сразу'),
+        (DELIVERY_DIGEST, 'ежедневная сводка'),
+    )
+
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
                              verbose_name="пользователь подписки", )
     course = models.ForeignKey(Course, on_delete=models.CASCADE, verbose_name='курс', **NULLABLE)
     is_subscribed = models.BooleanField(default=False, verbose_name='статус подписки')
+    delivery_mode = models.CharField(max_length=20, choices=DELIVERY_MODES, default=DELIVERY_IMMEDIATE,
+                                     verbose_name='способ уведомления')
 
     def __str__(self):
         return f"{self.user} - {self.course}"
@@ -92,3 +185,168 @@ class Subscription(models.Model):
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
+        constraints = [
+            # Одна подписка пользователя на курс, индекс ограничения используется для поиска подписки
+            models.UniqueConstraint(fields=['user', 'course'], name='subscription_user_course_unique'),
+        ]
+
+
+class CourseChangeEvent(models.Model):
+    """ Модель изменений курсов для ежедневной сводки подписчикам (обрабатывается задачей course_digest) """
+
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, verbose_name='курс', related_name='change_events')
+    changed_at = models.DateTimeField(default=timezone.now, verbose_name='дата изменения')
+
+    def __str__(self):
+        return f'{self.course_id} - {self.changed_at}'
+
+    class Meta:
+        verbose_name = 'изменение курса'
+        verbose_name_plural = 'изменения курсов'
+        indexes = [
+            # Изменения с прошлой сводки по времени (course_digest)
+            models.Index(fields=['changed_at'], name='course_change_at_idx'),
+        ]
+
+
+class Watermark(models.Model):
+    """ Отметка фоновой задачи - до какого времени данные уже обработаны """
+
+    name = models.CharField(max_length=50, unique=True, verbose_name='название')
+    processed_until = models.DateTimeField(verbose_name='обработано до', **NULLABLE)
+
+    def __str__(self):
+        return f'{self.name} - {self.processed_until}'
+
+    class Meta:
+        verbose_name = 'отметка обработки'
+        verbose_name_plural = 'отметки обработки'
+
+
+class PaymentsDailyRollup(models.Model):
+    """ Модель для сумм платежей за день по курсу, уроку и способу оплаты (ведется задачей payments_rollup) """
+
+    day = models.DateField(verbose_name='день')
+    # Для оплаты урока здесь курс, к которому относится урок
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, verbose_name='курс', related_name='+', **NULLABLE)
+    lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE, verbose_name='урок', related_name='+', **NULLABLE)
+    payment_method = models.CharField(max_length=20, choices=Payments.PAYMENT_METHODS, verbose_name='способ оплаты')
+
+    payments_count = models.PositiveIntegerField(default=0, verbose_name='количество платежей')
+    amount_total = models.BigIntegerField(default=0, verbose_name='сумма платежей')
+
+    def __str__(self):
+        return f'{self.day} - {self.amount_total}'
+
+    class Meta:
+        verbose_name = 'сумма платежей за день'
+        verbose_name_plural = 'суммы платежей за день'
+        indexes = [
+            models.Index(fields=['day', 'course'], name='rollup_day_course_idx'),
+        ]
+
+
+class Outbox(models.Model):
+    """
+    Модель исходящих событий: записываются в одной транзакции с изменением данных
+    и обрабатываются фоновым диспетчером (см. education/outbox.py)
+    """
+
+    STATUS_PENDING = 'pending'
+    STATUS_IN_PROGRESS = 'in_progress'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUSES = (
+        (STATUS_PENDING, 'ожидает'),
+        (STATUS_IN_PROGRESS, 'в обработке'),
+        (STATUS_DONE, 'обработано'),
+        (STATUS_FAILED, 'ошибка'),
+    )
+
+    topic = models.CharField(max_length=50, verbose_name='тип события')
+    # Ожидающие события с одинаковым типом и ключом объединяются в одно
+    key = models.CharField(max_length=100, verbose_name='ключ объединения')
+    payload = models.JSONField(default=dict, verbose_name='данные события')
+
+    status = models.CharField(max_length=20, choices=STATUSES, default=STATUS_PENDING, verbose_name='статус')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='количество попыток')
+    # Время, раньше которого событие не обрабатывается (окно объединения, повтор после ошибки, аренда)
+    available_at = models.DateTimeField(default=timezone.now, verbose_name='доступно с')
+    last_error = models.TextField(blank=True, default='', verbose_name='последняя ошибка')
+
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='дата создания')
+    processed_at = models.DateTimeField(verbose_name='дата обработки', **NULLABLE)
+
+    def __str__(self):
+        return f'{self.topic}:{self.key} - {self.status}'
+
+    class Meta:
+        verbose_name = 'исходящее событие'
+        verbose_name_plural = 'исходящие события'
+        indexes = [
+            # Выборка диспетчером событий, готовых к обработке
+            models.Index(fields=['available_at'], name='outbox_due_idx',
+                         condition=models.Q(status__in=['pending', 'in_progress'])),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['topic', 'key'], condition=models.Q(status='pending'),
+                                    name='outbox_pending_topic_key_unique'),
+        ]
+
+
+class IdempotencyKey(models.Model):
+    """
+    Модель ключей идемпотентности запросов (заголовок Idempotency-Key): ключ записывается в транзакции запроса
+    вместе с ответом, повтор запроса с тем же ключом получает сохраненный ответ (см. education/idempotency.py)
+    """
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name='пользователь')
+    key = models.CharField(max_length=255, verbose_name='ключ идемпотентности')
+    # Хеш тела запроса: тот же ключ с другими данными - ошибка клиента
+    request_hash = models.CharField(max_length=64, verbose_name='хеш запроса')
+
+    response_status = models.PositiveSmallIntegerField(verbose_name='код ответа', **NULLABLE)
+    response_body = models.JSONField(verbose_name='тело ответа', **NULLABLE)
+    response_headers = models.JSONField(default=dict, verbose_name='заголовки ответа')
+
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='дата создания')
+
+    def __str__(self):
+        return f'{self.user_id}:{self.key}'
+
+    class Meta:
+        verbose_name = 'ключ идемпотентности'
+        verbose_name_plural = 'ключи идемпотентности'
+        indexes = [
+            # Удаление устаревших ключей
+            models.Index(fields=['created_at'], name='idempotency_created_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_user_key_unique'),
+        ]
+
+
+class StripeEvent(models.Model):
+    """
+    Модель входящих событий Stripe (webhook): событие записывается как есть, один раз на id события,
+    и обрабатывается фоновой задачей пачками (см. education/webhooks.py)
+    """
+
+    event_id = models.CharField(max_length=255, unique=True, verbose_name='id события в Stripe')
+    type = models.CharField(max_length=100, verbose_name='тип события')
+    payload = models.JSONField(verbose_name='данные события')
+
+    received_at = models.DateTimeField(auto_now_add=True, verbose_name='дата получения')
+    processed_at = models.DateTimeField(verbose_name='дата обработки', **NULLABLE)
+
+    def __str__(self):
+        return f'{self.event_id} - {self.type}'
+
+    class Meta:
+        verbose_name = 'событие Stripe'
+        verbose_name_plural = 'события Stripe'
+        indexes = [
+            # Выборка необработанных событий
+            models.Index(fields=['received_at'], name='stripe_event_pending_idx',
+                         condition=models.Q(processed_at__isnull=True)),
+        ]
@@ -0,0 +1,20 @@
+from django.conf import settings
+
+from education.outbox import enqueue
+
+# Тип события outbox об изменении уроков курса, обработчик - в education/tasks.py
+COURSE_CHANGED = 'course_changed'
+
+
+def schedule_course_notification(lesson):
+    """
+    Уведомление подписчиков об изменении урока через outbox - событие пишется в транзакции изменения урока.
+    Событие обрабатывается не раньше чем через NOTIFY_WINDOW, а изменения уроков курса за это время
+    объединяются с ним - в рассылку входят все уроки курса, измененные с момента первого изменения
+    """
+
+    enqueue(
+        COURSE_CHANGED, lesson.course_id,
+        {'course_id': lesson.course_id, 'since': lesson.updated_at.isoformat()},
+        delay=settings.NOTIFY_WINDOW,
+    )
@@ -0,0 +1,136 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Min
+from django.utils import timezone
+
+from education import metrics
+from education.models import Outbox
+
+# Обработчики событий по типу, регистрируются декоратором handles
+OUTBOX_HANDLERS = {}
+
+
+def handles(topic):
+    """ Регистрация обработчика событий данного типа """
+
+    def register(handler):
+        OUTBOX_HANDLERS[topic] = handler
+        return handler
+
+    return register
+
+
+def enqueue(topic, key, payload, delay=0):
+    """
+    Запись события в той же транзакции, что и изменение данных.
+    Если событие с тем же типом и ключом еще ожидает обработки, новое с ним объединяется:
+    остаются данные и время обработки первого события
+    """
+
+    for attempt in range(2):
+        try:
+            # Точка сохранения: ошибка вставки не прерывает транзакцию, в которой изменялись данные
+            with transaction.atomic():
+                _, created = Outbox.objects.get_or_create(
+                    topic=topic, key=str(key), status=Outbox.STATUS_PENDING,
+                    defaults={'payload': payload, 'available_at': timezone.now() + timedelta(seconds=delay)},
+                )
+            break
+        except IntegrityError as error:
+            # Параллельный запрос вставил такое же событие, а диспетчер успел его захватить до повторного
+            # поиска в get_or_create - ожидающего события уже нет, повторяем поиск и вставку один раз
+            if attempt or 'outbox_pending_topic_key_unique' not in str(error):
+                raise
+    metrics.incr(f'outbox.{"enqueued" if created else "coalesced"}')
+    return created
+
+
+def claim_outbox(batch_size):
+    """
+    Захват пачки готовых событий: строки выбираются с SELECT ... FOR UPDATE SKIP LOCKED,
+    поэтому параллельные диспетчеры получают разные события. Захваченные события переводятся в обработку
+    с арендой OUTBOX_LEASE - если диспетчер упадет, после ее окончания событие захватит другой
+    """
+
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            Outbox.objects.select_for_update(skip_locked=True).filter(
+                status__in=(Outbox.STATUS_PENDING, Outbox.STATUS_IN_PROGRESS), available_at__lte=now
+            ).order_by('available_at')[:batch_size]
+        )
+        Outbox.objects.filter(pk__in=[event.pk for event in events]).update(
+            status=Outbox.STATUS_IN_PROGRESS,
+            attempts=F('attempts') + 1,
+            available_at=now + timedelta(seconds=settings.OUTBOX_LEASE),
+        )
+    for event in events:
+        event.attempts += 1
+    return events
+
+
+def dispatch_outbox(batch_size=None, max_batches=None):
+    """ Обработка готовых событий пачками, пока они есть (не больше max_batches пачек за запуск) """
+
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    max_batches = max_batches or settings.OUTBOX_MAX_BATCHES
+    # Отставание очереди - сколько ждет самое старое готовое событие
+    metrics.set_gauge('outbox.lag_seconds', round(get_outbox_lag(), 3))
+    started = time.perf_counter()
+    processed = 0
+
+    for _ in range(max_batches):
+        events = claim_outbox(batch_size)
+        if not events:
+            break
+
+        done = []
+        for event in events:
+            try:
+                OUTBOX_HANDLERS[event.topic](event.payload)
+            except Exception as error:
+                fail_event(event, error)
+            else:
+                done.append(event.pk)
+        Outbox.objects.filter(pk__in=done).update(status=Outbox.STATUS_DONE, processed_at=timezone.now())
+        metrics.incr('outbox.dispatched', len(done))
+        processed += len(events)
+
+    elapsed = time.perf_counter() - started
+    if processed:
+        metrics.set_gauge('outbox.throughput', round(processed / elapsed, 1))
+    return processed
+
+
+def fail_event(event, error):
+    """ Повтор события с экспоненциальной задержкой, после OUTBOX_MAX_ATTEMPTS попыток - ошибка """
+
+    if event.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        changes = {'status': Outbox.STATUS_FAILED}
+        metrics.incr('outbox.failed')
+    else:
+        delay = settings.OUTBOX_RETRY_DELAY * 2 ** (event.attempts - 1)
+        changes = {'available_at': timezone.now() + timedelta(seconds=delay)}
+        metrics.incr('outbox.retries')
+    Outbox.objects.filter(pk=event.pk).update(last_error=f'{type(error).__name__}: {error}', **changes)
+
+
+def get_outbox_lag():
+    """ Сколько секунд ждет самое старое готовое к обработке событие (0 - очередь пуста) """
+
+    oldest = Outbox.objects.filter(
+        status__in=(Outbox.STATUS_PENDING, Outbox.STATUS_IN_PROGRESS), available_at__lte=timezone.now()
+    ).aggregate(oldest=Min('available_at'))['oldest']
+    return (timezone.now() - oldest).total_seconds() if oldest else 0
+
+
+def purge_outbox():
+    """ Удаление обработанных событий старше OUTBOX_RETENTION """
+
+    deleted, _ = Outbox.objects.filter(
+        status=Outbox.STATUS_DONE, processed_at__lt=timezone.now() - settings.OUTBOX_RETENTION
+    ).delete()
+    return deleted
@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from education.caching import bump_version, get_version
+from education.models import Course, Lesson
+
+OWNERSHIP_VERSION_KEY = 'ownership:version'
+
+
+def get_owned_course_ids(request):
+    """
+    Набор id курсов, которыми владеет пользователь запроса или в которых он владеет уроком.
+    Считается одним запросом и запоминается на время запроса, а между запросами - в кеше
+    до любого изменения курсов или уроков (OWNERSHIP_CACHE_TIMEOUT)
+    """
+
+    owned = getattr(request, '_owned_course_ids', None)
+    if owned is not None:
+        return owned
+
+    user = request.user
+    if user.is_anonymous:
+        owned = frozenset()
+    elif settings.OWNERSHIP_CACHE_TIMEOUT:
+        key = f'ownership:courses:{get_version(OWNERSHIP_VERSION_KEY)}:{user.pk}'
+        owned = cache.get(key)
+        if owned is None:
+            owned = fetch_owned_course_ids(user)
+            cache.set(key, owned, settings.OWNERSHIP_CACHE_TIMEOUT)
+    else:
+        owned = fetch_owned_course_ids(user)
+
+    request._owned_course_ids = owned
+    return owned
+
+
+def fetch_owned_course_ids(user):
+    """ id курсов пользователя и курсов его уроков одним запросом UNION """
+
+    courses = Course.objects.filter(owner=user).values_list('pk', flat=True)
+    lesson_courses = Lesson.objects.filter(owner=user).values_list('course_id', flat=True)
+    return frozenset(courses.union(lesson_courses))
+
+
+def invalidate_owned_course_ids():
+    """ Сброс закешированных наборов курсов всех пользователей """
+
+    bump_version(OWNERSHIP_VERSION_KEY)
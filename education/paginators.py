@@ -1,9 +1,231 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import b64decode, b64encode
+from binascii import Error as BinasciiError
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class EducationCursorPaginator(BasePagination):
+    """
+    Курсорный (keyset) пагинатор: страница выбирается условием по индексированной сортировке,
+    а не OFFSET, поэтому время ответа не зависит от глубины страницы
+    """
+
+    page_size = 10
+    page_size_query_param = 'per_page'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор'
+
+    # Сортировка по умолчанию, должна быть уникальной (последним полем идет первичный ключ)
+    ordering = ('id',)
+    # Выше этого количества строк в таблице точный COUNT(*) не выполняется
+    count_estimate_threshold = 10000
+
+    def __init__(self, ordering=None):
+        if ordering is not None:
+            self.ordering = tuple(ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.position, self.reverse = self.decode_cursor(request, queryset.model)
+        self.count = self.get_count(queryset)
+
+        if self.position is not None:
+            queryset = queryset.filter(self.get_position_filter(self.position, self.reverse))
+        ordering = [self.invert(field) for field in self.ordering] if self.reverse else self.ordering
+        results = list(queryset.order_by(*ordering)[:self.page_size + 1])
+
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+
+        # Определяем, есть ли страницы до и после текущей
+        if self.reverse:
+            self.has_next, self.has_previous = self.position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.position is not None
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {'type': 'integer', 'nullable': True},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        """ Получение размера страницы из параметра запроса с ограничением сверху """
+
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.get_item_position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.get_item_position(self.page[0]), reverse=True)
+
+    def get_item_position(self, item):
+        """ Значения полей сортировки для строки - модели или словаря из .values() """
+
+        if isinstance(item, dict):
+            return [item[field.lstrip('-')] for field in self.ordering]
+        return [getattr(item, field.lstrip('-')) for field in self.ordering]
+
+    def get_position_filter(self, position, reverse):
+        """
+        Условие "строка идет после позиции" для составного ключа сортировки:
+        (a > x) OR (a = x AND b > y) OR ...
+        """
+
+        condition = Q()
+        for index, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            step = Q(**{f'{name}__lt' if descending else f'{name}__gt': position[index]})
+            for previous_field, value in zip(self.ordering[:index], position):
+                step &= Q(**{previous_field.lstrip('-'): value})
+            condition |= step
+        return condition
+
+    def encode_cursor(self, position, reverse):
+        """ Кодирование позиции в параметр cursor ссылки на соседнюю страницу """
+
+        # Даты кодируем через isoformat, чтобы не потерять микросекунды (DjangoJSONEncoder их обрезает)
+        position = [value.isoformat() if hasattr(value, 'isoformat') else value for value in position]
+        data = json.dumps({'p': position, 'r': int(reverse)}, cls=DjangoJSONEncoder)
+        cursor = b64encode(data.encode()).decode()
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request, model):
+        """
+        Декодирование курсора, пустой курсор означает первую страницу.
+        Значения позиции проверяются полями модели (тип, NULL, диапазон) - подмененный курсор дает 404, а не 500
+        """
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            data = json.loads(b64decode(encoded.encode()).decode())
+            position, reverse = data['p'], bool(data['r'])
+        except (BinasciiError, UnicodeDecodeError, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            position = [
+                model._meta.get_field(field.lstrip('-')).clean(value, None)
+                for field, value in zip(self.ordering, position)
+            ]
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        # Первичный ключ пропускает NULL при проверке, а сравнение с NULL в условии позиции невозможно
+        if None in position:
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def get_count(self, queryset):
+        """
+        Общее количество записей: точное для небольших таблиц, оценка планировщика PostgreSQL
+        для больших таблиц без фильтров и None (пропуск подсчета) для больших таблиц с фильтрами
+        """
+
+        estimate = self.get_table_estimate(queryset)
+        if estimate is None or estimate <= self.count_estimate_threshold:
+            return queryset.count()
+        if not queryset.query.where:
+            return estimate
+        return None
+
+    @staticmethod
+    def get_table_estimate(queryset):
+        """ Оценка количества строк таблицы по статистике pg_class.reltuples """
+
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        # До первого ANALYZE статистики нет (reltuples = -1 или 0)
+        if row is None or row[0] <= 0:
+            return None
+        return int(row[0])
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
 
 
 class EducationPaginator(PageNumberPagination):
-    """ Пагинатор для вывода информации на странице по 10 записей """
+    """
+    Пагинатор для вывода информации на странице по 10 записей.
+    Если представление задает cursor_ordering, то с параметром ?cursor= включается курсорный режим
+    """
 
     page_size = 10
     page_size_query_param = 'per_page'
     max_page_size = 100
+    cursor_query_param = 'cursor'
+
+    cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        ordering = getattr(view, 'cursor_ordering', None)
+        if ordering and self.cursor_query_param in request.query_params:
+            self.cursor_paginator = EducationCursorPaginator(ordering=ordering)
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_next_link(self):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_next_link()
+        return super().get_next_link()
+
+    def get_previous_link(self):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_previous_link()
+        return super().get_previous_link()
@@ -1,5 +1,6 @@
 from rest_framework import permissions
 
+from education.ownership import get_owned_course_ids
 from users.models import UserRoles
 
 
@@ -16,18 +17,20 @@ class IsCourseOwner(permissions.BasePermission):
     """ Разрешение - Владелец курса """
 
     def has_object_permission(self, request, view, obj):
-        return obj.owner == request.user
+        # Сравниваем id, чтобы не загружать владельца отдельным запросом
+        return obj.owner_id == request.user.pk
 
 
 class IsCourseOrLessonOwner(permissions.BasePermission):
-    """ Разрешение - Владелец курса или урока """
+    """ Разрешение - Владелец курса или урока в этом курсе (по набору курсов пользователя, один раз за запрос) """
 
     def has_object_permission(self, request, view, obj):
-        return obj.course.owner == request.user or obj.course.lesson_set.filter(owner=request.user).exists()
+        return obj.course_id in get_owned_course_ids(request)
 
 
 class IsPaymentOwner(permissions.BasePermission):
     """ Разрешение - Владелец платежа """
 
     def has_object_permission(self, request, view, obj):
-        return obj.owner == request.user
+        # Сравниваем id, чтобы не загружать владельца отдельным запросом
+        return obj.owner_id == request.user.pk
@@ -0,0 +1,97 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from education.models import Payments, PaymentsDailyRollup, Watermark
+
+PAYMENTS_ROLLUP_WATERMARK = 'payments_rollup'
+PAYMENTS_ROLLUP_BATCH_SIZE = 50000
+
+# Поля, по которым можно группировать суммы (?group_by=)
+ROLLUP_GROUP_FIELDS = ('day', 'course', 'lesson', 'payment_method')
+
+
+def get_rollup_groups(payments):
+    """ Суммы платежей по дню, курсу, уроку и способу оплаты одним GROUP BY """
+
+    return payments.order_by().annotate(
+        day=TruncDate('payment_date'),
+        # Оплата урока относится к курсу урока - так же, как в выручке курса
+        rollup_course=Coalesce('course', 'lesson__course'),
+    ).values('day', 'rollup_course', 'lesson', 'payment_method').annotate(
+        batch_count=Count('pk'),
+        batch_amount=Coalesce(Sum('amount'), 0),
+    )
+
+
+def apply_rollup_groups(groups):
+    """ Добавление сумм пачки к строкам дневных итогов: UPDATE существующей строки, иначе INSERT """
+
+    created = []
+    for group in groups:
+        key = {
+            'day': group['day'],
+            'course_id': group['rollup_course'],
+            'lesson_id': group['lesson'],
+            'payment_method': group['payment_method'],
+        }
+        updated = PaymentsDailyRollup.objects.filter(**key).update(
+            payments_count=F('payments_count') + group['batch_count'],
+            amount_total=F('amount_total') + group['batch_amount'],
+        )
+        if not updated:
+            created.append(PaymentsDailyRollup(
+                payments_count=group['batch_count'], amount_total=group['batch_amount'], **key
+            ))
+    PaymentsDailyRollup.objects.bulk_create(created)
+
+
+def update_payments_rollup(batch_size=PAYMENTS_ROLLUP_BATCH_SIZE):
+    """
+    Инкрементальное обновление дневных итогов по оплаченным платежам: обрабатываются платежи, получившие
+    статус оплаты после отметки и раньше, чем WATERMARK_SAFETY_LAG назад, - транзакции, записавшие более ранние
+    статусы, к этому времени зафиксированы, и отметка не обгоняет их. Оплата больше не меняет статус,
+    поэтому каждый платеж учитывается один раз. Каждая пачка - отдельная транзакция, в которой строка отметки
+    заблокирована (select_for_update), поэтому параллельные запуски не посчитают одни и те же платежи дважды.
+    Платежи, измененные или удаленные после обработки, учитываются только полным пересчетом
+    """
+
+    Watermark.objects.get_or_create(name=PAYMENTS_ROLLUP_WATERMARK)
+    cutoff = timezone.now() - settings.WATERMARK_SAFETY_LAG
+    processed = 0
+    while True:
+        with transaction.atomic():
+            watermark = Watermark.objects.select_for_update().get(name=PAYMENTS_ROLLUP_WATERMARK)
+            paid = Payments.objects.filter(payment_status=Payments.PAYMENT_PAID, status_changed_at__lte=cutoff)
+            if watermark.processed_until is not None:
+                paid = paid.filter(status_changed_at__gt=watermark.processed_until)
+
+            upper = paid.order_by('status_changed_at').values_list(
+                'status_changed_at', flat=True
+            )[batch_size - 1:batch_size].first()
+            if upper is None:
+                # Неполная пачка - берем все оставшиеся платежи
+                upper = paid.aggregate(upper=Max('status_changed_at'))['upper']
+            if upper is None:
+                return processed
+
+            # Платежи с тем же временем, что и у последнего в пачке, попадают в эту же пачку
+            payments = paid.filter(status_changed_at__lte=upper)
+            processed += payments.count()
+            apply_rollup_groups(get_rollup_groups(payments))
+
+            watermark.processed_until = upper
+            watermark.save(update_fields=['processed_until'])
+
+
+def rebuild_payments_rollup(batch_size=PAYMENTS_ROLLUP_BATCH_SIZE):
+    """ Полный пересчет дневных итогов с нуля - исправление расхождений после изменения или удаления платежей """
+
+    with transaction.atomic():
+        watermark, _ = Watermark.objects.select_for_update().get_or_create(name=PAYMENTS_ROLLUP_WATERMARK)
+        PaymentsDailyRollup.objects.all().delete()
+        watermark.processed_until = None
+        watermark.save(update_fields=['processed_until'])
+    return update_payments_rollup(batch_size)
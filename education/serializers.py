@@ -1,13 +1,94 @@
-from rest_framework import serializers
+from django.core.exceptions import FieldDoesNotExist
+from django.db import IntegrityError, transaction
+from rest_framework import permissions, serializers
 from rest_framework.relations import SlugRelatedField
+from rest_framework.reverse import reverse
+from rest_framework.settings import api_settings
 
 from education.models import Course, Lesson, Payments, Subscription
-from education.services import create_product, get_url
-from education.validators import UrlValidator
+from education.validators import ContentHashUniqueValidator, UrlValidator
 from users.models import User
 
 
-class LessonSerializer(serializers.ModelSerializer):
+def get_query_list(request, param):
+    """ Список значений параметра запроса, перечисленных через запятую (?fields=id,name), или None """
+
+    value = request.query_params.get(param) if request is not None else None
+    if value is None:
+        return None
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def get_sparse_queryset(queryset, serializer, extra=()):
+    """
+    Ограничение выбираемых колонок полями сериализатора (и дополнительными колонками extra) через .only():
+    для SlugRelatedField связанная модель подгружается select_related только с нужной колонкой
+    """
+
+    model = queryset.model
+    columns, related = {model._meta.pk.name, *extra}, []
+    for field in serializer.fields.values():
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            continue
+        if model_field.many_to_one and isinstance(field, SlugRelatedField):
+            related.append(field.source)
+            columns.add(f'{field.source}__{field.slug_field}')
+        elif model_field.concrete:
+            columns.add(field.source)
+
+    if related:
+        queryset = queryset.select_related(*related)
+    return queryset.only(*columns)
+
+
+class DynamicFieldsMixin:
+    """
+    Миксин для сериализатора - выбор полей ответа на GET-запросы:
+    ?fields=id,name оставляет только перечисленные поля,
+    а поля из expandable_fields выводятся только по запросу ?expand=lessons
+    """
+
+    expandable_fields = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        request = self.context.get('request')
+        if request is None or request.method not in permissions.SAFE_METHODS:
+            return
+
+        requested = get_query_list(request, 'fields')
+        expanded = set(get_query_list(request, 'expand') or ())
+        for name in list(self.fields):
+            if name in self.expandable_fields:
+                keep = name in expanded
+            else:
+                keep = requested is None or name in requested
+            if not keep:
+                self.fields.pop(name)
+
+
+class ContentHashUniqueMixin:
+    """
+    Миксин для сериализатора модели с content_hash: если параллельный запрос успел создать такую же запись
+    после проверки валидатором, ошибка уникального индекса возвращается как ошибка валидации, а не 500
+    """
+
+    def save(self, **kwargs):
+        try:
+            with transaction.atomic():
+                return super().save(**kwargs)
+        except IntegrityError as error:
+            if 'content_hash' not in str(error):
+                raise
+            raise serializers.ValidationError(
+                {api_settings.NON_FIELD_ERRORS_KEY: [ContentHashUniqueValidator.message]}, code='unique'
+            )
+
+
+class LessonSerializer(ContentHashUniqueMixin, DynamicFieldsMixin, serializers.ModelSerializer):
     """ Сериализотор для модели урока """
 
     # Выводим название курса в поле "course", вместо цифры
@@ -15,10 +96,11 @@ class LessonSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Lesson
-        fields = '__all__'
+        # Хеш содержимого и данные Stripe служебные и в ответах не выводятся
+        exclude = ['content_hash', 'stripe_product_id', 'stripe_price_id', 'stripe_price_amount']
         validators = [
             UrlValidator(fields=['name', 'description', 'video_url']),
-            serializers.UniqueTogetherValidator(fields=['name', 'description'], queryset=Lesson.objects.all())
+            ContentHashUniqueValidator(queryset=Lesson.objects.all())
         ]
 
 
@@ -30,11 +112,11 @@ class LessonListSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'description', 'preview', 'video_url']
 
 
-class CourseSerializer(serializers.ModelSerializer):
-    """ Сериализотор для модели курса """
+class CourseSerializer(ContentHashUniqueMixin, DynamicFieldsMixin, serializers.ModelSerializer):
+    """ Сериализотор для модели курса, вложенные уроки выводятся по запросу ?expand=lessons """
+
+    expandable_fields = ('lessons',)
 
-    # Выводим счетчик уроков
-    lessons_count = serializers.IntegerField(source='lesson_set.count', read_only=True)
     # Расширяем сериализатор дополнительным вложенным полем с уроками
     lessons = serializers.SerializerMethodField()
     # Расширяем сериализатор дополнительным вложенным полем со статусом подписки
@@ -45,18 +127,23 @@ class CourseSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Course
-        fields = '__all__'
+        # Хеш содержимого и данные Stripe служебные и в ответах не выводятся
+        exclude = ['content_hash', 'stripe_product_id', 'stripe_price_id', 'stripe_price_amount']
+        # Счетчики уроков, подписчиков и выручки ведутся сигналами, а не задаются клиентом
+        read_only_fields = ['lessons_count', 'subscribers_count', 'revenue_total']
         validators = [
             UrlValidator(fields=['name', 'description']),
-            serializers.UniqueTogetherValidator(fields=['name', 'description'], queryset=Course.objects.all())
+            ContentHashUniqueValidator(queryset=Course.objects.all())
         ]
 
-    # Получаем все поля для дополнительного поля уроков с фильтрацией по курсу
+    # Получаем все поля для дополнительного поля уроков, используя предзагруженные уроки курса
     def get_lessons(self, course):
-        return LessonListSerializer(Lesson.objects.filter(course=course), many=True).data
+        return LessonListSerializer(course.lesson_set.all(), many=True).data
 
-    # Получаем поле статуса подписки с фильтрацией по пользователю подписки
+    # Получаем поле статуса подписки из аннотации queryset, а если ее нет - фильтруем по пользователю подписки
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context['request'].user
         return Subscription.objects.filter(user=user, course=obj).exists()
 
@@ -87,22 +174,21 @@ class PaymentsForOwnerSerializer(serializers.ModelSerializer):
 class PaymentCreateSerializer(serializers.ModelSerializer):
     """ Сериализатор для создания платежа через Stripe """
 
-    payment_url = serializers.SerializerMethodField()
     price = serializers.SerializerMethodField()
+    status_url = serializers.SerializerMethodField()
 
     # Можно указать это поле, если хотим указывать свою цену (не ту что в базе данных за курс или урок)
     # amount = serializers.IntegerField(required=True)
 
     class Meta:
         model = Payments
-        fields = ['id', 'price', 'payment_method', 'course', 'lesson', 'payment_url']
-        read_only_fields = ['id', 'price', 'payment_url']
+        fields = ['id', 'price', 'payment_method', 'course', 'lesson', 'checkout_status', 'payment_url', 'status_url']
+        read_only_fields = ['id', 'price', 'checkout_status', 'payment_url', 'status_url']
 
-    def get_payment_url(self, obj):
-        """ Получение дополнительного поля - payment_url """
+    def get_status_url(self, obj):
+        """ Получение дополнительного поля - status_url, адрес статуса сессии оплаты """
 
-        price = create_product(obj)
-        return get_url(price)
+        return reverse('education:payments_checkout', args=[obj.pk], request=self.context.get('request'))
 
     def get_price(self, payment):
         """ Получение дополнительного поля - price """
@@ -116,6 +202,14 @@ class PaymentCreateSerializer(serializers.ModelSerializer):
         return price
 
 
+class PaymentCheckoutSerializer(serializers.ModelSerializer):
+    """ Сериализатор статуса сессии оплаты Stripe """
+
+    class Meta:
+        model = Payments
+        fields = ['id', 'checkout_status', 'payment_url']
+
+
 class SubscriptionSerializer(serializers.ModelSerializer):
     """ Сериализотор для модели подписки пользователя на курс """
 
@@ -1,55 +1,89 @@
 import stripe
+from django.conf import settings
 
-from config import settings
 
+def get_payment_item(payment):
+    """ Курс или урок, за который платят, и подпись для описания продукта """
 
-def create_product(payment):
+    if payment.course:
+        return payment.course, 'Курс'
+    if payment.lesson:
+        return payment.lesson, 'Урок'
+    raise ValueError('Invalid Payment')
+
+
+def create_product(item, label):
     """
     Создание продукта для оплаты через Stripe,
     попадает в личный кабинет страйпа после успешного создания
     """
 
-    stripe.api_key = settings.STRIPE_SK
+    product = stripe.Product.create(
+        api_key=settings.STRIPE_SK,
+        # Название поля и описания на платежной странице
+        name='Оплата за обучение',
+        description=f'{label}: {item.name}',
+        # Повтор после сбоя до записи id в БД вернет тот же продукт, а не создаст новый
+        idempotency_key=f'{item._meta.model_name}-{item.pk}-product',
+    )
+    return product['id']
 
-    if payment.course:
-        product = stripe.Product.create(
-            # Название поля и описания на платежной странице
-            name='Оплата за обучение',
-            description=f'Курс: {payment.course.name}',
-        )
-        amount = payment.course.amount
-    elif payment.lesson:
-        product = stripe.Product.create(
-            name='Оплата за обучение',
-            description=f'Урок: {payment.lesson.name}',
-        )
-        amount = payment.lesson.amount
-    else:
-        raise ValueError('Invalid Payment')
 
-    product.save()
+def create_price(item, amount):
+    """ Создание цены продукта курса или урока в Stripe """
+
     price = stripe.Price.create(
+        api_key=settings.STRIPE_SK,
         unit_amount=amount,
-        # Можно указать это поле взамен, если хотим указывать свою цену (не ту что в базе данных за курс или урок)
-        # unit_amount=int(payment.amount),
         currency="rub",
         # Указываем, если нужно создать периодический платеж
         # recurring={"interval": "month"},
-        product=product['id'],
+        product=item.stripe_product_id,
+        idempotency_key=f'{item._meta.model_name}-{item.pk}-{item.stripe_product_id}-price-{amount}',
     )
-    price.save()
     return price['id']
 
 
-def get_url(price):
+def get_price_id(payment):
+    """
+    Получение id цены Stripe для оплаты курса или урока.
+    Продукт создается один раз, цена - один раз на каждую сумму: id сохраняются в курсе или уроке,
+    поэтому обычно оплата обходится одним запросом к Stripe (создание сессии оплаты)
     """
-    Получение ссылки на оплату через Stripe,
+
+    item, label = get_payment_item(payment)
+    if item.stripe_price_id and item.stripe_price_amount == item.amount:
+        return item.stripe_price_id
+
+    model = type(item)
+    # Строка не блокируется на время запросов к Stripe: параллельные оплаты создают продукт и цену с теми же
+    # ключами идемпотентности и получают те же id, а свежие значения берутся, если их уже сохранила другая оплата
+    item = model.objects.get(pk=item.pk)
+    # update, а не save: служебные поля не меняют дату изменения и не сбрасывают кеши курсов
+    if not item.stripe_product_id:
+        item.stripe_product_id = create_product(item, label)
+        model.objects.filter(pk=item.pk, stripe_product_id__isnull=True).update(
+            stripe_product_id=item.stripe_product_id
+        )
+    if not item.stripe_price_id or item.stripe_price_amount != item.amount:
+        item.stripe_price_id = create_price(item, item.amount)
+        item.stripe_price_amount = item.amount
+        # Цена сохраняется, только если сумма не изменилась за время запроса к Stripe
+        model.objects.filter(pk=item.pk, amount=item.amount).update(
+            stripe_price_id=item.stripe_price_id, stripe_price_amount=item.stripe_price_amount
+        )
+    return item.stripe_price_id
+
+
+def create_session(price, client_reference_id=None, idempotency_key=None):
+    """
+    Создание сессии оплаты через Stripe,
     фиксируется в личном кабинете страйпа
-     """
+    """
 
-    stripe.api_key = settings.STRIPE_SK
     # Перенаправление на страницу успешного платежа в случае успешной оплаты
-    session = stripe.checkout.Session.create(
+    return stripe.checkout.Session.create(
+        api_key=settings.STRIPE_SK,
         # Здесь можно указать свою страницу с сообщением об успешном платеже
         success_url="https://example.com/success_payment",
         line_items=[
@@ -59,5 +93,8 @@ def get_url(price):
             },
         ],
         mode="payment",
+        # id платежа: по нему события Stripe находят платеж, даже если id сессии не успел сохраниться
+        client_reference_id=client_reference_id,
+        # Повтор после таймаута вернет ту же сессию, а не создаст вторую
+        idempotency_key=idempotency_key,
     )
-    return session['url']
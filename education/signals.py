@@ -0,0 +1,87 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from education.caching import bump_courses_version
+from education.counters import get_counted_state, shift_course_counters
+from education.models import Course, Lesson, Payments, Subscription
+from education.ownership import invalidate_owned_course_ids
+from users.models import User
+
+
+@receiver([post_save, post_delete], sender=Course)
+@receiver([post_save, post_delete], sender=Lesson)
+@receiver([post_save, post_delete], sender=Subscription)
+def invalidate_courses_cache(sender, **kwargs):
+    """
+    Сброс закешированных ответов по курсам при любом изменении курсов, уроков и подписок.
+    Версия меняется после фиксации транзакции: иначе параллельный запрос успеет закешировать старые данные
+    под новой версией. Платежи сбрасывают кеш только через изменение выручки курса (shift_course_counters)
+    """
+
+    transaction.on_commit(bump_courses_version)
+
+
+@receiver(post_init, sender=User)
+def remember_owner_name(sender, instance, **kwargs):
+    """ Запоминаем имя пользователя при загрузке: оно выводится в курсах как имя владельца """
+
+    instance._owner_name = instance.__dict__.get('first_name')
+
+
+@receiver(post_save, sender=User)
+def invalidate_courses_cache_by_owner(sender, instance, created, **kwargs):
+    """
+    Сброс закешированных ответов по курсам при смене имени пользователя.
+    Если имя не было загружено, прежнее значение неизвестно - кеш сбрасывается
+    """
+
+    if not created and (instance._owner_name is None or instance._owner_name != instance.first_name):
+        transaction.on_commit(bump_courses_version)
+    instance._owner_name = instance.__dict__.get('first_name')
+
+
+@receiver([post_save, post_delete], sender=Course)
+@receiver([post_save, post_delete], sender=Lesson)
+def invalidate_ownership_cache(sender, **kwargs):
+    """
+    Сброс закешированных наборов курсов пользователей при изменении курсов и уроков (владелец, курс урока).
+    Как и для кеша курсов, версия меняется после фиксации транзакции
+    """
+
+    transaction.on_commit(invalidate_owned_course_ids)
+
+
+@receiver(post_init, sender=Lesson)
+@receiver(post_init, sender=Subscription)
+@receiver(post_init, sender=Payments)
+def remember_counted_state(sender, instance, **kwargs):
+    """ Запоминаем состояние строки при загрузке, чтобы при сохранении изменить счетчики курса на разницу """
+
+    instance._counted_state = get_counted_state(instance)
+
+
+@receiver(post_save, sender=Lesson)
+@receiver(post_save, sender=Subscription)
+@receiver(post_save, sender=Payments)
+def update_course_counters(sender, instance, created, **kwargs):
+    """ Обновление счетчиков курса при создании и изменении уроков, подписок и платежей """
+
+    old_state = None if created else instance._counted_state
+    new_state = get_counted_state(instance)
+    # Если строка была загружена не полностью, вклад до изменения неизвестен - расхождение исправит пересчет
+    if created or old_state is not None:
+        shift_course_counters(sender, old_state, new_state)
+    instance._counted_state = new_state
+
+
+@receiver(post_delete, sender=Lesson)
+@receiver(post_delete, sender=Subscription)
+@receiver(post_delete, sender=Payments)
+def decrease_course_counters(sender, instance, origin=None, **kwargs):
+    """ Уменьшение счетчиков курса при удалении уроков, подписок и платежей """
+
+    # При удалении самого курса его счетчики обновлять не нужно
+    if isinstance(origin, Course) or getattr(origin, 'model', None) is Course:
+        return
+    shift_course_counters(sender, instance._counted_state or get_counted_state(instance), None)
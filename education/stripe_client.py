@@ -0,0 +1,160 @@
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+import stripe
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from stripe.http_client import RequestsClient
+
+from education import metrics
+
+
+class CircuitOpenError(stripe.error.APIConnectionError):
+    """ Запрос к Stripe не отправлялся: слишком много ошибок, Stripe считается недоступным """
+
+    def __init__(self, retry_in):
+        super().__init__(f'Stripe временно недоступен, повторите через {retry_in:.0f} с', should_retry=False)
+
+
+class CircuitBreaker:
+    """
+    Предохранитель запросов к Stripe: если среди последних window запросов (не меньше min_calls) доля ошибок
+    достигла error_rate, запросы отклоняются сразу на reset_timeout секунд. Затем пропускается один
+    пробный запрос: успех закрывает предохранитель, ошибка снова открывает его
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, window, min_calls, error_rate, reset_timeout):
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.reset_timeout = reset_timeout
+        self.results = deque(maxlen=window)
+        self.state = self.CLOSED
+        self.opened_at = 0
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        """ Проверка перед запросом, при открытом предохранителе - CircuitOpenError """
+
+        with self.lock:
+            if self.state == self.CLOSED:
+                return
+            retry_in = self.opened_at + self.reset_timeout - time.monotonic()
+            if self.state == self.OPEN and retry_in <= 0:
+                # Пробный запрос, остальные ждут его результата
+                self.state = self.HALF_OPEN
+                return
+        metrics.incr('stripe.circuit_rejected')
+        raise CircuitOpenError(max(retry_in, 0))
+
+    def record(self, success):
+        """ Учет результата запроса """
+
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.results.clear()
+                if success:
+                    self.set_state(self.CLOSED)
+                else:
+                    self.open()
+                return
+
+            self.results.append(success)
+            errors = self.results.count(False)
+            if len(self.results) >= self.min_calls and errors / len(self.results) >= self.error_rate:
+                self.open()
+
+    def open(self):
+        self.opened_at = time.monotonic()
+        self.results.clear()
+        self.set_state(self.OPEN)
+        metrics.incr('stripe.circuit_opened')
+
+    def set_state(self, state):
+        self.state = state
+        metrics.set_gauge('stripe.circuit_state', state)
+
+
+class StripeHTTPClient(RequestsClient):
+    """
+    HTTP-клиент библиотеки stripe: общий пул соединений keep-alive, таймауты соединения и чтения,
+    ограниченные повторы с jitter, предохранитель и метрики задержки и ошибок запросов
+    """
+
+    def __init__(self, connect_timeout, read_timeout, pool_size, max_retries, retry_delay, max_retry_delay, breaker):
+        session = requests.Session()
+        # Повторы делает сам клиент stripe (с ключом идемпотентности), а не urllib3
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        super().__init__(timeout=(connect_timeout, read_timeout), session=session)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.breaker = breaker
+
+    def request(self, method, url, headers, post_data=None):
+        self.breaker.before_call()
+        started = time.perf_counter()
+        try:
+            response = super().request(method, url, headers, post_data)
+        except Exception:
+            # Любая ошибка учитывается, иначе пробный запрос оставит предохранитель полуоткрытым навсегда
+            self.record(started, success=False)
+            raise
+        # 429 - ограничение частоты запросов, Stripe перегружен так же, как при 5xx
+        self.record(started, success=response[1] < 500 and response[1] != 429)
+        return response
+
+    def record(self, started, success):
+        """ Метрики запроса и учет результата предохранителем """
+
+        latency_ms = round((time.perf_counter() - started) * 1000)
+        metrics.incr('stripe.requests')
+        metrics.incr('stripe.latency_ms_total', latency_ms)
+        metrics.set_gauge('stripe.latency_ms', latency_ms)
+        if not success:
+            metrics.incr('stripe.errors')
+        self.breaker.record(success)
+
+    def _max_network_retries(self):
+        return self.max_retries
+
+    def _sleep_time_seconds(self, num_retries, response=None):
+        """ Задержка повтора: full jitter от экспоненты, но не меньше Retry-After от Stripe """
+
+        metrics.incr('stripe.retries')
+        delay = random.uniform(0, min(self.retry_delay * 2 ** (num_retries - 1), self.max_retry_delay))
+        retry_after = self._retry_after_header(response)
+        if retry_after is not None and retry_after <= self.MAX_RETRY_AFTER:
+            delay = max(delay, retry_after)
+        return delay
+
+
+def create_stripe_client():
+    """ Клиент Stripe с настройками из settings """
+
+    return StripeHTTPClient(
+        connect_timeout=settings.STRIPE_CONNECT_TIMEOUT,
+        read_timeout=settings.STRIPE_READ_TIMEOUT,
+        pool_size=settings.STRIPE_POOL_SIZE,
+        max_retries=settings.STRIPE_MAX_RETRIES,
+        retry_delay=settings.STRIPE_RETRY_DELAY,
+        max_retry_delay=settings.STRIPE_MAX_RETRY_DELAY,
+        breaker=CircuitBreaker(
+            window=settings.STRIPE_BREAKER_WINDOW,
+            min_calls=settings.STRIPE_BREAKER_MIN_CALLS,
+            error_rate=settings.STRIPE_BREAKER_ERROR_RATE,
+            reset_timeout=settings.STRIPE_BREAKER_RESET_TIMEOUT,
+        ),
+    )
+
+
+def configure_stripe():
+    """ Общий клиент для всех запросов библиотеки stripe в процессе, вызывается при запуске приложения """
+
+    stripe.default_http_client = create_stripe_client()
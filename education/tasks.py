@@ -1,27 +1,212 @@
+from itertools import islice
+
 from celery import shared_task
+from django.conf import settings
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db import transaction
+from django.utils import timezone
+
+from education import metrics
+from education.checkout import RETRYABLE_ERRORS, checkout_payment, fail_checkout
+from education.email_sender import MailChunkError, send_mail_chunk
+from education.idempotency import purge_idempotency_keys
+from education.models import Course, CourseChangeEvent, Lesson, Payments, Subscription, Watermark
+from education.notifications import COURSE_CHANGED
+from education.outbox import dispatch_outbox, handles, purge_outbox
+from education.rollups import update_payments_rollup
+from education.webhooks import process_stripe_events, purge_stripe_events
 
-from education.email_sender import send_mail_task
-from education.models import Course, Subscription
+DIGEST_WATERMARK = 'course_digest'
+DIGEST_SUBJECT = 'Ежедневная сводка изменений ваших курсов'
 
 
 @shared_task
-def subscriber_notify(course_id):
-    """ Задача для уведомления подписчиков, если курс обновился """
+def subscriber_notify(course_id, since=None):
+    """
+    Задача для уведомления подписчиков, если курс обновился (since - начало окна изменений курса):
+    адреса активных подписчиков читаются потоком одним запросом и делятся на пачки,
+    каждая пачка отправляется отдельной подзадачей через одно SMTP-соединение
+    """
+
+    # получаем название измененного курса
+    course_name = Course.objects.filter(pk=course_id).values_list('name', flat=True).first()
+    if course_name is None:
+        return 0
+
+    # подписчики с ежедневной сводкой получат это изменение в сводке
+    CourseChangeEvent.objects.create(course_id=course_id)
+
+    # получаем названия уроков, измененных с начала окна
+    lesson_names = []
+    if since is not None:
+        lesson_names = list(Lesson.objects.filter(course=course_id, updated_at__gte=since).order_by(
+            'updated_at'
+        ).values_list('name', flat=True))
+
+    subject = f'Изменения в уроках вашего курса - {course_name}'
+    chunk_size = settings.NOTIFY_CHUNK_SIZE
+
+    # получаем адреса подписчиков данного курса без загрузки подписок и пользователей
+    emails = Subscription.objects.filter(
+        course=course_id, is_subscribed=True, delivery_mode=Subscription.DELIVERY_IMMEDIATE
+    ).order_by('pk').values_list('user__email', flat=True).iterator(chunk_size=chunk_size)
+
+    chunks = 0
+    while chunk := list(islice(emails, chunk_size)):
+        items = [[email, get_notify_message(email, course_name, lesson_names)] for email in chunk]
+        send_notify_chunk.delay(subject, items)
+        chunks += 1
+    metrics.incr('notify.chunks', chunks)
+    return chunks
+
+
+@handles(COURSE_CHANGED)
+def notify_course_changed(payload):
+    """ Обработчик события outbox об изменении уроков курса - рассылка подписчикам """
+
+    return subscriber_notify(payload['course_id'], payload['since'])
+
+
+def get_notify_message(email, course_name, lesson_names=()):
+    """ Текст уведомления подписчику об изменениях в курсе со списком измененных уроков """
+
+    lessons = ''.join(f'- {name}\n' for name in lesson_names)
+    if lessons:
+        lessons = f'Изменены уроки:\n{lessons}'
+    return (f'Уважаемый подписчик, {email}!\nВ курсе "{course_name}" произошли недавние обновления некоторых уроков.\n'
+            f'{lessons}Скорее посетите наш сайт, чтобы посмотреть что изменилось в курсе!')
+
+
+@shared_task(name='course_digest')
+def course_digest():
+    """
+    Периодическая задача для ежедневной сводки: одно письмо подписчику со всеми курсами, измененными
+    с прошлой сводки. Сводки всех подписчиков собираются одним запросом с группировкой по пользователю
+    """
+
+    Watermark.objects.get_or_create(name=DIGEST_WATERMARK)
+    # изменения берутся по времени и с запасом WATERMARK_SAFETY_LAG: более ранние транзакции уже зафиксированы
+    upper = timezone.now() - settings.WATERMARK_SAFETY_LAG
+    chunk_size = settings.NOTIFY_CHUNK_SIZE
+    chunks = 0
+
+    # отметка сдвигается и фиксируется до рассылки: строка заблокирована только на время короткой транзакции,
+    # параллельный запуск дождется ее и не повторит сводку, а письма не копятся в памяти до фиксации
+    with transaction.atomic():
+        watermark = Watermark.objects.select_for_update().get(name=DIGEST_WATERMARK)
+        events = CourseChangeEvent.objects.filter(changed_at__lte=upper)
+        if watermark.processed_until is not None:
+            events = events.filter(changed_at__gt=watermark.processed_until)
+        if not events.exists():
+            return 0
+        watermark.processed_until = upper
+        watermark.save(update_fields=['processed_until'])
+
+    # сводки читаются потоком и каждая пачка отправляется сразу - в памяти не больше одной пачки
+    digests = Subscription.objects.filter(
+        is_subscribed=True, delivery_mode=Subscription.DELIVERY_DIGEST, course__change_events__in=events,
+    ).values('user__email').annotate(
+        course_names=ArrayAgg('course__name', distinct=True, ordering='course__name')
+    ).order_by('user__email').values_list('user__email', 'course_names').iterator(chunk_size=chunk_size)
+
+    while chunk := list(islice(digests, chunk_size)):
+        items = [[email, get_digest_message(email, course_names)] for email, course_names in chunk]
+        send_notify_chunk.delay(DIGEST_SUBJECT, items)
+        chunks += 1
+
+    # учтенные в сводках изменения старше срока хранения больше не нужны
+    CourseChangeEvent.objects.filter(
+        changed_at__lte=upper, changed_at__lt=timezone.now() - settings.DIGEST_EVENT_RETENTION
+    ).delete()
+    metrics.incr('digest.chunks', chunks)
+    return chunks
+
+
+def get_digest_message(email, course_names):
+    """ Текст ежедневной сводки подписчику со списком измененных курсов """
+
+    courses = ''.join(f'- {name}\n' for name in course_names)
+    return (f'Уважаемый подписчик, {email}!\nЗа последние сутки обновились курсы:\n{courses}'
+            f'Скорее посетите наш сайт, чтобы посмотреть что изменилось в курсах!')
+
+
+@shared_task(bind=True, max_retries=5)
+def send_notify_chunk(self, subject, items):
+    """ Задача для отправки пачки уведомлений, при ошибке повторяется только для неотправленных писем """
+
+    try:
+        sent = send_mail_chunk(subject, items)
+    except MailChunkError as error:
+        metrics.incr('notify.sent', error.sent)
+        metrics.incr('notify.retries')
+        # Повтор с нарастающей задержкой: 10, 20, 40... секунд
+        raise self.retry(args=(subject, items[error.sent:]), exc=error.error,
+                         countdown=settings.NOTIFY_RETRY_DELAY * 2 ** self.request.retries)
+    metrics.incr('notify.sent', sent)
+    return sent
+
+
+@shared_task(bind=True, max_retries=settings.CHECKOUT_MAX_RETRIES)
+def create_checkout_session(self, payment_id):
+    """ Задача для создания сессии оплаты Stripe платежа, созданного с Prefer: respond-async """
+
+    payment = Payments.objects.select_related('course', 'lesson').filter(
+        pk=payment_id, checkout_status=Payments.CHECKOUT_PENDING
+    ).first()
+    if payment is None:
+        return
+
+    try:
+        checkout_payment(payment)
+    except RETRYABLE_ERRORS as error:
+        if self.request.retries >= self.max_retries:
+            fail_checkout(payment)
+            raise
+        metrics.incr('checkout.retries')
+        # Повтор с нарастающей задержкой: 2, 4, 8... секунд
+        raise self.retry(exc=error, countdown=settings.CHECKOUT_RETRY_DELAY * 2 ** self.request.retries)
+    except Exception:
+        fail_checkout(payment)
+        raise
+
+
+@shared_task(name='payments_rollup')
+def payments_rollup():
+    """ Периодическая задача для добавления новых платежей в дневные итоги выручки """
+
+    return update_payments_rollup()
+
+
+@shared_task(name='outbox_dispatch')
+def outbox_dispatch():
+    """ Периодическая задача для обработки событий outbox, можно запускать на нескольких воркерах параллельно """
+
+    return dispatch_outbox()
+
+
+@shared_task(name='outbox_purge')
+def outbox_purge():
+    """ Периодическая задача для удаления старых обработанных событий outbox """
+
+    return purge_outbox()
+
+
+@shared_task(name='idempotency_purge')
+def idempotency_purge():
+    """ Периодическая задача для удаления устаревших ключей идемпотентности """
+
+    return purge_idempotency_keys()
+
 
-    course = Course.objects.get(pk=course_id)  # получаем данные об измененном курсе
-    subscriptions = Subscription.objects.filter(course=course_id)  # получаем подписки на данный курс
+@shared_task(name='stripe_events_process')
+def stripe_events_process():
+    """ Периодическая задача для обработки входящих событий Stripe и обновления статусов платежей """
 
-    subject = f'Изменения в уроках вашего курса - {course.name}'
+    return process_stripe_events()
 
-    # если подписки существуют, отправляем подписчикам курса сообщение об изменениях
-    if subscriptions:
-        #recipient_list = []
 
-        for subscription in subscriptions:
-            message = (
-                f'Уважаемый подписчик, {subscription.user}!\nВ курсе "{course.name}" произошли недавние обновления некоторых уроков.\n'
-                f'Скорее посетите наш сайт, чтобы посмотреть что изменилось в курсе!')
-            recipient_email = subscription.user.email
+@shared_task(name='stripe_events_purge')
+def stripe_events_purge():
+    """ Периодическая задача для удаления старых обработанных событий Stripe """
 
-            # Вызываем функцию отправки сообщения на email подписчика
-            send_mail_task(subject, message, [recipient_email])
+    return purge_stripe_events()
@@ -1,10 +1,52 @@
+import csv
+import hashlib
+import hmac
+import json
+import threading
+import time
+from base64 import b64encode
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
+from urllib.parse import parse_qsl, urlencode
+
+import stripe
+
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models import Count, QuerySet, Sum
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models.functions import TruncDate
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
 from rest_framework.reverse import reverse
-from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework import serializers, status
+from rest_framework.test import APIClient, APIRequestFactory, APITestCase, APITransactionTestCase
 from rest_framework_simplejwt.tokens import AccessToken
 
-from education.models import Lesson, Course, Subscription
-from users.models import User
+from education.email_sender import MailChunkError
+from education.fields import get_content_hash
+from education.metrics import get_metrics
+from education.notifications import schedule_course_notification
+from education.outbox import claim_outbox, dispatch_outbox, enqueue
+from education.ownership import get_owned_course_ids
+from education.models import Lesson, Course, Subscription, Payments, PaymentsDailyRollup, Outbox, \
+    CourseChangeEvent, IdempotencyKey, StripeEvent, Watermark
+from education.rollups import rebuild_payments_rollup, update_payments_rollup
+from education.stripe_client import CircuitBreaker, CircuitOpenError, StripeHTTPClient
+from education.serializers import LessonSerializer, PaymentsSerializer
+from education.tasks import DIGEST_WATERMARK, course_digest, create_checkout_session, idempotency_purge, \
+    send_notify_chunk, stripe_events_process, subscriber_notify
+from education.validators import ContentHashUniqueValidator
+from education.webhooks import apply_session_updates
+from users.models import User, UserRoles
+from users.serializers import ClaimsTokenObtainPairSerializer
 
 
 class LessonTestCase(APITestCase):
@@ -25,6 +67,12 @@ class LessonTestCase(APITestCase):
 
         )
 
+    @staticmethod
+    def format_datetime(value):
+        """ Дата в том же формате, в котором ее выводит сериализатор """
+
+        return serializers.DateTimeField().to_representation(value)
+
     def test_lesson_create(self):
         """ Тестирование создания урока """
 
@@ -54,13 +102,15 @@ class LessonTestCase(APITestCase):
         self.assertEqual(
             response.json(),
             {
-                "id": 2,
+                "id": Lesson.objects.latest('pk').pk,
                 "course": self.course.name,
                 "name": "TEST1",
                 "description": "TEST1",
                 "preview": None,
                 "video_url": self.lesson.video_url,
-                "owner": self.user.pk
+                "amount": 0,
+                "owner": self.user.pk,
+                "updated_at": self.format_datetime(Lesson.objects.latest('pk').updated_at)
             }
         )
 
@@ -90,7 +140,9 @@ class LessonTestCase(APITestCase):
                         "description": self.lesson.description,
                         "preview": None,
                         "video_url": self.lesson.video_url,
-                        "owner": self.user.pk
+                        "amount": 0,
+                        "owner": self.user.pk,
+                        "updated_at": self.format_datetime(self.lesson.updated_at)
                     }
                 ]
             }
@@ -118,7 +170,9 @@ class LessonTestCase(APITestCase):
                 "description": self.lesson.description,
                 "preview": None,
                 "video_url": self.lesson.video_url,
-                "owner": self.user.pk
+                "amount": 0,
+                "owner": self.user.pk,
+                "updated_at": self.format_datetime(self.lesson.updated_at)
             }
         )
 
@@ -151,7 +205,9 @@ class LessonTestCase(APITestCase):
                 "description": self.lesson.description,
                 "preview": None,
                 "video_url": "https://youtube.com/test2/",
-                "owner": self.user.pk
+                "amount": 0,
+                "owner": self.user.pk,
+                "updated_at": self.format_datetime(Lesson.objects.get(pk=self.lesson.pk).updated_at)
             }
         )
 
@@ -178,7 +234,9 @@ class LessonTestCase(APITestCase):
                 "description": "TEST3",
                 "preview": None,
                 "video_url": "https://youtube.com/test3/",
-                "owner": self.user.pk
+                "amount": 0,
+                "owner": self.user.pk,
+                "updated_at": self.format_datetime(Lesson.objects.get(pk=self.lesson.pk).updated_at)
             }
         )
 
@@ -226,9 +284,11 @@ class SubscriptionTestCase(APITestCase):
     def test_create_subscription(self):
         """ Тестирование подписки на курс """
 
+        # Подписка на курс из setUp уже есть, подписываемся на другой курс
+        other_course = Course.objects.create(name="OTHER", description="OTHER", owner=self.user)
         expected_data = {
             'user': self.user.pk,
-            'course': self.course.pk,
+            'course': other_course.pk,
             'is_subscribed': True
         }
 
@@ -251,13 +311,33 @@ class SubscriptionTestCase(APITestCase):
         self.assertEqual(
             response.json(),
             {
-                "id": 2,
+                "id": Subscription.objects.latest('pk').pk,
                 "is_subscribed": True,
+                "delivery_mode": "immediate",
                 "user": self.user.pk,
-                "course": self.course.pk
+                "course": other_course.pk
             }
         )
 
+    def test_create_duplicate_subscription(self):
+        """ Тестирование повторной подписки на тот же курс """
+
+        response = self.client.post(
+            reverse('education:subscription-list'),
+            data={'user': self.user.pk, 'course': self.course.pk, 'is_subscribed': True},
+            HTTP_AUTHORIZATION=self.token
+        )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_400_BAD_REQUEST
+        )
+
+        self.assertEqual(
+            Subscription.objects.all().count(),
+            1
+        )
+
     def test_unsubscribe(self):
         """ Тестирование отписки на курс """
 
@@ -288,6 +368,7 @@ class SubscriptionTestCase(APITestCase):
             {
                 "id": self.subscription.pk,
                 "is_subscribed": False,
+                "delivery_mode": "immediate",
                 "user": self.user.pk,
                 "course": self.course.pk
             }
@@ -311,6 +392,12 @@ class SubscriptionTestCase(APITestCase):
             1
         )
 
+        # Список подписок выводится без пагинации
+        self.assertEqual(
+            [subscription['id'] for subscription in response.json()],
+            [self.subscription.pk]
+        )
+
     def test_subscription_retrieve(self):
         """ Тестирование вывода одной подписки """
 
@@ -329,6 +416,7 @@ class SubscriptionTestCase(APITestCase):
             {
                 "id": self.subscription.pk,
                 "is_subscribed": False,
+                "delivery_mode": "immediate",
                 "user": self.user.pk,
                 "course": self.course.pk
             }
@@ -356,3 +444,1734 @@ class SubscriptionTestCase(APITestCase):
         self.user.delete()
         self.course.delete()
         self.subscription.delete()
+
+
+class CourseQueryCountTestCase(APITestCase):
+    """ Тестирование количества запросов к БД при выводе списка курсов """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='owner', password='owner')
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+
+    def create_courses(self, count):
+        """ Создание курсов с уроками и подписками текущего пользователя """
+
+        # Нумерация продолжается, так как курсы с одинаковым названием и описанием создать нельзя
+        start = Course.objects.count()
+        for number in range(start, start + count):
+            course = Course.objects.create(name=f'Course{number}', description='Description', owner=self.user)
+            Lesson.objects.create(course=course, name=f'Lesson{number}', description='Description', owner=self.user)
+            Lesson.objects.create(course=course, name=f'Lesson{number}-2', description='Description')
+            Subscription.objects.create(user=self.user, course=course, is_subscribed=True)
+
+    def get_course_list(self, query='?expand=lessons'):
+        """ Запрос списка курсов с подсчетом выполненных запросов к БД """
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('education:courses-list') + query, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, context
+
+    def test_course_list_query_count(self):
+        """ Тестирование постоянного количества запросов независимо от количества курсов на странице """
+
+        self.create_courses(1)
+        response, small_page_queries = self.get_course_list()
+        self.assertEqual(len(response.json()['results']), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_courses(9)
+        response, full_page_queries = self.get_course_list()
+        self.assertEqual(len(response.json()['results']), 10)
+
+        self.assertEqual(len(small_page_queries), len(full_page_queries))
+
+    def test_course_list_data(self):
+        """ Тестирование данных, полученных из аннотаций и предзагрузки """
+
+        self.create_courses(1)
+        response, _ = self.get_course_list()
+        course = response.json()['results'][0]
+
+        self.assertEqual(course['lessons_count'], 2)
+        self.assertEqual([lesson['name'] for lesson in course['lessons']], ['Lesson0', 'Lesson0-2'])
+        self.assertTrue(course['is_subscribed'])
+        self.assertEqual(course['owner'], self.user.first_name)
+
+    def test_course_list_sparse_fields(self):
+        """ Тестирование выбора полей: невыбранные поля не вычисляются и не читаются из БД """
+
+        self.create_courses(2)
+        response, queries = self.get_course_list('?fields=id,name,amount')
+        sql = ' '.join(query['sql'] for query in queries.captured_queries)
+
+        self.assertEqual(list(response.json()['results'][0]), ['id', 'name', 'amount'])
+        self.assertNotIn('education_lesson', sql)
+        self.assertNotIn('education_subscription', sql)
+        self.assertNotIn('"education_course"."description"', sql)
+
+    def test_course_list_without_expand(self):
+        """ Тестирование того, что без ?expand=lessons уроки не выводятся и не запрашиваются """
+
+        self.create_courses(2)
+        response, queries = self.get_course_list('')
+        sql = ' '.join(query['sql'] for query in queries.captured_queries)
+
+        self.assertNotIn('lessons', response.json()['results'][0])
+        self.assertEqual(response.json()['results'][0]['lessons_count'], 2)
+        self.assertNotIn('FROM "education_lesson"', sql)
+
+
+class CursorPaginationTestCase(APITestCase):
+    """ Тестирование курсорного режима пагинации списка уроков """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='owner', password='owner')
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+        self.course = Course.objects.create(name='Course', description='Description', owner=self.user)
+        self.lessons = [
+            Lesson.objects.create(course=self.course, name=f'Lesson{number}', description='Description',
+                                  owner=self.user)
+            for number in range(7)
+        ]
+
+    def get_page(self, url):
+        response = self.client.get(url, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def test_cursor_walk(self):
+        """ Тестирование прохода по всем страницам вперед и назад """
+
+        url = reverse('education:lesson_list') + '?cursor=&per_page=3'
+        pages = []
+        while url:
+            page = self.get_page(url)
+            pages.append([lesson['id'] for lesson in page['results']])
+            url = page['next']
+
+        self.assertEqual(len(pages), 3)
+        self.assertEqual(sum(pages, []), [lesson.pk for lesson in self.lessons])
+        self.assertEqual(page['count'], 7)
+
+        previous_page = self.get_page(page['previous'])
+        self.assertEqual([lesson['id'] for lesson in previous_page['results']], pages[1])
+
+        first_page = self.get_page(previous_page['previous'])
+        self.assertEqual([lesson['id'] for lesson in first_page['results']], pages[0])
+        self.assertIsNone(first_page['previous'])
+
+    def test_page_number_mode(self):
+        """ Тестирование того, что без параметра cursor работает постраничный режим """
+
+        page = self.get_page(reverse('education:lesson_list') + '?page=2&per_page=3')
+        self.assertEqual([lesson['id'] for lesson in page['results']], [lesson.pk for lesson in self.lessons[3:6]])
+        self.assertIn('page=3', page['next'])
+
+    def test_lesson_sparse_fields(self):
+        """ Тестирование выбора полей списка уроков """
+
+        page = self.get_page(reverse('education:lesson_list') + '?fields=id,course')
+        self.assertEqual(page['results'][0], {'id': self.lessons[0].pk, 'course': self.course.name})
+
+    def test_invalid_cursor(self):
+        """ Тестирование ответа на поврежденный курсор """
+
+        response = self.client.get(reverse('education:lesson_list') + '?cursor=broken', HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_tampered_cursor(self):
+        """ Тестирование курсора с подмененными значениями позиции """
+
+        for position in (['abc'], [None], [{}], [[1]], [2 ** 70]):
+            cursor = b64encode(json.dumps({'p': position, 'r': 0}).encode()).decode()
+            response = self.client.get(reverse('education:lesson_list') + f'?cursor={cursor}',
+                                       HTTP_AUTHORIZATION=self.token)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, position)
+
+        cursor = b64encode(json.dumps({'p': [str(self.lessons[2].pk)], 'r': 0}).encode()).decode()
+        page = self.get_page(reverse('education:lesson_list') + f'?cursor={cursor}')
+        self.assertEqual([lesson['id'] for lesson in page['results']], [lesson.pk for lesson in self.lessons[3:]])
+
+
+class PaymentsListTestCase(APITestCase):
+    """ Тестирование вывода списка платежей """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='moderator', password='moderator', role=UserRoles.MODERATOR)
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+        self.course = Course.objects.create(name='Course', description='Description', owner=self.user)
+        self.lesson = Lesson.objects.create(course=self.course, name='Lesson', description='Description',
+                                            owner=self.user)
+
+    def create_payments(self, count):
+        Payments.objects.bulk_create(
+            Payments(course=self.course, lesson=self.lesson, amount=number, owner=self.user)
+            for number in range(count)
+        )
+
+    def get_payments_list(self, query=''):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('education:payments_list') + query, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json(), len(context)
+
+    def test_payments_list_paginated(self):
+        """ Тестирование пагинации списка платежей по умолчанию """
+
+        self.create_payments(15)
+        data, _ = self.get_payments_list()
+
+        self.assertEqual(data['count'], 15)
+        self.assertEqual(len(data['results']), 10)
+        self.assertEqual(data['results'][0]['course'], self.course.name)
+        self.assertEqual(data['results'][0]['lesson'], self.lesson.name)
+        self.assertEqual(data['results'][0]['owner'], self.user.first_name)
+
+    def test_payments_list_query_count(self):
+        """ Тестирование постоянного количества запросов независимо от количества платежей на странице """
+
+        self.create_payments(1)
+        _, small_page_queries = self.get_payments_list()
+        self.create_payments(20)
+        _, full_page_queries = self.get_payments_list('?per_page=20')
+
+        self.assertEqual(small_page_queries, full_page_queries)
+
+    def test_payments_cursor(self):
+        """ Тестирование курсорной пагинации платежей по дате и id """
+
+        self.create_payments(5)
+        data, _ = self.get_payments_list('?cursor=&per_page=3')
+        next_data, _ = self.get_payments_list('?' + data['next'].split('?', 1)[1])
+
+        ids = [payment['id'] for payment in data['results'] + next_data['results']]
+        self.assertEqual(ids, list(Payments.objects.order_by('payment_date', 'id').values_list('id', flat=True)))
+        self.assertIsNone(next_data['next'])
+
+    def test_payments_tampered_cursor(self):
+        """ Тестирование курсора с подмененной датой платежа """
+
+        for position in (['yesterday', 1], [{}, 1], [None, 1]):
+            cursor = b64encode(json.dumps({'p': position, 'r': 0}).encode()).decode()
+            response = self.client.get(reverse('education:payments_list') + f'?cursor={cursor}',
+                                       HTTP_AUTHORIZATION=self.token)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, position)
+
+
+class CourseCacheTestCase(APITestCase):
+    """ Тестирование кеширования ответов по курсам """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        cache.clear()
+        self.user = User.objects.create(email='owner', password='owner')
+        self.other_user = User.objects.create(email='other', password='other')
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+        self.course = Course.objects.create(name='Course', description='Description', owner=self.user)
+
+    def get_course(self, token=None):
+        return self.client.get(
+            reverse('education:courses-detail', kwargs={'pk': self.course.pk}),
+            HTTP_AUTHORIZATION=token or self.token
+        )
+
+    def test_cache_hit(self):
+        """ Тестирование повторного ответа из кеша и счетчиков попаданий """
+
+        first = self.get_course()
+        second = self.get_course()
+
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(get_metrics()['course_cache.hit'], 1)
+        self.assertEqual(get_metrics()['course_cache.miss'], 1)
+
+    def test_cache_invalidation(self):
+        """ Тестирование сброса кеша при изменении уроков и подписок курса """
+
+        self.get_course()
+        # Версия кеша меняется после фиксации транзакции
+        with self.captureOnCommitCallbacks() as callbacks:
+            Lesson.objects.create(course=self.course, name='Lesson', description='Description', owner=self.user)
+        self.assertEqual(self.get_course()['X-Cache'], 'HIT')
+        for callback in callbacks:
+            callback()
+        response = self.get_course()
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['lessons_count'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Subscription.objects.create(user=self.user, course=self.course, is_subscribed=True)
+        response = self.get_course()
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertTrue(response.json()['is_subscribed'])
+
+    def test_cache_invalidation_by_owner(self):
+        """ Тестирование сброса кеша при смене имени владельца курса """
+
+        self.get_course()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Owner'
+            self.user.save()
+        response = self.get_course()
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['owner'], 'Owner')
+
+    def test_cache_kept_by_unpaid_payment(self):
+        """ Тестирование того, что кеш сбрасывают только платежи, меняющие выручку курса """
+
+        self.get_course()
+        with self.captureOnCommitCallbacks(execute=True):
+            payment = Payments.objects.create(owner=self.user, course=self.course, amount=100)
+        self.assertEqual(self.get_course()['X-Cache'], 'HIT')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            payment.payment_status = Payments.PAYMENT_PAID
+            payment.save()
+        response = self.get_course()
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['revenue_total'], 100)
+
+    def test_cache_per_user(self):
+        """ Тестирование того, что ответ одного пользователя не отдается другому """
+
+        self.get_course()
+        response = self.get_course(f'Bearer {AccessToken.for_user(self.other_user)}')
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(get_metrics()['course_cache.miss'], 2)
+
+
+class CourseCountersTestCase(APITestCase):
+    """ Тестирование денормализованных счетчиков курса """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='owner', password='owner')
+        self.course = Course.objects.create(name='Course', description='Description', owner=self.user)
+        self.other_course = Course.objects.create(name='Other', description='Description', owner=self.user)
+
+    def assertCounters(self, course, lessons_count, subscribers_count, revenue_total):
+        course.refresh_from_db()
+        self.assertEqual(
+            (course.lessons_count, course.subscribers_count, course.revenue_total),
+            (lessons_count, subscribers_count, revenue_total)
+        )
+
+    def test_lessons_count(self):
+        """ Тестирование счетчика уроков при создании, переносе и удалении урока """
+
+        lesson = Lesson.objects.create(course=self.course, name='Lesson', description='Description')
+        self.assertCounters(self.course, 1, 0, 0)
+
+        lesson.course = self.other_course
+        lesson.save()
+        self.assertCounters(self.course, 0, 0, 0)
+        self.assertCounters(self.other_course, 1, 0, 0)
+
+        Lesson.objects.get(pk=lesson.pk).delete()
+        self.assertCounters(self.other_course, 0, 0, 0)
+
+    def test_subscribers_count(self):
+        """ Тестирование счетчика подписчиков при подписке и отписке """
+
+        subscription = Subscription.objects.create(user=self.user, course=self.course, is_subscribed=True)
+        self.assertCounters(self.course, 0, 1, 0)
+
+        subscription.is_subscribed = False
+        subscription.save()
+        self.assertCounters(self.course, 0, 0, 0)
+
+    def test_revenue_total(self):
+        """ Тестирование выручки курса по оплатам курса и его уроков """
+
+        lesson = Lesson.objects.create(course=self.course, name='Lesson', description='Description')
+        Payments.objects.create(course=self.course, amount=100, owner=self.user, payment_status=Payments.PAYMENT_PAID)
+        payment = Payments.objects.create(lesson=lesson, amount=50, owner=self.user,
+                                          payment_status=Payments.PAYMENT_PAID)
+        # Неоплаченная попытка в выручку не входит
+        unpaid = Payments.objects.create(course=self.course, amount=700, owner=self.user,
+                                         payment_status=Payments.PAYMENT_UNPAID)
+        self.assertCounters(self.course, 1, 0, 150)
+
+        payment.delete()
+        self.assertCounters(self.course, 1, 0, 100)
+
+        unpaid.payment_status = Payments.PAYMENT_PAID
+        unpaid.save()
+        self.assertCounters(self.course, 1, 0, 800)
+
+    def test_revenue_total_webhook(self):
+        """ Тестирование выручки при смене статуса событиями Stripe (bulk_update без сигналов) """
+
+        lesson = Lesson.objects.create(course=self.course, name='Lesson', description='Description')
+        payment = Payments.objects.create(course=self.course, amount=100, stripe_session_id='cs_1')
+        Payments.objects.create(lesson=lesson, amount=50, stripe_session_id='cs_2')
+        Payments.objects.create(course=self.other_course, amount=300, stripe_session_id='cs_3')
+        self.assertCounters(self.course, 1, 0, 0)
+
+        changed_at = timezone.now()
+        apply_session_updates([
+            ({'id': 'cs_1'}, Payments.PAYMENT_PAID, changed_at),
+            ({'id': 'cs_2'}, Payments.PAYMENT_PAID, changed_at),
+            ({'id': 'cs_3'}, Payments.PAYMENT_EXPIRED, changed_at),
+        ])
+        self.assertCounters(self.course, 1, 0, 150)
+        self.assertCounters(self.other_course, 0, 0, 0)
+
+        # Повтор события по оплаченному платежу выручку не меняет
+        apply_session_updates([({'id': 'cs_1'}, Payments.PAYMENT_PAID, changed_at)])
+        self.assertCounters(self.course, 1, 0, 150)
+        Payments.objects.get(pk=payment.pk).delete()
+        self.assertCounters(self.course, 1, 0, 50)
+
+    def test_recount_command(self):
+        """ Тестирование исправления расхождений командой пересчета """
+
+        Lesson.objects.create(course=self.course, name='Lesson', description='Description')
+        Subscription.objects.create(user=self.user, course=self.course, is_subscribed=True)
+        Payments.objects.create(course=self.course, amount=100, owner=self.user, payment_status=Payments.PAYMENT_PAID)
+        Payments.objects.create(course=self.course, amount=700, owner=self.user)
+        Course.objects.update(lessons_count=10, subscribers_count=10, revenue_total=10)
+
+        call_command('recount_course_counters', stdout=StringIO())
+
+        self.assertCounters(self.course, 1, 1, 100)
+        self.assertCounters(self.other_course, 0, 0, 0)
+
+
+class ContentHashMigrationTestCase(TransactionTestCase):
+    """ Тестирование миграции повторов курсов и уроков, оставшихся без хеша содержимого """
+
+    migrate_from = [('education', '0023_stripe_events')]
+    migrate_to = [('education', '0024_rename_content_duplicates')]
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД: схема до миграции и повторы без хеша """
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        apps = executor.loader.project_state(self.migrate_from).apps
+        old_course, old_lesson = apps.get_model('education', 'Course'), apps.get_model('education', 'Lesson')
+
+        self.course = old_course.objects.create(name='Course', description='Description')
+        old_course.objects.create(name='Course (2)', description='Description')
+        # Повторы до 0017 - хеш при сохранении считается всегда, поэтому пустой хеш записывается через update
+        self.duplicate = old_course.objects.create(name='Other', description='Description')
+        old_course.objects.filter(pk=self.duplicate.pk).update(name='Course', content_hash=None)
+
+        old_lesson.objects.create(name='Lesson', description='Description', course=self.course)
+        self.lesson_duplicate = old_lesson.objects.create(name='Other', description='Description', course=self.course)
+        old_lesson.objects.filter(pk=self.lesson_duplicate.pk).update(name='Lesson', content_hash=None)
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_duplicates_renamed(self):
+        """ Тестирование переименования повторов: хеш заполнен, запись снова можно изменить """
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_to)
+
+        duplicate = Course.objects.get(pk=self.duplicate.pk)
+        self.assertEqual((duplicate.name, duplicate.content_hash),
+                         ('Course (3)', get_content_hash('Course (3)', 'Description')))
+        self.assertEqual(Lesson.objects.get(pk=self.lesson_duplicate.pk).name, 'Lesson (2)')
+        self.assertEqual(Course.objects.get(pk=self.course.pk).name, 'Course')
+
+        duplicate.amount = 100
+        duplicate.save()
+        self.assertFalse(Course.objects.filter(content_hash__isnull=True).exists())
+
+
+class CompiledSerializerTestCase(APITestCase):
+    """ Тестирование быстрой сериализации списков - вывод должен совпадать с ModelSerializer байт в байт """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='moderator', password='moderator', first_name='Moderator',
+                                        role=UserRoles.MODERATOR)
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+        self.course = Course.objects.create(name='Course', description='Description', owner=self.user)
+        Lesson.objects.create(course=self.course, name='Lesson', description='Description',
+                              preview='lessons/preview.png', video_url='https://youtube.com', owner=self.user)
+        Lesson.objects.create(course=self.course, name='Lesson2', description='Description')
+        Payments.objects.create(course=self.course, amount=100, owner=self.user)
+        Payments.objects.create(lesson=Lesson.objects.first(), payment_method='cash')
+
+    def assertSameOutput(self, url, serializer_class, queryset):
+        response = self.client.get(url, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        context = {'request': response.renderer_context['request']}
+        expected = {
+            'count': queryset.count(),
+            'next': None,
+            'previous': None,
+            'results': serializer_class(queryset, many=True, context=context).data,
+        }
+        self.assertEqual(response.content, JSONRenderer().render(expected))
+
+    def test_lesson_list(self):
+        """ Тестирование совпадения вывода списка уроков """
+
+        self.assertSameOutput(reverse('education:lesson_list'), LessonSerializer, Lesson.objects.order_by('pk'))
+
+    def test_payments_list(self):
+        """ Тестирование совпадения вывода списка платежей """
+
+        self.assertSameOutput(reverse('education:payments_list'), PaymentsSerializer,
+                              Payments.objects.order_by('payment_date', 'id'))
+
+
+class ConditionalGetTestCase(APITestCase):
+    """ Тестирование условных GET-запросов (ETag, Last-Modified) для курсов и уроков """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='owner', password='owner')
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+        self.course = Course.objects.create(name='Course', description='Description', owner=self.user)
+        self.lesson = Lesson.objects.create(course=self.course, name='Lesson', description='Description',
+                                            owner=self.user)
+
+    def get(self, url, **headers):
+        return self.client.get(url, HTTP_AUTHORIZATION=self.token, **headers)
+
+    def test_etag_not_modified(self):
+        """ Тестирование ответа 304 на неизмененные курсы и уроки """
+
+        for url in (
+            reverse('education:courses-list'),
+            reverse('education:courses-detail', kwargs={'pk': self.course.pk}),
+            reverse('education:lesson_list'),
+            reverse('education:lesson_get', kwargs={'pk': self.lesson.pk}),
+        ):
+            response = self.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            with CaptureQueriesContext(connection) as context:
+                not_modified = self.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(not_modified.content, b'')
+            # Только запрос пользователя из токена и запрос валидаторов, без выборки и сериализации данных
+            self.assertEqual(len(context), 2)
+
+    def test_last_modified(self):
+        """ Тестирование ответа 304 по If-Modified-Since """
+
+        url = reverse('education:lesson_get', kwargs={'pk': self.lesson.pk})
+        response = self.get(url)
+        not_modified = self.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_etag_changes_with_lessons(self):
+        """ Тестирование смены ETag курса при изменении его уроков """
+
+        url = reverse('education:courses-detail', kwargs={'pk': self.course.pk})
+        etag = self.get(url)['ETag']
+
+        self.lesson.name = 'Changed'
+        self.lesson.save()
+        response = self.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_changes_with_course_name(self):
+        """ Тестирование смены ETag уроков при переименовании курса - название курса выводится в уроке """
+
+        for url in (reverse('education:lesson_list'), reverse('education:lesson_get', kwargs={'pk': self.lesson.pk})):
+            etag = self.get(url)['ETag']
+            self.course.name = f'Renamed {url}'
+            self.course.save()
+            response = self.get(url, HTTP_IF_NONE_MATCH=etag)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn(f'Renamed {url}', response.content.decode())
+
+    def test_etag_changes_with_owner_name(self):
+        """ Тестирование смены ETag курсов при изменении имени владельца - оно выводится в курсе """
+
+        urls = (reverse('education:courses-list'), reverse('education:courses-detail', kwargs={'pk': self.course.pk}))
+        for url in urls:
+            etag = self.get(url)['ETag']
+            self.user.first_name = f'Renamed {url}'
+            self.user.save()
+            response = self.get(url, HTTP_IF_NONE_MATCH=etag)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_missing_object(self):
+        """ Тестирование того, что для отсутствующего объекта отдается 404, а не 304 """
+
+        url = reverse('education:lesson_get', kwargs={'pk': self.lesson.pk + 1000})
+        response = self.get(url, HTTP_IF_NONE_MATCH='*')
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class PaymentsExportTestCase(APITestCase):
+    """ Тестирование потоковой выгрузки платежей """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='moderator', password='moderator', first_name='Moderator',
+                                        role=UserRoles.MODERATOR)
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+        self.course = Course.objects.create(name='Course', description='Description', owner=self.user)
+        self.cash = Payments.objects.create(course=self.course, amount=100, owner=self.user, payment_method='cash')
+        self.transfer = Payments.objects.create(course=self.course, amount=200, owner=self.user)
+
+    def export(self, query):
+        response = self.client.get(reverse('education:payments_export') + query, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_ndjson(self):
+        """ Тестирование выгрузки NDJSON с фильтром по способу оплаты """
+
+        content = self.export('?payment_method=cash')
+        rows = [json.loads(line) for line in content.splitlines()]
+
+        self.assertEqual(rows, [dict(PaymentsSerializer(self.cash).data)])
+
+    def test_export_csv(self):
+        """ Тестирование выгрузки CSV с фильтром по диапазону дат """
+
+        query = urlencode({'export_format': 'csv', 'payment_date_after': self.transfer.payment_date.isoformat()})
+        rows = list(csv.reader(StringIO(self.export('?' + query))))
+
+        self.assertEqual(rows[0], list(PaymentsSerializer().fields))
+        self.assertEqual([row[0] for row in rows[1:]], [str(self.transfer.pk)])
+
+    def test_export_command(self):
+        """ Тестирование выгрузки командой """
+
+        output = StringIO()
+        call_command('export_payments', '--payment-method', 'transfer', stdout=output)
+
+        self.assertEqual([json.loads(line)['id'] for line in output.getvalue().splitlines()], [self.transfer.pk])
+
+
+class PaymentsRollupTestCase(APITestCase):
+    """ Тестирование дневных итогов выручки и аналитики по ним """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='moderator', password='moderator', first_name='Moderator',
+                                        role=UserRoles.MODERATOR)
+        self.owner = User.objects.create(email='owner', password='owner', first_name='Owner')
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+        self.course = Course.objects.create(name='Course', description='Description', owner=self.owner)
+        self.other_course = Course.objects.create(name='Other', description='Description', owner=self.user)
+        self.lesson = Lesson.objects.create(name='Lesson', description='Description', course=self.course,
+                                            owner=self.owner, video_url='https://youtube.com')
+        self.create_payments()
+
+    def create_payments(self, paid_ago=timedelta(minutes=10)):
+        # Оплаты записаны раньше запаса WATERMARK_SAFETY_LAG, неоплаченная попытка в итоги не входит
+        paid = {'payment_status': Payments.PAYMENT_PAID, 'status_changed_at': timezone.now() - paid_ago}
+        Payments.objects.create(course=self.course, amount=100, owner=self.user, payment_method='cash', **paid)
+        Payments.objects.create(course=self.course, amount=200, owner=self.user, **paid)
+        Payments.objects.create(lesson=self.lesson, amount=50, owner=self.user, **paid)
+        Payments.objects.create(course=self.other_course, amount=300, owner=self.user, **paid)
+        Payments.objects.create(course=self.other_course, amount=700, owner=self.user,
+                                payment_status=Payments.PAYMENT_UNPAID)
+
+    def get_analytics(self, query, token=None):
+        response = self.client.get(reverse('education:payments_analytics') + query,
+                                   HTTP_AUTHORIZATION=token or self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()['results']
+
+    def get_raw_totals(self):
+        """ Те же суммы, посчитанные напрямую по платежам """
+
+        return list(Payments.objects.filter(payment_status=Payments.PAYMENT_PAID).annotate(
+            day=TruncDate('payment_date')
+        ).values(
+            'day', 'payment_method'
+        ).annotate(payments_count=Count('pk'), amount_total=Sum('amount')).order_by('day', 'payment_method'))
+
+    def get_rollup_totals(self):
+        return list(PaymentsDailyRollup.objects.values('day', 'payment_method').annotate(
+            payments_count=Sum('payments_count'), amount_total=Sum('amount_total')
+        ).order_by('day', 'payment_method'))
+
+    def test_incremental_rollup(self):
+        """ Тестирование инкрементального обновления: повторный запуск учитывает только новые платежи """
+
+        self.assertEqual(update_payments_rollup(batch_size=3), 4)
+        self.assertEqual(self.get_rollup_totals(), self.get_raw_totals())
+
+        self.assertEqual(update_payments_rollup(), 0)
+        self.create_payments()
+        self.assertEqual(update_payments_rollup(), 4)
+        self.assertEqual(self.get_rollup_totals(), self.get_raw_totals())
+
+    def test_recent_payments_wait_for_lag(self):
+        """
+        Тестирование запаса по времени: оплата, записанная позже уже обработанных, но в пределах
+        WATERMARK_SAFETY_LAG (ее транзакция могла быть еще не зафиксирована), учитывается следующим запуском
+        """
+
+        update_payments_rollup()
+        self.create_payments(paid_ago=timedelta(seconds=1))
+        self.assertEqual(update_payments_rollup(), 0)
+
+        Payments.objects.filter(status_changed_at__gt=timezone.now() - timedelta(minutes=1)).update(
+            status_changed_at=timezone.now() - settings.WATERMARK_SAFETY_LAG - timedelta(seconds=1)
+        )
+        self.assertEqual(update_payments_rollup(), 4)
+        self.assertEqual(self.get_rollup_totals(), self.get_raw_totals())
+
+    def test_rebuild_rollup(self):
+        """ Тестирование полного пересчета после изменения уже учтенного платежа """
+
+        update_payments_rollup()
+        Payments.objects.filter(payment_method='cash').update(amount=1000)
+        call_command('rebuild_payments_rollup', stdout=StringIO())
+
+        self.assertEqual(self.get_rollup_totals(), self.get_raw_totals())
+        self.assertEqual(rebuild_payments_rollup(), 4)
+
+    def test_analytics_by_course(self):
+        """ Тестирование аналитики по курсам: оплата урока входит в выручку курса урока """
+
+        update_payments_rollup()
+        rows = self.get_analytics('?group_by=course')
+
+        self.assertEqual(rows, [
+            {'course': self.course.pk, 'payments_count': 3, 'amount_total': 350},
+            {'course': self.other_course.pk, 'payments_count': 1, 'amount_total': 300},
+        ])
+
+    def test_analytics_filters(self):
+        """ Тестирование аналитики с фильтрами и группировкой по дню и способу оплаты """
+
+        update_payments_rollup()
+        day = PaymentsDailyRollup.objects.values_list('day', flat=True).first().isoformat()
+        query = urlencode({'group_by': 'day,payment_method', 'course': self.course.pk, 'day_after': day})
+
+        self.assertEqual(self.get_analytics('?' + query), [
+            {'day': day, 'payment_method': 'cash', 'payments_count': 1, 'amount_total': 100},
+            {'day': day, 'payment_method': 'transfer', 'payments_count': 2, 'amount_total': 250},
+        ])
+
+        response = self.client.get(reverse('education:payments_analytics') + '?group_by=owner',
+                                   HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_analytics_owner(self):
+        """ Тестирование аналитики для владельца - только выручка своих курсов """
+
+        update_payments_rollup()
+        rows = self.get_analytics('?group_by=course', token=f'Bearer {AccessToken.for_user(self.owner)}')
+
+        self.assertEqual([row['course'] for row in rows], [self.course.pk])
+
+
+class ContentHashTestCase(APITestCase):
+    """ Тестирование уникальности названия и описания курсов и уроков по хешу содержимого """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='owner', password='owner', first_name='Owner')
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+        self.course = Course.objects.create(name='Course', description='Description', owner=self.user)
+
+    def create_course(self, name='Course', description='Description'):
+        return self.client.post(
+            reverse('education:courses-list'),
+            data={'name': name, 'description': description, 'owner': self.user.first_name},
+            HTTP_AUTHORIZATION=self.token
+        )
+
+    def test_hash_maintained_on_save(self):
+        """ Тестирование пересчета хеша при изменении названия """
+
+        self.assertEqual(self.course.content_hash, get_content_hash('Course', 'Description'))
+
+        self.course.name = 'Renamed'
+        self.course.save()
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.content_hash, get_content_hash('Renamed', 'Description'))
+
+    def test_duplicate_rejected_by_hash_lookup(self):
+        """ Тестирование отказа в создании повторного курса: проверка идет по хешу, а не по тексту описания """
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.create_course()
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'non_field_errors': [ContentHashUniqueValidator.message]})
+        lookups = [query['sql'] for query in context.captured_queries if 'content_hash' in query['sql']]
+        self.assertEqual(len(lookups), 1)
+        self.assertNotIn('"description" =', lookups[0])
+
+        self.assertEqual(self.create_course(description='Other').status_code, status.HTTP_201_CREATED)
+
+    def test_concurrent_duplicate_rejected_by_constraint(self):
+        """ Тестирование повтора, созданного после проверки валидатором: срабатывает уникальный индекс """
+
+        with mock.patch.object(ContentHashUniqueValidator, '__call__', return_value=None):
+            response = self.create_course()
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'non_field_errors': [ContentHashUniqueValidator.message]})
+        self.assertEqual(Course.objects.count(), 1)
+
+    def test_partial_update_keeps_own_hash(self):
+        """ Тестирование частичного изменения курса без изменения названия и описания """
+
+        response = self.client.patch(
+            reverse('education:courses-detail', kwargs={'pk': self.course.pk}),
+            data={'amount': 100},
+            HTTP_AUTHORIZATION=self.token
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('content_hash', response.json())
+
+
+class OwnershipTestCase(APITestCase):
+    """ Тестирование набора курсов пользователя для проверки прав владельца """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        cache.clear()
+        self.user = User.objects.create(email='owner', password='owner', first_name='Owner')
+        self.other = User.objects.create(email='other', password='other', first_name='Other')
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+        self.course = Course.objects.create(name='Own', description='Description', owner=self.user)
+        self.other_course = Course.objects.create(name='Other', description='Description', owner=self.other)
+        self.lesson = Lesson.objects.create(name='Lesson', description='Description', course=self.other_course,
+                                            owner=self.user, video_url='https://youtube.com')
+
+    def get_request(self, user):
+        request = APIRequestFactory().get('/')
+        request.user = user
+        return request
+
+    def test_owned_course_ids(self):
+        """ Тестирование набора: свои курсы и курсы своих уроков, один запрос на запрос пользователя """
+
+        request = self.get_request(self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_owned_course_ids(request), {self.course.pk, self.other_course.pk})
+            get_owned_course_ids(request)
+
+        # Следующий запрос пользователя берет набор из кеша
+        with self.assertNumQueries(0):
+            get_owned_course_ids(self.get_request(self.user))
+
+        self.assertEqual(get_owned_course_ids(self.get_request(self.other)), {self.other_course.pk})
+
+    def test_owned_course_ids_invalidation(self):
+        """ Тестирование сброса закешированного набора при изменении уроков """
+
+        get_owned_course_ids(self.get_request(self.user))
+        # Версия наборов меняется после фиксации транзакции
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.lesson.delete()
+        self.assertEqual(get_owned_course_ids(self.get_request(self.user)), {self.course.pk, self.other_course.pk})
+        for callback in callbacks:
+            callback()
+
+        self.assertEqual(get_owned_course_ids(self.get_request(self.user)), {self.course.pk})
+
+    def test_lesson_delete_permission(self):
+        """ Тестирование проверки прав на удаление урока по набору курсов без загрузки курса """
+
+        url = reverse('education:lesson_delete', kwargs={'pk': self.lesson.pk})
+        response = self.client.delete(url, HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.other)}')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.delete(url, HTTP_AUTHORIZATION=self.token)
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse([query for query in context.captured_queries if 'EXISTS' in query['sql']])
+        self.assertEqual(len([query for query in context.captured_queries if 'UNION' in query['sql']]), 1)
+
+
+class SubscriberNotifyTestCase(APITestCase):
+    """ Тестирование рассылки уведомлений подписчикам пачками """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.owner = User.objects.create(email='owner', password='owner', first_name='Owner')
+        self.course = Course.objects.create(name='Course', description='Description', owner=self.owner)
+        for number in range(5):
+            user = User.objects.create(email=f'subscriber-{number}@lms.local', first_name=f'User {number}')
+            Subscription.objects.create(user=user, course=self.course, is_subscribed=True)
+        unsubscribed = User.objects.create(email='unsubscribed@lms.local', first_name='Unsubscribed')
+        Subscription.objects.create(user=unsubscribed, course=self.course, is_subscribed=False)
+
+    @override_settings(NOTIFY_CHUNK_SIZE=2)
+    def test_notify_chunks(self):
+        """ Тестирование деления активных подписчиков на пачки без загрузки подписок по одной """
+
+        # Название курса, запись изменения для ежедневных сводок и поток адресов подписчиков
+        with mock.patch.object(send_notify_chunk, 'delay') as delay, self.assertNumQueries(3):
+            self.assertEqual(subscriber_notify(self.course.pk), 3)
+
+        emails = [email for call in delay.call_args_list for email, _ in call.args[1]]
+        self.assertEqual(emails, [f'subscriber-{number}@lms.local' for number in range(5)])
+        self.assertEqual(delay.call_args_list[0].args[0], 'Изменения в уроках вашего курса - Course')
+
+    def test_send_chunk(self):
+        """ Тестирование отправки пачки персональных писем """
+
+        items = [['first@lms.local', 'First'], ['second@lms.local', 'Second']]
+        self.assertEqual(send_notify_chunk('Subject', items), 2)
+
+        self.assertEqual([message.to for message in mail.outbox], [['first@lms.local'], ['second@lms.local']])
+        self.assertEqual([message.body for message in mail.outbox], ['First', 'Second'])
+
+    def test_send_chunk_retry(self):
+        """ Тестирование повтора пачки только для писем, которые не успели отправиться """
+
+        items = [['first@lms.local', 'First'], ['second@lms.local', 'Second']]
+        error = MailChunkError(1, OSError('connection lost'))
+        with mock.patch('education.tasks.send_mail_chunk', side_effect=error), \
+                mock.patch.object(send_notify_chunk, 'retry', side_effect=RuntimeError) as retry:
+            with self.assertRaises(RuntimeError):
+                send_notify_chunk('Subject', items)
+
+        self.assertEqual(retry.call_args.kwargs['args'], ('Subject', items[1:]))
+
+
+class NotificationOutboxTestCase(APITestCase):
+    """ Тестирование уведомлений об изменении уроков через outbox """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        cache.clear()
+        self.owner = User.objects.create(email='owner', password='owner', first_name='Owner')
+        self.token = f'Bearer {AccessToken.for_user(self.owner)}'
+        self.course = Course.objects.create(name='Course', description='Description', owner=self.owner)
+        self.subscriber = User.objects.create(email='subscriber@lms.local', first_name='Subscriber')
+        Subscription.objects.create(user=self.subscriber, course=self.course, is_subscribed=True)
+        self.lessons = [
+            Lesson.objects.create(name=f'Lesson {number}', description='Description', course=self.course,
+                                  owner=self.owner, video_url='https://youtube.com')
+            for number in range(3)
+        ]
+
+    def make_due(self):
+        """ Окно объединения прошло - события готовы к обработке """
+
+        Outbox.objects.update(available_at=timezone.now())
+
+    def test_enqueue_race_with_dispatcher(self):
+        """
+        Тестирование гонки при записи события: параллельный запрос вставил ожидающее событие, и диспетчер
+        захватил его раньше, чем get_or_create повторил поиск - вставка повторяется, а не падает с 500
+        """
+
+        # Событие, вставленное параллельным запросом, уже захвачено диспетчером
+        Outbox.objects.all().delete()
+        Outbox.objects.create(topic='course_changed', key=str(self.course.pk), payload={},
+                              status=Outbox.STATUS_IN_PROGRESS)
+        get_or_create = QuerySet.get_or_create
+        calls = []
+
+        def racing_get_or_create(queryset, **kwargs):
+            calls.append(kwargs)
+            if len(calls) == 1:
+                # Вставка первого вызова столкнулась с событием параллельного запроса, пока оно еще ожидало
+                raise IntegrityError('duplicate key value violates unique constraint '
+                                     '"outbox_pending_topic_key_unique"')
+            return get_or_create(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'get_or_create', autospec=True, side_effect=racing_get_or_create):
+            self.assertTrue(enqueue('course_changed', self.course.pk, {'course_id': self.course.pk}))
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(sorted(Outbox.objects.values_list('status', flat=True)),
+                         [Outbox.STATUS_IN_PROGRESS, Outbox.STATUS_PENDING])
+
+    def test_changes_coalesced(self):
+        """ Тестирование одного события на несколько изменений уроков курса внутри окна """
+
+        for lesson in self.lessons:
+            response = self.client.patch(reverse('education:lesson_update', kwargs={'pk': lesson.pk}),
+                                         data={'amount': 10}, HTTP_AUTHORIZATION=self.token)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        event = Outbox.objects.get()
+        self.assertEqual((event.topic, event.key, event.status), ('course_changed', str(self.course.pk), 'pending'))
+        self.assertEqual(event.payload['course_id'], self.course.pk)
+        self.assertGreater(event.available_at, timezone.now() + timedelta(seconds=settings.NOTIFY_WINDOW - 10))
+
+    def test_event_rolled_back_with_lesson(self):
+        """ Тестирование отсутствия события, если транзакция изменения урока откатилась """
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            schedule_course_notification(self.lessons[0])
+            raise RuntimeError
+
+        self.assertFalse(Outbox.objects.exists())
+
+    def test_dispatch(self):
+        """ Тестирование обработки события: одна рассылка со всеми измененными уроками """
+
+        for lesson in self.lessons:
+            schedule_course_notification(lesson)
+        self.assertEqual(dispatch_outbox(), 0)
+
+        self.make_due()
+        with mock.patch.object(send_notify_chunk, 'delay') as delay:
+            self.assertEqual(dispatch_outbox(), 1)
+
+        (email, message), = delay.call_args.args[1]
+        self.assertEqual(email, 'subscriber@lms.local')
+        for lesson in self.lessons:
+            self.assertIn(f'- {lesson.name}', message)
+        self.assertEqual(Outbox.objects.get().status, Outbox.STATUS_DONE)
+        self.assertEqual(get_metrics()['outbox.dispatched'], 1)
+
+        # Следующее изменение создает новое событие
+        schedule_course_notification(self.lessons[0])
+        self.assertEqual(Outbox.objects.filter(status=Outbox.STATUS_PENDING).count(), 1)
+
+    def test_dispatch_retry(self):
+        """ Тестирование повтора с экспоненциальной задержкой и ошибки после последней попытки """
+
+        schedule_course_notification(self.lessons[0])
+        self.make_due()
+        with mock.patch.object(send_notify_chunk, 'delay', side_effect=OSError('broker is down')):
+            dispatch_outbox()
+
+            event = Outbox.objects.get()
+            self.assertEqual((event.status, event.attempts), (Outbox.STATUS_IN_PROGRESS, 1))
+            self.assertEqual(event.last_error, 'OSError: broker is down')
+            self.assertGreater(event.available_at, timezone.now() + timedelta(seconds=settings.OUTBOX_RETRY_DELAY - 5))
+
+            Outbox.objects.update(attempts=settings.OUTBOX_MAX_ATTEMPTS - 1)
+            self.make_due()
+            dispatch_outbox()
+
+        self.assertEqual(Outbox.objects.get().status, Outbox.STATUS_FAILED)
+
+    def test_claimed_event_not_reclaimed(self):
+        """ Тестирование захвата: событие в обработке другим диспетчером не берется до конца аренды """
+
+        schedule_course_notification(self.lessons[0])
+        self.make_due()
+
+        self.assertEqual(len(claim_outbox(10)), 1)
+        self.assertEqual(claim_outbox(10), [])
+
+
+class CourseDigestTestCase(APITestCase):
+    """ Тестирование ежедневной сводки изменений курсов """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.owner = User.objects.create(email='owner', password='owner', first_name='Owner')
+        self.courses = [
+            Course.objects.create(name=f'Course {number}', description='Description', owner=self.owner)
+            for number in range(3)
+        ]
+        self.digest_user = User.objects.create(email='digest@lms.local', first_name='Digest')
+        self.immediate_user = User.objects.create(email='immediate@lms.local', first_name='Immediate')
+        for course in self.courses:
+            Subscription.objects.create(user=self.digest_user, course=course, is_subscribed=True,
+                                        delivery_mode=Subscription.DELIVERY_DIGEST)
+            Subscription.objects.create(user=self.immediate_user, course=course, is_subscribed=True)
+
+    def notify(self, course):
+        with mock.patch.object(send_notify_chunk, 'delay') as delay:
+            subscriber_notify(course.pk)
+        return [email for call in delay.call_args_list for email, _ in call.args[1]]
+
+    def test_digest_subscribers_skipped_by_notify(self):
+        """ Тестирование немедленной рассылки только подписчикам без сводки """
+
+        self.assertEqual(self.notify(self.courses[0]), ['immediate@lms.local'])
+        self.assertEqual(CourseChangeEvent.objects.count(), 1)
+
+    def test_digest(self):
+        """ Тестирование одного письма со всеми измененными курсами, собранного одним запросом """
+
+        self.notify(self.courses[0])
+        self.notify(self.courses[2])
+        self.notify(self.courses[0])
+        self.make_old()
+
+        # Письма отправляются после фиксации отметки - вне транзакции задачи
+        sent_in = []
+        outer_blocks = len(connection.atomic_blocks)
+
+        def remember_state(*args):
+            watermark = Watermark.objects.get(name=DIGEST_WATERMARK)
+            sent_in.append((len(connection.atomic_blocks), watermark.processed_until is not None))
+
+        with mock.patch.object(send_notify_chunk, 'delay', side_effect=remember_state) as delay:
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(course_digest(), 1)
+        self.assertEqual(sent_in, [(outer_blocks, True)])
+
+        # Сводки всех подписчиков - один запрос к подпискам
+        self.assertEqual(len([query for query in context.captured_queries
+                              if '"education_subscription"' in query['sql']]), 1)
+
+        (email, message), = delay.call_args.args[1]
+        self.assertEqual(email, 'digest@lms.local')
+        self.assertIn('- Course 0\n- Course 2\n', message)
+        self.assertNotIn('Course 1', message)
+
+        # Повторный запуск без новых изменений ничего не отправляет
+        with mock.patch.object(send_notify_chunk, 'delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(course_digest(), 0)
+        delay.assert_not_called()
+
+    def make_old(self, age=timedelta(minutes=10)):
+        CourseChangeEvent.objects.update(changed_at=timezone.now() - age)
+
+    def test_recent_changes_wait_for_lag(self):
+        """ Тестирование запаса по времени: изменение моложе WATERMARK_SAFETY_LAG попадает в следующую сводку """
+
+        self.notify(self.courses[1])
+        with mock.patch.object(send_notify_chunk, 'delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(course_digest(), 0)
+            self.make_old()
+            self.assertEqual(course_digest(), 1)
+
+        self.assertIn('- Course 1\n', delay.call_args.args[1][0][1])
+
+    @override_settings(DIGEST_EVENT_RETENTION=timedelta(minutes=30))
+    def test_sent_changes_purged(self):
+        """ Тестирование удаления учтенных изменений старше DIGEST_EVENT_RETENTION """
+
+        self.notify(self.courses[0])
+        self.make_old(timedelta(hours=1))
+        self.notify(self.courses[1])
+        CourseChangeEvent.objects.filter(course=self.courses[1]).update(
+            changed_at=timezone.now() - timedelta(minutes=10)
+        )
+        with mock.patch.object(send_notify_chunk, 'delay'), self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(course_digest(), 1)
+
+        self.assertEqual(list(CourseChangeEvent.objects.values_list('course', flat=True)), [self.courses[1].pk])
+
+
+class StripeStubHandler(BaseHTTPRequestHandler):
+    """
+    Локальная заглушка HTTP API Stripe: создает объекты с последовательными id и запоминает запросы,
+    список сессий оплаты отдает страницами по server.page_size из server.sessions.
+    Задержка ответа (server.delay) и ответы 500 на несколько следующих запросов (server.failures) имитируют сбои Stripe
+    """
+
+    OBJECTS = {
+        '/v1/products': ('prod', 'product'),
+        '/v1/prices': ('price', 'price'),
+        '/v1/checkout/sessions': ('cs', 'checkout.session'),
+    }
+
+    def do_POST(self):
+        params = dict(parse_qsl(self.rfile.read(int(self.headers['Content-Length'] or 0)).decode()))
+        self.server.requests.append((self.path, params))
+        time.sleep(self.server.delay)
+        prefix, object_name = self.OBJECTS[self.path]
+        body = {'id': f'{prefix}_{len(self.server.requests)}', 'object': object_name, **params}
+        if object_name == 'checkout.session':
+            body['url'] = f'https://checkout.stripe.local/{body["id"]}'
+
+        code = 200
+        if self.server.failures:
+            self.server.failures -= 1
+            code, body = 500, {'error': {'type': 'api_error', 'message': 'Internal error'}}
+        self.send_json(code, body)
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        params = dict(parse_qsl(query))
+        self.server.requests.append((path, params))
+        sessions = self.server.sessions
+        start = next((number + 1 for number, session in enumerate(sessions)
+                      if session['id'] == params.get('starting_after')), 0)
+        page = sessions[start:start + self.server.page_size]
+        self.send_json(200, {'object': 'list', 'url': path, 'data': page,
+                             'has_more': start + len(page) < len(sessions)})
+
+    def send_json(self, code, body):
+        content = json.dumps(body).encode()
+        try:
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент не дождался ответа (таймаут чтения)
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StripeStubMixin:
+    """ Запуск заглушки Stripe на свободном порту на время теста """
+
+    def start_stripe_stub(self, handler=StripeStubHandler):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.server.requests = []
+        self.server.delay = self.server.failures = 0
+        self.server.sessions, self.server.page_size = [], 100
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        api_base = mock.patch.object(stripe, 'api_base', f'http://127.0.0.1:{self.server.server_port}')
+        api_base.start()
+        self.addCleanup(api_base.stop)
+
+
+@override_settings(STRIPE_SK='sk_test_stub')
+class StripePriceTestCase(StripeStubMixin, APITestCase):
+    """ Тестирование оплаты через Stripe: продукт и цена создаются один раз и хранятся в курсе """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.start_stripe_stub()
+        self.user = User.objects.create(email='user', password='user')
+        self.course = Course.objects.create(name='Course', description='Description', amount=1000)
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+
+    def pay(self):
+        response = self.client.post(reverse('education:payments_create'), data={'course': self.course.pk},
+                                    HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.json()
+
+    def get_paths(self):
+        return [path for path, _ in self.server.requests]
+
+    def test_first_payment(self):
+        """ Тестирование первой оплаты: создаются продукт, цена и сессия оплаты """
+
+        data = self.pay()
+
+        self.assertEqual(self.get_paths(), ['/v1/products', '/v1/prices', '/v1/checkout/sessions'])
+        self.assertEqual(data['payment_url'], 'https://checkout.stripe.local/cs_3')
+        self.assertEqual(data['checkout_status'], Payments.CHECKOUT_READY)
+        self.assertEqual(self.server.requests[1][1]['product'], 'prod_1')
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.stripe_product_id, self.course.stripe_price_id, self.course.stripe_price_amount),
+                         ('prod_1', 'price_2', 1000))
+
+    def test_no_lock_during_stripe_calls(self):
+        """ Тестирование создания продукта и цены без блокировки строки курса на время запросов к Stripe """
+
+        with CaptureQueriesContext(connection) as context:
+            self.pay()
+
+        self.assertFalse([query for query in context.captured_queries if 'FOR UPDATE' in query['sql']])
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.stripe_product_id, self.course.stripe_price_id), ('prod_1', 'price_2'))
+
+    def test_repeated_payment(self):
+        """ Тестирование повторной оплаты: только создание сессии оплаты с сохраненной ценой """
+
+        self.pay()
+        self.pay()
+
+        self.assertEqual(self.get_paths()[3:], ['/v1/checkout/sessions'])
+        self.assertEqual(self.server.requests[3][1]['line_items[0][price]'], 'price_2')
+
+    def test_amount_changed(self):
+        """ Тестирование оплаты после изменения цены курса: новая цена того же продукта """
+
+        self.pay()
+        Course.objects.filter(pk=self.course.pk).update(amount=1500)
+        self.pay()
+
+        self.assertEqual(self.get_paths()[3:], ['/v1/prices', '/v1/checkout/sessions'])
+        self.assertEqual(self.server.requests[3][1], {'unit_amount': '1500', 'currency': 'rub', 'product': 'prod_1'})
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.stripe_price_id, self.course.stripe_price_amount), ('price_4', 1500))
+
+
+@override_settings(STRIPE_SK='sk_test_stub')
+class AsyncCheckoutTestCase(StripeStubMixin, APITestCase):
+    """ Тестирование создания сессии оплаты задачей с Prefer: respond-async """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        cache.clear()
+        self.start_stripe_stub()
+        self.user = User.objects.create(email='user', password='user')
+        self.course = Course.objects.create(name='Course', description='Description', amount=1000)
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+
+    def pay_async(self):
+        with mock.patch.object(create_checkout_session, 'delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('education:payments_create'), data={'course': self.course.pk},
+                                        HTTP_AUTHORIZATION=self.token, HTTP_PREFER='respond-async')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        payment_id = response.json()['id']
+        delay.assert_called_once_with(payment_id)
+        return response, Payments.objects.get(pk=payment_id)
+
+    def get_status(self, payment, query=''):
+        response = self.client.get(reverse('education:payments_checkout', args=[payment.pk]) + query,
+                                   HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def test_async_payment(self):
+        """ Тестирование ответа без обращения к Stripe и создания сессии задачей """
+
+        response, payment = self.pay_async()
+
+        data = response.json()
+        self.assertEqual((data['checkout_status'], data['payment_url']), (Payments.CHECKOUT_PENDING, None))
+        self.assertEqual(response['Location'], data['status_url'])
+        self.assertEqual(response['Preference-Applied'], 'respond-async')
+        self.assertEqual(self.server.requests, [])
+        self.assertEqual((payment.owner, payment.amount), (self.user, 1000))
+
+        create_checkout_session(payment.pk)
+
+        self.assertEqual(self.get_status(payment), {
+            'id': payment.pk, 'checkout_status': Payments.CHECKOUT_READY,
+            'payment_url': 'https://checkout.stripe.local/cs_3',
+        })
+        self.assertEqual(Payments.objects.get(pk=payment.pk).stripe_session_id, 'cs_3')
+
+    def test_long_polling(self):
+        """ Тестирование ожидания ?wait=: ответ приходит, как только задача создала сессию """
+
+        _, payment = self.pay_async()
+
+        # Подменяем time только в модуле ожидания: сессия создается задачей во время первой паузы
+        with mock.patch('education.checkout.time', monotonic=time.monotonic,
+                        sleep=mock.Mock(side_effect=lambda _: create_checkout_session(payment.pk))) as fake_time:
+            data = self.get_status(payment, '?wait=10')
+
+        fake_time.sleep.assert_called_once()
+
+        self.assertEqual(data['checkout_status'], Payments.CHECKOUT_READY)
+        self.assertEqual(self.get_status(payment, '?wait=0')['checkout_status'], Payments.CHECKOUT_READY)
+
+    def test_invalid_wait(self):
+        """ Тестирование ошибки при нечисловом времени ожидания """
+
+        _, payment = self.pay_async()
+        response = self.client.get(reverse('education:payments_checkout', args=[payment.pk]) + '?wait=soon',
+                                   HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_checkout_failed(self):
+        """ Тестирование ошибки Stripe, которую не стоит повторять: платеж помечается ошибкой """
+
+        _, payment = self.pay_async()
+        error = stripe.error.InvalidRequestError('No such price', 'price')
+
+        with mock.patch('education.tasks.checkout_payment', side_effect=error), \
+                self.assertRaises(stripe.error.InvalidRequestError):
+            create_checkout_session(payment.pk)
+
+        self.assertEqual(self.get_status(payment)['checkout_status'], Payments.CHECKOUT_FAILED)
+        self.assertEqual(get_metrics()['checkout.failed'], 1)
+
+
+@override_settings(STRIPE_SK='sk_test_stub')
+class StripeClientTestCase(StripeStubMixin, APITestCase):
+    """ Тестирование клиента Stripe на заглушке с задержками и ошибками: таймауты, повторы и предохранитель """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        cache.clear()
+        self.start_stripe_stub()
+        self.breaker = CircuitBreaker(window=4, min_calls=4, error_rate=0.5, reset_timeout=0.2)
+        self.client_http = StripeHTTPClient(connect_timeout=1, read_timeout=0.2, pool_size=2, max_retries=2,
+                                            retry_delay=0.01, max_retry_delay=0.02, breaker=self.breaker)
+        default_client = mock.patch.object(stripe, 'default_http_client', self.client_http)
+        default_client.start()
+        self.addCleanup(default_client.stop)
+
+    def create_product(self):
+        return stripe.Product.create(api_key=settings.STRIPE_SK, name='Product')
+
+    def test_latency_metrics(self):
+        """ Тестирование метрик задержки запросов """
+
+        self.server.delay = 0.05
+        self.create_product()
+        self.create_product()
+
+        metrics = get_metrics()
+        self.assertEqual(metrics['stripe.requests'], 2)
+        self.assertGreaterEqual(metrics['stripe.latency_ms_total'], 100)
+        self.assertNotIn('stripe.errors', metrics)
+
+    def test_retry_server_errors(self):
+        """ Тестирование повторов ответов 500 с тем же ключом идемпотентности """
+
+        self.server.failures = 2
+        self.assertEqual(self.create_product()['id'], 'prod_3')
+
+        self.assertEqual(len(self.server.requests), 3)
+        metrics = get_metrics()
+        self.assertEqual((metrics['stripe.retries'], metrics['stripe.errors']), (2, 2))
+
+    def test_read_timeout(self):
+        """ Тестирование таймаута чтения: медленный ответ Stripe не держит запрос дольше таймаута с повторами """
+
+        self.server.delay = 0.5
+        started = time.monotonic()
+        with self.assertRaises(stripe.error.APIConnectionError):
+            self.create_product()
+
+        self.assertLess(time.monotonic() - started, 1.2)
+        self.assertEqual(get_metrics()['stripe.errors'], 3)
+
+    def test_circuit_breaker(self):
+        """ Тестирование предохранителя: после серии ошибок запросы отклоняются без обращения к Stripe """
+
+        self.server.failures = 6
+        with self.assertRaises(stripe.error.APIError):
+            self.create_product()
+        # Четвертая ошибка открывает предохранитель, и повторы прекращаются
+        with self.assertRaises(CircuitOpenError):
+            self.create_product()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        with self.assertRaises(CircuitOpenError):
+            self.create_product()
+        self.assertEqual(len(self.server.requests), 4)
+        self.assertEqual(get_metrics()['stripe.circuit_rejected'], 2)
+
+        # После reset_timeout пробный запрос проходит и закрывает предохранитель
+        self.server.failures = 0
+        time.sleep(0.25)
+        self.create_product()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+
+    def test_half_open_unexpected_error(self):
+        """ Тестирование непредвиденной ошибки пробного запроса: предохранитель снова открывается """
+
+        self.breaker.open()
+        time.sleep(0.25)
+        with mock.patch('stripe.http_client.RequestsClient.request', side_effect=ValueError('bad response')), \
+                self.assertRaises(ValueError):
+            self.create_product()
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(get_metrics()['stripe.errors'], 1)
+
+@override_settings(STRIPE_SK='sk_test_stub')
+class IdempotencyKeyTestCase(StripeStubMixin, APITestCase):
+    """ Тестирование повторов создания платежа с заголовком Idempotency-Key """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.start_stripe_stub()
+        self.user = User.objects.create(email='user', password='user')
+        self.course = Course.objects.create(name='Course', description='Description', amount=1000)
+        # Токен с ролью и активностью - пользователь не читается из БД
+        self.token = f'Bearer {ClaimsTokenObtainPairSerializer.get_token(self.user).access_token}'
+
+    def pay(self, key=None, course=None, prefer=None):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key is not None else {}
+        if prefer is not None:
+            headers['HTTP_PREFER'] = prefer
+        return self.client.post(reverse('education:payments_create'), data={'course': (course or self.course).pk},
+                                HTTP_AUTHORIZATION=self.token, **headers)
+
+    def test_retry_replayed(self):
+        """ Тестирование повтора: сохраненный ответ одним запросом к БД и без обращения к Stripe """
+
+        response = self.pay('key-1')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        with self.assertNumQueries(1):
+            retry = self.pay('key-1')
+
+        self.assertEqual((retry.status_code, retry.json()), (status.HTTP_201_CREATED, response.json()))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Payments.objects.count(), 1)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_different_keys(self):
+        """ Тестирование запросов без ключа и с разными ключами - отдельные платежи """
+
+        self.pay()
+        self.pay()
+        self.pay('key-1')
+        self.pay('key-2')
+
+        self.assertEqual(Payments.objects.count(), 4)
+
+    def test_payload_mismatch(self):
+        """ Тестирование того же ключа с другими данными запроса """
+
+        other_course = Course.objects.create(name='Other', description='Description', amount=500)
+        self.pay('key-1')
+        response = self.pay('key-1', course=other_course)
+
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Payments.objects.count(), 1)
+
+    def test_failed_request_releases_key(self):
+        """
+        Тестирование ошибки Stripe в первом запросе: платеж остается с ошибкой оформления,
+        ключ освобождается, повтор выполняется заново
+        """
+
+        with mock.patch('education.views.checkout_payment', side_effect=stripe.error.APIConnectionError('down')), \
+                self.assertRaises(stripe.error.APIConnectionError):
+            self.pay('key-1')
+        self.assertEqual(list(Payments.objects.values_list('checkout_status', flat=True)), [Payments.CHECKOUT_FAILED])
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        response = self.pay('key-1')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Payments.objects.count(), 2)
+        self.assertEqual(IdempotencyKey.objects.get().response_status, status.HTTP_201_CREATED)
+
+    @override_settings(IDEMPOTENCY_WAIT=0)
+    def test_expired_lease_taken_over(self):
+        """ Тестирование ключа без ответа: до истечения аренды повтор получает 409, после - выполняется заново """
+
+        self.pay('key-1')
+        # Процесс первого запроса завершился, не сохранив ответ
+        IdempotencyKey.objects.update(response_status=None, response_body=None)
+        self.assertEqual(self.pay('key-1').status_code, status.HTTP_409_CONFLICT)
+
+        IdempotencyKey.objects.update(created_at=timezone.now() - settings.IDEMPOTENCY_LEASE - timedelta(minutes=1))
+        response = self.pay('key-1')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+        self.assertEqual(Payments.objects.count(), 2)
+        self.assertEqual(IdempotencyKey.objects.get().response_status, status.HTTP_201_CREATED)
+
+    def test_async_replayed_with_headers(self):
+        """ Тестирование повтора асинхронного создания платежа: заголовки Location и Preference-Applied сохраняются """
+
+        with mock.patch.object(create_checkout_session, 'delay'), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.pay('key-1', prefer='respond-async')
+        retry = self.pay('key-1', prefer='respond-async')
+
+        self.assertEqual((response.status_code, retry.status_code), (status.HTTP_202_ACCEPTED,) * 2)
+        self.assertEqual(retry['Location'], response['Location'])
+        self.assertEqual(retry['Preference-Applied'], 'respond-async')
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Payments.objects.count(), 1)
+
+    def test_async_payload_mismatch(self):
+        """ Тестирование того же ключа с другими данными при асинхронном создании - 422, а не 202 """
+
+        other_course = Course.objects.create(name='Other', description='Description', amount=500)
+        with mock.patch.object(create_checkout_session, 'delay'), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.pay('key-1', prefer='respond-async')
+        response = self.pay('key-1', course=other_course, prefer='respond-async')
+
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertFalse(response.has_header('Location'))
+        self.assertEqual(Payments.objects.count(), 1)
+
+    def test_purge(self):
+        """ Тестирование удаления устаревших ключей """
+
+        self.pay('key-1')
+        IdempotencyKey.objects.update(created_at=timezone.now() - settings.IDEMPOTENCY_KEY_TTL - timedelta(minutes=1))
+        self.pay('key-2')
+
+        self.assertEqual(idempotency_purge(), 1)
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['key-2'])
+
+
+@override_settings(STRIPE_SK='sk_test_stub')
+class IdempotencyConcurrencyTestCase(StripeStubMixin, APITransactionTestCase):
+    """ Тестирование параллельных запросов с одним ключом идемпотентности (отдельные соединения с БД) """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.start_stripe_stub()
+        self.server.delay = 0.2
+        self.user = User.objects.create(email='user', password='user')
+        self.course = Course.objects.create(name='Course', description='Description', amount=1000)
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+
+    def pay(self, responses):
+        try:
+            client = APIClient()
+            responses.append(client.post(reverse('education:payments_create'), data={'course': self.course.pk},
+                                         HTTP_AUTHORIZATION=self.token, HTTP_IDEMPOTENCY_KEY='key-1'))
+        finally:
+            connections.close_all()
+
+    def test_concurrent_duplicate_waits(self):
+        """ Тестирование повтора во время первого запроса: ждет его завершения и получает тот же ответ """
+
+        responses = []
+        first = threading.Thread(target=self.pay, args=(responses,))
+        first.start()
+        # Второй запрос приходит, пока первый ждет ответа Stripe
+        while not self.server.requests:
+            time.sleep(0.01)
+        # Транзакция с платежом и ключом зафиксирована до обращения к Stripe
+        self.assertTrue(Payments.objects.exists())
+        second = threading.Thread(target=self.pay, args=(responses,))
+        second.start()
+        first.join()
+        second.join()
+
+        self.assertEqual([response.status_code for response in responses], [status.HTTP_201_CREATED] * 2)
+        self.assertEqual(responses[0].json(), responses[1].json())
+        self.assertTrue(responses[1].has_header('Idempotent-Replayed'))
+        self.assertEqual(Payments.objects.count(), 1)
+        self.assertEqual(len(self.server.requests), 3)
+
+
+@override_settings(STRIPE_SK='sk_test_stub', STRIPE_WEBHOOK_SECRET='whsec_test')
+class StripeWebhookTestCase(StripeStubMixin, APITestCase):
+    """ Тестирование приема событий Stripe, пакетной обработки и сверки платежей """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.start_stripe_stub()
+        self.course = Course.objects.create(name='Course', description='Description', amount=1000)
+        self.payment = Payments.objects.create(course=self.course, amount=1000, stripe_session_id='cs_1',
+                                               checkout_status=Payments.CHECKOUT_READY)
+        # Сессия этого платежа не сохранилась - платеж находится по client_reference_id
+        self.other_payment = Payments.objects.create(course=self.course, amount=1000)
+
+    def get_session(self, session_id, payment, **values):
+        return {'id': session_id, 'object': 'checkout.session', 'client_reference_id': str(payment.pk),
+                'payment_status': 'unpaid', 'status': 'open', 'created': 1700000000, **values}
+
+    def get_event(self, event_id, event_type, session, created=1700000100):
+        return {'id': event_id, 'object': 'event', 'type': event_type, 'created': created,
+                'data': {'object': session}}
+
+    def send_event(self, event, secret='whsec_test'):
+        payload = json.dumps(event)
+        timestamp = int(time.time())
+        signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+        return self.client.post(reverse('education:payments_webhook'), data=payload, content_type='application/json',
+                                HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}')
+
+    def test_webhook_records_event(self):
+        """ Тестирование записи события одним запросом к БД, повтор доставки отбрасывается """
+
+        event = self.get_event('evt_1', 'checkout.session.completed', self.get_session('cs_1', self.payment))
+        with self.assertNumQueries(1):
+            response = self.send_event(event)
+        self.send_event(event)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(StripeEvent.objects.values_list('event_id', 'processed_at')), [('evt_1', None)])
+
+    def test_invalid_signature(self):
+        """ Тестирование события с неверной подписью """
+
+        response = self.send_event(self.get_event('evt_1', 'checkout.session.completed', {}), secret='whsec_other')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    @override_settings(STRIPE_WEBHOOK_SECRET=None)
+    def test_secret_not_configured(self):
+        """ Тестирование приема события без настроенного секрета webhook - 503, событие не записывается """
+
+        response = self.send_event(self.get_event('evt_1', 'checkout.session.completed', {}))
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_process_events(self):
+        """ Тестирование обработки пачки событий: статусы платежей обновляются одним bulk_update """
+
+        paid = self.get_session('cs_1', self.payment, payment_status='paid', status='complete')
+        for event in (
+            self.get_event('evt_1', 'checkout.session.completed', paid),
+            # Событие об истечении пришло позже оплаты, но оплаченный платеж не меняется
+            self.get_event('evt_2', 'checkout.session.expired', {**paid, 'status': 'expired'}, created=1700000200),
+            self.get_event('evt_3', 'checkout.session.expired', self.get_session('cs_2', self.other_payment)),
+            self.get_event('evt_4', 'customer.created', {'id': 'cus_1', 'object': 'customer'}),
+        ):
+            self.send_event(event)
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(stripe_events_process(), 4)
+
+        updates = [query['sql'] for query in context.captured_queries
+                   if query['sql'].startswith('UPDATE "education_payments"')]
+        self.assertEqual(len(updates), 1)
+        self.payment.refresh_from_db()
+        self.other_payment.refresh_from_db()
+        self.assertEqual((self.payment.payment_status, self.payment.paid_at.timestamp()),
+                         (Payments.PAYMENT_PAID, 1700000100))
+        # Время записи статуса - время обработки, а не события Stripe (по нему идут дневные итоги)
+        self.assertGreater(self.payment.status_changed_at, timezone.now() - timedelta(minutes=1))
+        self.assertEqual((self.other_payment.payment_status, self.other_payment.stripe_session_id),
+                         (Payments.PAYMENT_EXPIRED, 'cs_2'))
+        self.assertFalse(StripeEvent.objects.filter(processed_at__isnull=True).exists())
+        self.assertEqual(stripe_events_process(), 0)
+
+    def test_reconcile_payments(self):
+        """ Тестирование сверки: постраничный обход сессий оплаты Stripe """
+
+        self.server.page_size = 2
+        self.server.sessions = [
+            self.get_session('cs_1', self.payment, payment_status='paid', status='complete'),
+            self.get_session('cs_2', self.other_payment),
+            self.get_session('cs_3', self.payment, client_reference_id=None, status='expired'),
+        ]
+        output = StringIO()
+        call_command('reconcile_payments', '--days', '1', stdout=output)
+
+        self.assertIn('Проверено сессий оплаты: 3, обновлено платежей: 2', output.getvalue())
+        self.assertEqual([path for path, _ in self.server.requests], ['/v1/checkout/sessions'] * 2)
+        self.assertEqual(self.server.requests[1][1]['starting_after'], 'cs_2')
+        self.payment.refresh_from_db()
+        self.other_payment.refresh_from_db()
+        self.assertEqual(self.payment.payment_status, Payments.PAYMENT_PAID)
+        self.assertEqual((self.other_payment.payment_status, self.other_payment.stripe_session_id),
+                         (Payments.PAYMENT_UNPAID, 'cs_2'))
@@ -5,7 +5,7 @@ from rest_framework.routers import DefaultRouter
 
 from education.views import CourseViewSet, LessonCreateAPIView, LessonListAPIView, LessonRetrieveAPIView, \
     LessonUpdateAPIView, LessonDestroyAPIView, PaymentsListAPIView, PaymentsRetrieveAPIView, PaymentsCreateAPIView, \
-    SubscriptionViewSet
+    SubscriptionViewSet, PaymentsExportAPIView, PaymentsAnalyticsAPIView, PaymentsCheckoutAPIView, StripeWebhookAPIView
 
 app_name = EducationConfig.name
 
@@ -22,5 +22,9 @@ urlpatterns = [
 
     path('payments/create/', PaymentsCreateAPIView.as_view(), name='payments_create'),
     path('payments/', PaymentsListAPIView.as_view(), name='payments_list'),
+    path('payments/export/', PaymentsExportAPIView.as_view(), name='payments_export'),
+    path('payments/analytics/', PaymentsAnalyticsAPIView.as_view(), name='payments_analytics'),
+    path('payments/webhook/', StripeWebhookAPIView.as_view(), name='payments_webhook'),
     path('payments/<int:pk>/', PaymentsRetrieveAPIView.as_view(), name='payments_get'),
+    path('payments/<int:pk>/checkout/', PaymentsCheckoutAPIView.as_view(), name='payments_checkout'),
 ] + router.urls
\ No newline at end of file
@@ -1,6 +1,8 @@
 import re
 from rest_framework.serializers import ValidationError
 
+from education.fields import get_content_hash
+
 
 class UrlValidator:
     """ Валидатор для проверки отсутствия посторонних ссылок в курсах или уроках, кроме youtube.com """
@@ -22,3 +24,30 @@ class UrlValidator:
             if 'youtube' not in url:
                 return True
         return False
+
+
+class ContentHashUniqueValidator:
+    """
+    Валидатор уникальности названия и описания курса или урока:
+    вместо сравнения текстов ищется хеш содержимого по уникальному индексу
+    """
+
+    requires_context = True
+    message = 'Запись с таким названием и описанием уже существует!'
+
+    def __init__(self, queryset, fields=('name', 'description')):
+        self.queryset = queryset
+        self.fields = fields
+
+    def __call__(self, attrs, serializer):
+        instance = serializer.instance
+        # При частичном изменении недостающие значения берем из изменяемой записи
+        values = [attrs[field] if field in attrs else getattr(instance, field, None) for field in self.fields]
+        if any(value is None for value in values):
+            return
+
+        queryset = self.queryset.filter(content_hash=get_content_hash(*values))
+        if instance is not None:
+            queryset = queryset.exclude(pk=instance.pk)
+        if queryset.exists():
+            raise ValidationError(self.message, code='unique')
@@ -1,25 +1,50 @@
+from functools import partial
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch, Sum
+from django.http import StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.filters import OrderingFilter
-from rest_framework import generics, viewsets
-from rest_framework.permissions import IsAuthenticated
-
-from education.models import Course, Lesson, Payments, Subscription
+from rest_framework import generics, status, viewsets
+from rest_framework.permissions import AllowAny, IsAuthenticated, SAFE_METHODS
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from education.caching import CachedResponseMixin, ConditionalGetMixin
+from education.checkout import checkout_payment, fail_checkout, prefers_async, wait_for_checkout
+from education.compiled_serializers import CompiledListMixin
+from education.exports import EXPORT_FORMATS, iter_export
+from education.filters import PaymentsFilter, PaymentsRollupFilter
+from education.idempotency import IdempotentCreateMixin
+from education.models import Course, Lesson, Payments, PaymentsDailyRollup, Subscription
 from education.paginators import EducationPaginator
 from education.permissions import IsModeratorOrReadOnly, IsCourseOrLessonOwner, IsPaymentOwner, IsCourseOwner
+from education.rollups import ROLLUP_GROUP_FIELDS
 from education.serializers import CourseSerializer, LessonSerializer, PaymentsSerializer, SubscriptionSerializer, \
-    PaymentCreateSerializer
+    PaymentCreateSerializer, PaymentCheckoutSerializer, LessonListSerializer, get_query_list, get_sparse_queryset
+from education.tasks import create_checkout_session
+from education.webhooks import record_stripe_event
 from users.helpers import is_moderator
 
-from education.tasks import subscriber_notify
+from education.notifications import schedule_course_notification
 
 
-class CourseViewSet(viewsets.ModelViewSet):
-    """ ViewSet - набор для основных CRUD - действий над курсами """
+class CourseViewSet(ConditionalGetMixin, CachedResponseMixin, viewsets.ModelViewSet):
+    """
+    ViewSet - набор для основных CRUD - действий над курсами,
+    ответы list и retrieve кешируются и поддерживают условные запросы (ETag, Last-Modified)
+    """
 
     serializer_class = CourseSerializer
     permission_classes = [IsAuthenticated, IsModeratorOrReadOnly | IsCourseOwner]
     pagination_class = EducationPaginator
+    # Сортировка для курсорной пагинации (?cursor=)
+    cursor_ordering = ('id',)
+    # В курсе выводится имя владельца
+    conditional_related_fields = ('owner',)
 
     def get_queryset(self):
         """ Переопределяем queryset, чтобы доступ к обьекту имели только его владельцы и модератор """
@@ -27,9 +52,25 @@ class CourseViewSet(viewsets.ModelViewSet):
         if self.request.user.is_anonymous:
             return Course.objects.none()
         if is_moderator(self.request.user):
-            return Course.objects.all()
+            queryset = Course.objects.all()
         else:
-            return Course.objects.filter(owner=self.request.user)
+            queryset = Course.objects.filter(owner=self.request.user)
+
+        if self.request.method not in SAFE_METHODS:
+            return queryset
+
+        # Собираем данные только для запрошенных полей (?fields=, ?expand=) одним планом запросов без N+1
+        serializer = self.get_serializer()
+        queryset = get_sparse_queryset(queryset, serializer)
+        if 'is_subscribed' in serializer.fields:
+            queryset = queryset.annotate(
+                is_subscribed=Exists(Subscription.objects.filter(user=self.request.user, course=OuterRef('pk')))
+            )
+        if 'lessons' in serializer.fields:
+            # Колонка course нужна, чтобы разложить предзагруженные уроки по курсам
+            lessons = get_sparse_queryset(Lesson.objects.order_by('pk'), LessonListSerializer(), extra=('course',))
+            queryset = queryset.prefetch_related(Prefetch('lesson_set', queryset=lessons))
+        return queryset.order_by('pk')
 
     def perform_create(self, serializer):
         """ Переопределяем метод создания обьекта с условием, чтобы модераторы не могли создавать обьект """
@@ -60,20 +101,26 @@ class LessonCreateAPIView(generics.CreateAPIView):
 
         if is_moderator(self.request.user):
             raise PermissionDenied("Вы не можете создать новый урок!")
-        new_lesson = serializer.save()
-        new_lesson.owner = self.request.user
-        new_lesson.save()
+        # урок и событие для информирования подписчиков сохраняются в одной транзакции
+        with transaction.atomic():
+            new_lesson = serializer.save()
+            new_lesson.owner = self.request.user
+            new_lesson.save()
 
-        # запускаем отложенную задачу по информированию подписчиков курса о добалении нового урока
-        subscriber_notify.delay(new_lesson.course_id)
+            # планируем информирование подписчиков курса о добалении нового урока (изменения за окно объединяются)
+            schedule_course_notification(new_lesson)
 
 
-class LessonListAPIView(generics.ListAPIView):
-    """ Generic - класс для вывода списка уроков """
+class LessonListAPIView(ConditionalGetMixin, CompiledListMixin, generics.ListAPIView):
+    """ Generic - класс для вывода списка уроков с поддержкой условных запросов (ETag, Last-Modified) """
 
     serializer_class = LessonSerializer
     permission_classes = [IsAuthenticated, IsModeratorOrReadOnly | IsCourseOrLessonOwner]
     pagination_class = EducationPaginator
+    # Сортировка для курсорной пагинации (?cursor=)
+    cursor_ordering = ('id',)
+    # В уроке выводится название курса
+    conditional_related_fields = ('course',)
 
     def get_queryset(self):
         """ Переопределяем queryset чтобы доступ к обьекту имели только его владельцы и модератор """
@@ -81,16 +128,21 @@ class LessonListAPIView(generics.ListAPIView):
         if self.request.user.is_anonymous:
             return Lesson.objects.none()
         if is_moderator(self.request.user):
-            return Lesson.objects.all()
+            queryset = Lesson.objects.all()
         else:
-            return Lesson.objects.filter(owner=self.request.user)
+            queryset = Lesson.objects.filter(owner=self.request.user)
 
+        # Выбираем только колонки запрошенных полей (?fields=), название курса - тем же запросом
+        return get_sparse_queryset(queryset, self.get_serializer()).order_by('pk')
 
-class LessonRetrieveAPIView(generics.RetrieveAPIView):
-    """ Generic - класс для просмотра урока """
+
+class LessonRetrieveAPIView(ConditionalGetMixin, generics.RetrieveAPIView):
+    """ Generic - класс для просмотра урока с поддержкой условных запросов (ETag, Last-Modified) """
 
     serializer_class = LessonSerializer
     permission_classes = [IsAuthenticated, IsModeratorOrReadOnly | IsCourseOrLessonOwner]
+    # В уроке выводится название курса
+    conditional_related_fields = ('course',)
 
     def get_queryset(self):
         """ Переопределяем queryset чтобы доступ к обьекту имели только его владельцы и модератор """
@@ -98,9 +150,12 @@ class LessonRetrieveAPIView(generics.RetrieveAPIView):
         if self.request.user.is_anonymous:
             return Lesson.objects.none()
         if is_moderator(self.request.user):
-            return Lesson.objects.all()
+            queryset = Lesson.objects.all()
         else:
-            return Lesson.objects.filter(owner=self.request.user)
+            queryset = Lesson.objects.filter(owner=self.request.user)
+
+        # Выбираем только колонки запрошенных полей (?fields=), название курса - тем же запросом
+        return get_sparse_queryset(queryset, self.get_serializer())
 
 
 class LessonUpdateAPIView(generics.UpdateAPIView):
@@ -122,11 +177,13 @@ class LessonUpdateAPIView(generics.UpdateAPIView):
     def perform_update(self, serializer):
         """ Переопределяем метод изменения урока """
 
-        changed_lesson = serializer.save()
-        changed_lesson.save()
+        # урок и событие для информирования подписчиков сохраняются в одной транзакции
+        with transaction.atomic():
+            changed_lesson = serializer.save()
+            changed_lesson.save()
 
-        # запускаем отложенную задачу по информированию подписчиков курса о изменениях уроков курса
-        subscriber_notify.delay(changed_lesson.course_id)
+            # планируем информирование подписчиков курса о изменениях уроков курса (изменения за окно объединяются)
+            schedule_course_notification(changed_lesson)
 
 
 class LessonDestroyAPIView(generics.DestroyAPIView):
@@ -152,8 +209,12 @@ class LessonDestroyAPIView(generics.DestroyAPIView):
         instance.delete()
 
 
-class PaymentsCreateAPIView(generics.CreateAPIView):
-    """ Generic - класс для создания нового платежа """
+class PaymentsCreateAPIView(IdempotentCreateMixin, generics.CreateAPIView):
+    """
+    Generic - класс для создания нового платежа. С заголовком Prefer: respond-async платеж сохраняется
+    без ожидания Stripe: ответ 202 с адресом статуса, сессия оплаты создается задачей.
+    Повтор запроса с тем же заголовком Idempotency-Key возвращает ответ на первый запрос
+    """
 
     serializer_class = PaymentCreateSerializer
     permission_classes = [IsAuthenticated, IsPaymentOwner]
@@ -163,22 +224,76 @@ class PaymentsCreateAPIView(generics.CreateAPIView):
 
         if is_moderator(self.request.user):
             raise PermissionDenied("Вы не можете создавать новые платежи!")
-        else:
+
+        with transaction.atomic():
             new_payment = serializer.save()
             new_payment.owner = self.request.user
+            # Фиксируем сумму платежа по цене курса или урока, из нее считается выручка курса
+            new_payment.amount = serializer.get_price(new_payment)
+            new_payment.checkout_status = Payments.CHECKOUT_PENDING
             new_payment.save()
+            if prefers_async(self.request):
+                # Задача ставится после фиксации транзакции, чтобы воркер уже видел платеж
+                transaction.on_commit(partial(create_checkout_session.delay, new_payment.pk))
+
+    def finalize_create(self, serializer):
+        """
+        Ответ после сохранения платежа: 202 с адресом статуса (сессию создает задача)
+        или 201 со ссылкой на оплату - сессия создается здесь, вне транзакции
+        """
+
+        if prefers_async(self.request):
+            headers = {'Preference-Applied': 'respond-async', 'Location': serializer.data['status_url']}
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED, headers=headers)
+
+        try:
+            checkout_payment(serializer.instance)
+        except Exception:
+            fail_checkout(serializer.instance)
+            raise
+        return super().finalize_create(serializer)
 
 
-class PaymentsListAPIView(generics.ListAPIView):
+class PaymentsListAPIView(CompiledListMixin, generics.ListAPIView):
     """ Generic - класс для вывода списка платежей """
 
     serializer_class = PaymentsSerializer
     permission_classes = [IsAuthenticated, IsModeratorOrReadOnly | IsPaymentOwner]
+    pagination_class = EducationPaginator
     filter_backends = [DjangoFilterBackend, OrderingFilter]
-    # Определяем фильтрацию по нужным нам полям
-    filterset_fields = ('course', 'lesson', 'owner', 'payment_method',)
-    # Определяем фильтрацию по дате
+    # Определяем фильтрацию по нужным нам полям и диапазону дат
+    filterset_class = PaymentsFilter
+    # Определяем сортировку по дате
     ordering_fields = ('payment_date',)
+    # Сортировка по умолчанию, id добавлен для стабильного порядка платежей с одинаковой датой
+    ordering = ('payment_date', 'id')
+    # Сортировка для курсорной пагинации (?cursor=)
+    cursor_ordering = ('payment_date', 'id')
+
+    def get_queryset(self):
+        """ Переопределяем queryset чтобы доступ к обьекту имели только его владельцы и модератор """
+
+        if self.request.user.is_anonymous:
+            return Payments.objects.none()
+        if is_moderator(self.request.user):
+            queryset = Payments.objects.all()
+        else:
+            queryset = Payments.objects.filter(owner=self.request.user)
+
+        # Загружаем курс, урок и владельца платежа тем же запросом
+        return queryset.select_related('course', 'lesson', 'owner')
+
+
+class PaymentsExportAPIView(generics.GenericAPIView):
+    """
+    Generic - класс для потоковой выгрузки платежей в NDJSON или CSV (?export_format=csv),
+    поддерживает те же фильтры, что и список платежей
+    """
+
+    serializer_class = PaymentsSerializer
+    permission_classes = [IsAuthenticated, IsModeratorOrReadOnly | IsPaymentOwner]
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = PaymentsFilter
 
     def get_queryset(self):
         """ Переопределяем queryset чтобы доступ к обьекту имели только его владельцы и модератор """
@@ -190,6 +305,63 @@ class PaymentsListAPIView(generics.ListAPIView):
         else:
             return Payments.objects.filter(owner=self.request.user)
 
+    def get(self, request, *args, **kwargs):
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError({'export_format': f'Доступные форматы: {", ".join(EXPORT_FORMATS)}'})
+
+        queryset = self.filter_queryset(self.get_queryset()).order_by('id')
+        response = StreamingHttpResponse(
+            iter_export(queryset, self.get_serializer(), export_format),
+            content_type=EXPORT_FORMATS[export_format]
+        )
+        response['Content-Disposition'] = f'attachment; filename="payments.{export_format}"'
+        return response
+
+
+class PaymentsAnalyticsAPIView(generics.ListAPIView):
+    """
+    Generic - класс для аналитики выручки по дневным итогам платежей без чтения самих платежей:
+    группировка ?group_by=day,course,lesson,payment_method и фильтры по курсу, уроку, способу оплаты и дням.
+    Модератор видит выручку всех курсов, остальные пользователи - только своих курсов
+    """
+
+    permission_classes = [IsAuthenticated]
+    pagination_class = EducationPaginator
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = PaymentsRollupFilter
+
+    def get_queryset(self):
+        """ Переопределяем queryset чтобы выручку курса видели только его владелец и модератор """
+
+        if self.request.user.is_anonymous:
+            return PaymentsDailyRollup.objects.none()
+        if is_moderator(self.request.user):
+            return PaymentsDailyRollup.objects.all()
+        else:
+            return PaymentsDailyRollup.objects.filter(course__owner=self.request.user)
+
+    def get_group_fields(self):
+        """ Поля группировки из параметра ?group_by= (по умолчанию - по дням) """
+
+        group_fields = get_query_list(self.request, 'group_by') or ['day']
+        unknown = [field for field in group_fields if field not in ROLLUP_GROUP_FIELDS]
+        if unknown:
+            raise ValidationError({'group_by': f'Доступные группировки: {", ".join(ROLLUP_GROUP_FIELDS)}'})
+        return list(dict.fromkeys(group_fields))
+
+    def list(self, request, *args, **kwargs):
+        group_fields = self.get_group_fields()
+        queryset = self.filter_queryset(self.get_queryset()).values(*group_fields).annotate(
+            payments_count=Sum('payments_count'),
+            amount_total=Sum('amount_total'),
+        ).order_by(*group_fields)
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(list(queryset))
+
 
 class PaymentsRetrieveAPIView(generics.RetrieveAPIView):
     """ Generic - класс для просмотра платежа """
@@ -203,9 +375,51 @@ class PaymentsRetrieveAPIView(generics.RetrieveAPIView):
         if self.request.user.is_anonymous:
             return Payments.objects.none()
         if is_moderator(self.request.user):
-            return Payments.objects.all()
+            queryset = Payments.objects.all()
         else:
-            return Payments.objects.filter(owner=self.request.user)
+            queryset = Payments.objects.filter(owner=self.request.user)
+        return queryset.select_related('course', 'lesson', 'owner')
+
+
+class PaymentsCheckoutAPIView(PaymentsRetrieveAPIView):
+    """ Generic - класс для статуса сессии оплаты платежа, ?wait=N - ждать ее готовности до N секунд """
+
+    serializer_class = PaymentCheckoutSerializer
+
+    def get_queryset(self):
+        return super().get_queryset().select_related(None).only(
+            'id', 'owner_id', 'checkout_status', 'payment_url', 'stripe_session_id'
+        )
+
+    def get_object(self):
+        payment = super().get_object()
+        try:
+            wait = min(float(self.request.query_params.get('wait', 0)), settings.CHECKOUT_MAX_WAIT)
+        except ValueError:
+            raise ValidationError({'wait': 'Укажите время ожидания в секундах'})
+        return wait_for_checkout(payment, wait) if wait > 0 else payment
+
+
+class StripeWebhookAPIView(APIView):
+    """
+    APIView - класс для приема событий Stripe (webhook): проверяется подпись, событие записывается
+    в таблицу входящих событий и обрабатывается задачей stripe_events_process
+    """
+
+    # Stripe подписывает запрос секретом webhook, а не токеном пользователя
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        # Без секрета подпись проверить нельзя: Stripe получит 503 и повторит доставку после настройки
+        if not settings.STRIPE_WEBHOOK_SECRET:
+            return Response({'detail': 'Прием событий Stripe не настроен'},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        try:
+            record_stripe_event(request.body, request.headers.get('Stripe-Signature', ''))
+        except (ValueError, KeyError, stripe.error.SignatureVerificationError):
+            return Response({'detail': 'Неверная подпись или данные события'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(status=status.HTTP_200_OK)
 
 
 class SubscriptionViewSet(viewsets.ModelViewSet):
@@ -214,6 +428,8 @@ class SubscriptionViewSet(viewsets.ModelViewSet):
     serializer_class = SubscriptionSerializer
     queryset = Subscription.objects.all()
     lookup_field = 'id'
+    # Список выводится целиком, как и до включения PAGE_SIZE в настройках
+    pagination_class = None
 
     def perform_create(self, serializer):
         """ Переопределение метода создания подписки, чтобы сохранять текущий статус подписки True или False """
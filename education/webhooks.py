@@ -0,0 +1,174 @@
+import json
+from datetime import datetime, timezone as dt_timezone
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from education import metrics
+from education.counters import get_counted_state, shift_course_counters_bulk
+from education.models import Payments, StripeEvent
+
+# События сессии оплаты и статус платежа после них (None - статус берется из payment_status сессии)
+SESSION_EVENT_STATUSES = {
+    'checkout.session.completed': None,
+    'checkout.session.async_payment_succeeded': Payments.PAYMENT_PAID,
+    'checkout.session.async_payment_failed': Payments.PAYMENT_FAILED,
+    'checkout.session.expired': Payments.PAYMENT_EXPIRED,
+}
+
+
+def record_stripe_event(payload, signature):
+    """
+    Проверка подписи события Stripe и запись его в таблицу входящих событий без обработки.
+    Повтор уже записанного события (Stripe повторяет доставку) отбрасывается уникальным индексом по id события
+    """
+
+    payload = payload.decode() if isinstance(payload, bytes) else payload
+    stripe.WebhookSignature.verify_header(payload, signature, settings.STRIPE_WEBHOOK_SECRET,
+                                          stripe.Webhook.DEFAULT_TOLERANCE)
+    event = json.loads(payload)
+    StripeEvent.objects.bulk_create(
+        [StripeEvent(event_id=event['id'], type=event['type'], payload=event)], ignore_conflicts=True
+    )
+    metrics.incr('stripe_events.received')
+
+
+def get_session_status(session, event_type=None):
+    """ Статус платежа по событию или по самой сессии оплаты (при сверке) """
+
+    status = SESSION_EVENT_STATUSES.get(event_type)
+    if status is not None:
+        return status
+    if session.get('payment_status') in ('paid', 'no_payment_required'):
+        return Payments.PAYMENT_PAID
+    if session.get('status') == 'expired':
+        return Payments.PAYMENT_EXPIRED
+    return Payments.PAYMENT_UNPAID
+
+
+def apply_session_updates(updates):
+    """
+    Обновление статусов платежей по списку (сессия оплаты, статус, время) в хронологическом порядке:
+    платежи ищутся одним запросом по id сессии или id платежа (client_reference_id) и сохраняются одним bulk_update.
+    Оплаченный платеж не возвращается в другой статус. Возвращает количество измененных платежей
+    """
+
+    session_ids = {session['id'] for session, _, _ in updates}
+    payment_ids = {int(session['client_reference_id']) for session, _, _ in updates
+                   if str(session.get('client_reference_id') or '').isdigit()}
+    # Поля вклада в выручку курса загружаются, чтобы сдвинуть счетчик на смену статуса
+    payments = Payments.objects.filter(Q(stripe_session_id__in=session_ids) | Q(pk__in=payment_ids)).only(
+        'id', 'stripe_session_id', 'payment_status', 'paid_at', 'status_changed_at', 'course', 'lesson', 'amount'
+    )
+    by_session = {payment.stripe_session_id: payment for payment in payments if payment.stripe_session_id}
+    by_id = {payment.pk: payment for payment in payments}
+
+    now = timezone.now()
+    changed = {}
+    for session, status, changed_at in updates:
+        reference = str(session.get('client_reference_id') or '')
+        payment = by_session.get(session['id']) or (by_id.get(int(reference)) if reference.isdigit() else None)
+        if payment is None:
+            metrics.incr('stripe_events.unknown_payment')
+            continue
+        if payment.payment_status == Payments.PAYMENT_PAID and status != Payments.PAYMENT_PAID:
+            continue
+        if (payment.payment_status, payment.stripe_session_id) == (status, session['id']):
+            continue
+
+        if payment.payment_status != status:
+            payment.status_changed_at = now
+        payment.payment_status = status
+        payment.stripe_session_id = session['id']
+        if status == Payments.PAYMENT_PAID and payment.paid_at is None:
+            payment.paid_at = changed_at
+        changed[payment.pk] = payment
+
+    with transaction.atomic():
+        Payments.objects.bulk_update(
+            changed.values(), ['payment_status', 'paid_at', 'status_changed_at', 'stripe_session_id']
+        )
+        # bulk_update не вызывает сигналы - выручка курсов меняется здесь
+        shift_course_counters_bulk(Payments, [
+            (payment._counted_state, get_counted_state(payment)) for payment in changed.values()
+        ])
+    metrics.incr('stripe_events.payments_updated', len(changed))
+    return len(changed)
+
+
+def get_event_update(event):
+    """ Обновление платежа по событию сессии оплаты или None для других событий """
+
+    if event.type not in SESSION_EVENT_STATUSES:
+        return None
+    session = event.payload['data']['object']
+    changed_at = datetime.fromtimestamp(event.payload['created'], dt_timezone.utc)
+    return session, get_session_status(session, event.type), changed_at
+
+
+def process_stripe_events(batch_size=None):
+    """
+    Обработка входящих событий Stripe пачками, пока они есть: пачка захватывается с SKIP LOCKED,
+    поэтому задачу можно запускать на нескольких воркерах. Возвращает количество обработанных событий
+    """
+
+    batch_size = batch_size or settings.STRIPE_EVENTS_BATCH_SIZE
+    processed = 0
+    while True:
+        with transaction.atomic():
+            events = list(
+                StripeEvent.objects.select_for_update(skip_locked=True).filter(
+                    processed_at__isnull=True
+                ).order_by('received_at', 'id')[:batch_size]
+            )
+            if not events:
+                break
+
+            updates = []
+            for event in events:
+                try:
+                    update = get_event_update(event)
+                except (KeyError, TypeError, ValueError):
+                    metrics.incr('stripe_events.invalid')
+                    continue
+                if update is not None:
+                    updates.append(update)
+            apply_session_updates(sorted(updates, key=lambda update: update[2]))
+            StripeEvent.objects.filter(pk__in=[event.pk for event in events]).update(processed_at=timezone.now())
+
+        processed += len(events)
+        metrics.incr('stripe_events.processed', len(events))
+    return processed
+
+
+def reconcile_payments(created_after):
+    """
+    Сверка со Stripe: постраничный обход сессий оплаты, созданных после created_after,
+    и обновление статусов платежей по каждой странице. Возвращает количество сессий и измененных платежей
+    """
+
+    sessions = updated = 0
+    page = stripe.checkout.Session.list(api_key=settings.STRIPE_SK, limit=100,
+                                        created={'gte': int(created_after.timestamp())})
+    while True:
+        updates = [
+            (session, get_session_status(session), datetime.fromtimestamp(session['created'], dt_timezone.utc))
+            for session in page.data
+        ]
+        sessions += len(updates)
+        updated += apply_session_updates(updates)
+        if not page.has_more:
+            return sessions, updated
+        page = page.next_page()
+
+
+def purge_stripe_events():
+    """ Удаление обработанных событий старше STRIPE_EVENT_RETENTION """
+
+    deleted, _ = StripeEvent.objects.filter(
+        processed_at__lt=timezone.now() - settings.STRIPE_EVENT_RETENTION
+    ).delete()
+    return deleted
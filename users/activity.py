@@ -0,0 +1,115 @@
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from education import metrics
+from users.models import User
+
+LAST_SEEN_THROTTLE_KEY = 'last_seen:throttle:{}'
+# Отметки пишутся в корзины по LAST_SEEN_INTERVAL секунд: счетчик корзины выдает номер ячейки, в ячейке - (id, время)
+LAST_SEEN_COUNT_KEY = 'last_seen:{}:count'
+LAST_SEEN_SLOT_KEY = 'last_seen:{}:{}'
+LAST_SEEN_FLUSHED_KEY = 'last_seen:flushed'
+# Сколько корзин хранятся в кеше, если их не забрала задача записи (например, не работал celery beat)
+LAST_SEEN_KEEP_BUCKETS = 12
+LAST_SEEN_BATCH_SIZE = 1000
+
+
+def get_bucket(timestamp=None):
+    """ Номер корзины отметок для момента времени """
+
+    return int((timestamp or time.time()) // settings.LAST_SEEN_INTERVAL)
+
+
+def touch_last_seen(user_id, timestamp=None):
+    """
+    Отметка о том, что пользователь заходил в сервис. Пишется в кеш не чаще раза в LAST_SEEN_INTERVAL секунд
+    на пользователя, поэтому количество записей зависит от числа пользователей, а не запросов
+    """
+
+    timestamp = timestamp or time.time()
+    if not cache.add(LAST_SEEN_THROTTLE_KEY.format(user_id), 1, settings.LAST_SEEN_INTERVAL):
+        return False
+
+    bucket = get_bucket(timestamp)
+    timeout = settings.LAST_SEEN_INTERVAL * LAST_SEEN_KEEP_BUCKETS
+    count_key = LAST_SEEN_COUNT_KEY.format(bucket)
+    cache.add(count_key, 0, timeout)
+    try:
+        slot = cache.incr(count_key)
+    except ValueError:
+        # Счетчик успел пропасть из кеша между add и incr
+        cache.set(count_key, 1, timeout)
+        slot = 1
+    cache.set(LAST_SEEN_SLOT_KEY.format(bucket, slot), (user_id, timestamp), timeout)
+    return True
+
+
+def get_recently_seen(user_ids):
+    """ Пользователи, заходившие за последние LAST_SEEN_INTERVAL секунд (их отметка может быть еще не записана) """
+
+    keys = {LAST_SEEN_THROTTLE_KEY.format(user_id): user_id for user_id in user_ids}
+    return {keys[key] for key in cache.get_many(keys)}
+
+
+def read_last_seen(buckets):
+    """
+    Отметки из закрытых корзин: {id пользователя: время последнего захода} и ключи корзин в кеше.
+    Ключи удаляются только после записи в БД, чтобы при ошибке записи отметки не потерялись
+    """
+
+    seen = {}
+    keys = []
+    for bucket in buckets:
+        count_key = LAST_SEEN_COUNT_KEY.format(bucket)
+        slot_keys = [LAST_SEEN_SLOT_KEY.format(bucket, slot) for slot in range(1, (cache.get(count_key) or 0) + 1)]
+        for user_id, timestamp in cache.get_many(slot_keys).values():
+            seen[user_id] = max(timestamp, seen.get(user_id, timestamp))
+        keys += [count_key, *slot_keys]
+    return seen, keys
+
+
+def save_last_seen(seen):
+    """
+    Запись времени последнего захода одним UPDATE ... FROM (VALUES ...) на пачку пользователей.
+    Время не уменьшается: более поздний вход через получение токена не перезаписывается
+    """
+
+    table = connection.ops.quote_name(User._meta.db_table)
+    rows = sorted(seen.items())
+    updated = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(0, len(rows), LAST_SEEN_BATCH_SIZE):
+            batch = rows[start:start + LAST_SEEN_BATCH_SIZE]
+            params = []
+            for user_id, timestamp in batch:
+                params += [user_id, datetime.fromtimestamp(timestamp, dt_timezone.utc)]
+            cursor.execute(
+                f'UPDATE {table} SET last_login = seen.last_seen '
+                f'FROM (VALUES {", ".join(["(%s, %s)"] * len(batch))}) AS seen (id, last_seen) '
+                f'WHERE {table}.id = seen.id AND ({table}.last_login IS NULL OR {table}.last_login < seen.last_seen)',
+                params,
+            )
+            updated += cursor.rowcount
+    return updated
+
+
+def flush_last_seen():
+    """ Перенос отметок из закрытых корзин в поле last_login, текущая корзина еще заполняется """
+
+    current = get_bucket()
+    flushed = cache.get(LAST_SEEN_FLUSHED_KEY, current - LAST_SEEN_KEEP_BUCKETS)
+    buckets = range(max(flushed + 1, current - LAST_SEEN_KEEP_BUCKETS), current)
+
+    seen, keys = read_last_seen(buckets)
+    # При ошибке UPDATE корзины и отметка о записи остаются в кеше - следующий запуск запишет их повторно
+    updated = save_last_seen(seen) if seen else 0
+    cache.delete_many(keys)
+    cache.set(LAST_SEEN_FLUSHED_KEY, current - 1, timeout=None)
+
+    metrics.incr('last_seen.flushed', updated)
+    metrics.set_gauge('last_seen.users_per_flush', len(seen))
+    return updated
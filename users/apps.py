@@ -5,3 +5,7 @@ class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
     verbose_name = 'пользователи'
+
+    def ready(self):
+        # Подключаем обработчики сигналов моделей
+        import users.signals  # noqa: F401
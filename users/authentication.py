@@ -0,0 +1,89 @@
+import time
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+
+from users.models import User
+
+# Поля пользователя, которые записываются в токен и читаются из него без обращения к БД
+TOKEN_CLAIM_FIELDS = ('role', 'is_active')
+
+REVOKED_KEY = 'jwt:revoked:{}'
+
+# Точное время выдачи токена: iat записывается целыми секундами, а отзыв должен отличать токены внутри секунды
+ISSUED_AT_CLAIM = 'issued_at'
+
+
+def get_token_claims(user):
+    """ Данные пользователя для записи в токен """
+
+    claims = {field: getattr(user, field) for field in TOKEN_CLAIM_FIELDS}
+    claims[ISSUED_AT_CLAIM] = time.time()
+    return claims
+
+
+def get_token_issued_at(token):
+    """
+    Время выдачи токена для проверки отзыва. У токенов без точного времени берется iat - он округлен вниз,
+    поэтому токен, выданный в секунду отзыва, считается отозванным
+    """
+
+    return token.get(ISSUED_AT_CLAIM, token.get('iat'))
+
+
+def get_revocation_timeout():
+    """ Отметка об отзыве хранится, пока действителен любой выданный до нее токен (access или refresh) """
+
+    lifetime = max(api_settings.ACCESS_TOKEN_LIFETIME, api_settings.REFRESH_TOKEN_LIFETIME)
+    return int(lifetime.total_seconds())
+
+
+def revoke_user_tokens(user_ids):
+    """
+    Отзыв всех токенов пользователей, выданных до текущего момента:
+    вызывается при блокировке и смене роли, так как данные в таких токенах устарели
+    """
+
+    revoked_at = time.time()
+    cache.set_many({REVOKED_KEY.format(user_id): revoked_at for user_id in user_ids}, get_revocation_timeout())
+
+
+def is_token_revoked(user_id, issued_at):
+    """
+    Токен выдан не позже последнего отзыва токенов пользователя.
+    Время сравнивается с точностью до долей секунды: токен, выданный за мгновение до смены роли или блокировки,
+    отозван, а полученный повторным входом сразу после нее - действует
+    """
+
+    revoked_at = cache.get(REVOKED_KEY.format(user_id))
+    return revoked_at is not None and (issued_at is None or issued_at <= revoked_at)
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    Аутентификация по JWT без запроса пользователя к БД: id, роль и активность берутся из токена.
+    Остальные поля пользователя отложены и загружаются одним запросом при первом обращении к любому из них.
+    Токены без этих данных (выданные раньше) проверяются обычным запросом пользователя
+    """
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is not None and is_token_revoked(user_id, get_token_issued_at(validated_token)):
+            raise AuthenticationFailed('Токен отозван, получите новый токен', code='token_revoked')
+
+        if any(field not in validated_token for field in TOKEN_CLAIM_FIELDS):
+            return super().get_user(validated_token)
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not validated_token['is_active']:
+            raise AuthenticationFailed('Пользователь заблокирован', code='user_inactive')
+
+        # id в токене записан строкой - приводим к типу первичного ключа
+        values = {field: validated_token[field] for field in TOKEN_CLAIM_FIELDS}
+        values[User._meta.pk.attname] = User._meta.pk.to_python(user_id)
+        field_names = [field.attname for field in User._meta.concrete_fields if field.attname in values]
+        user = User.from_db(DEFAULT_DB_ALIAS, field_names, [values[name] for name in field_names])
+        user._load_deferred_together = True
+        return user
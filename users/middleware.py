@@ -0,0 +1,19 @@
+from users.activity import touch_last_seen
+
+
+class LastSeenMiddleware:
+    """
+    Класс для отметки последнего захода пользователя. Пользователь из JWT известен только после обработки
+    запроса представлением DRF, поэтому отметка ставится по готовому ответу
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            touch_last_seen(user.pk)
+        return response
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_alter_user_role'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['is_active', 'last_login'], name='user_active_last_login_idx'),
+        ),
+    ]
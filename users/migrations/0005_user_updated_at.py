@@ -0,0 +1,20 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:52
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_user_activity_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='дата изменения'),
+            preserve_default=False,
+        ),
+    ]
@@ -22,6 +22,24 @@ class User(AbstractUser):
     phone = models.CharField(max_length=35, verbose_name='телефон', **NULLABLE)
     country = models.CharField(max_length=50, verbose_name='страна', **NULLABLE)
     role = models.CharField(max_length=9, choices=UserRoles.choices, default=UserRoles.MEMBER, **NULLABLE)
+    # Имя пользователя выводится в курсах - по этой дате меняются их ETag и Last-Modified
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='дата изменения')
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
+
+    def refresh_from_db(self, using=None, fields=None):
+        """
+        Пользователь из данных токена (см. users/authentication.py) загружен не полностью:
+        при обращении к любому отложенному полю догружаем сразу все, а не по одному запросу на поле
+        """
+
+        if fields is not None and getattr(self, '_load_deferred_together', False):
+            fields = set(fields) | self.get_deferred_fields()
+        super().refresh_from_db(using=using, fields=fields)
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Поиск неактивных пользователей задачей user_ban (см. users/tasks.py)
+            models.Index(fields=['is_active', 'last_login'], name='user_active_last_login_idx'),
+        ]
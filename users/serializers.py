@@ -1,7 +1,11 @@
 from rest_framework import serializers
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
 
 from education.models import Payments
 from education.serializers import PaymentsForOwnerSerializer
+from users.authentication import get_token_claims, get_token_issued_at, is_token_revoked
 from users.models import User
 
 
@@ -40,3 +44,24 @@ class PublicUserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'first_name', 'role']
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """ Сериализатор получения токенов - в токены записываются роль, активность пользователя и время выдачи """
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        for claim, value in get_token_claims(user).items():
+            token[claim] = value
+        return token
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """ Сериализатор обновления access-токена - отклоняет refresh-токены, выданные до их отзыва """
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        if is_token_revoked(refresh.get(api_settings.USER_ID_CLAIM), get_token_issued_at(refresh)):
+            raise AuthenticationFailed('Токен отозван, получите новый токен', code='token_revoked')
+        return super().validate(attrs)
@@ -0,0 +1,35 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from users.authentication import TOKEN_CLAIM_FIELDS, revoke_user_tokens
+from users.models import User
+
+
+@receiver(post_init, sender=User)
+def remember_token_claims(sender, instance, **kwargs):
+    """ Запоминаем роль и активность при загрузке, чтобы при сохранении понять, устарели ли выданные токены """
+
+    instance._token_claims = get_loaded_claims(instance)
+
+
+@receiver(post_save, sender=User)
+def revoke_changed_user_tokens(sender, instance, created, **kwargs):
+    """ Отзыв токенов пользователя при смене роли или блокировке - в токенах записаны прежние значения """
+
+    claims = get_loaded_claims(instance)
+    if not created and claims != instance._token_claims:
+        revoke_user_tokens([instance.pk])
+    instance._token_claims = claims
+
+
+@receiver(post_delete, sender=User)
+def revoke_deleted_user_tokens(sender, instance, **kwargs):
+    """ Отзыв токенов удаленного пользователя """
+
+    revoke_user_tokens([instance.pk])
+
+
+def get_loaded_claims(instance):
+    """ Загруженные поля токена (отложенные поля не читаем, чтобы не вызывать запрос) """
+
+    return tuple(instance.__dict__.get(field) for field in TOKEN_CLAIM_FIELDS)
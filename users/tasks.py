@@ -1,11 +1,57 @@
-from celery import shared_task
+import uuid
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
 
-from datetime import datetime
-import pytz
-import datetime
+from celery import shared_task
+from django.core.cache import cache
+from django.utils import timezone
 
+from education import metrics
+from users.activity import flush_last_seen, get_recently_seen
+from users.authentication import revoke_user_tokens
 from users.models import User
 
+# Пользователь блокируется, если не заходил в сервис больше INACTIVE_DAYS дней (по московскому времени)
+INACTIVE_DAYS = 30
+MOSCOW_TIMEZONE = ZoneInfo('Europe/Moscow')
+
+# Блокировка от параллельных запусков, снимается сама, если процесс упал
+USER_BAN_LOCK = 'lock:user_ban'
+USER_BAN_LOCK_TIMEOUT = 5 * 60
+
+
+def get_inactive_cutoff(now=None):
+    """
+    Граница активности: начало московских суток INACTIVE_DAYS дней назад.
+    Все, кто заходил раньше нее, не заходили больше INACTIVE_DAYS календарных дней
+    """
+
+    today = (now or timezone.now()).astimezone(MOSCOW_TIMEZONE).date()
+    return datetime.combine(today - timedelta(days=INACTIVE_DAYS), time.min, tzinfo=MOSCOW_TIMEZONE)
+
+
+def ban_inactive_users(now=None):
+    """
+    Блокировка неактивных пользователей и продление времени тем, у кого нет данных о последнем входе.
+    Вместо перебора пользователей - два UPDATE по индексу (is_active, last_login).
+    Возвращает количество заблокированных и продленных пользователей
+    """
+
+    now = now or timezone.now()
+    # id нужны, чтобы отозвать токены: массовый UPDATE не вызывает сигналы модели
+    inactive_ids = list(
+        User.objects.filter(is_active=True, last_login__lt=get_inactive_cutoff(now)).values_list('pk', flat=True)
+    )
+    # заходившие только что пользователи еще не попали в last_login из кеша отметок
+    recently_seen = get_recently_seen(inactive_ids)
+    inactive_ids = [user_id for user_id in inactive_ids if user_id not in recently_seen]
+    deactivated = User.objects.filter(pk__in=inactive_ids, is_active=True).update(is_active=False)
+    revoke_user_tokens(inactive_ids)
+
+    # если данных о последнем входе пользователя нет, заносим туда текущую дату (продлеваем ему время)
+    backfilled = User.objects.filter(is_active=True, last_login__isnull=True).update(last_login=now)
+    return deactivated, backfilled
+
 
 @shared_task(name='user_ban')
 def check_user():
@@ -14,27 +60,27 @@ def check_user():
     если пользователь не заходил в сервис более месяца, то он блокируется
     """
 
-    users_is_active = User.objects.filter(is_active=True)
+    token = uuid.uuid4().hex
+    if not cache.add(USER_BAN_LOCK, token, USER_BAN_LOCK_TIMEOUT):
+        # предыдущий запуск еще не закончился
+        metrics.incr('user_ban.skipped')
+        return None
 
-    moscow_timezone = pytz.timezone('Europe/Moscow')  # устанавливаем часовой пояс
-    date_time_now = datetime.datetime.now()  # получаем текущие дату и время
-    date_now = date_time_now.astimezone(moscow_timezone)  # устанавливаем текущую дату с учетом часового пояса
+    try:
+        flush_last_seen()
+        deactivated, backfilled = ban_inactive_users()
+    finally:
+        if cache.get(USER_BAN_LOCK) == token:
+            cache.delete(USER_BAN_LOCK)
 
-    # проверяем дату последнего входа пользователя
-    for user in users_is_active:
+    metrics.incr('user_ban.deactivated', deactivated)
+    metrics.incr('user_ban.last_login_backfilled', backfilled)
+    metrics.set_gauge('user_ban.rows_affected', deactivated + backfilled)
+    return deactivated, backfilled
 
-        # проверяем есть ли данные о последнем входе пользователя
-        if user.last_login:
-            # устанавливаем дату последнего входа пользователя с учетом часового пояса
-            user_last_login = user.last_login.astimezone(moscow_timezone)
 
-            # если текущая дата больше даты последнего входа пользователя более месяца
-            if (date_now.date() - user_last_login.date()).days > 30:
-                # устанавливаем признак пользователя "не активен"
-                user.is_active = False
-                user.save()
+@shared_task(name='last_seen_flush')
+def last_seen_flush():
+    """ Запись накопленных в кеше отметок о заходе пользователей в поле last_login """
 
-        # если данных о последнем входе пользователя нет, заносим туда текущую дату (продлеваем ему время))
-        else:
-            user.last_login = date_now
-            user.save()
+    return flush_last_seen()
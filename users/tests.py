@@ -1,3 +1,252 @@
-from django.test import TestCase
+import time
+from datetime import datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from education import metrics
+from users.activity import flush_last_seen, touch_last_seen
+from users.authentication import ClaimsJWTAuthentication, is_token_revoked
+from users.models import User, UserRoles
+from users.serializers import PublicUserSerializer, UserSerializer
+from users.tasks import MOSCOW_TIMEZONE, USER_BAN_LOCK, check_user, get_inactive_cutoff
+
+
+class UserListTestCase(APITestCase):
+    """ Тестирование вывода списка пользователей """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='user', password='user', first_name='User')
+        self.other_user = User.objects.create(email='other', password='other', first_name='Other')
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+
+    def test_user_list(self):
+        """ Тестирование совпадения быстрой сериализации списка с сериализаторами пользователей """
+
+        response = self.client.get(reverse('users:users-list'), HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        context = {'request': response.renderer_context['request']}
+        # Список пользователей выводится без пагинации
+        results = {user['id']: user for user in response.json()}
+
+        self.assertEqual(results[self.other_user.pk], PublicUserSerializer(self.other_user).data)
+        self.assertEqual(
+            results[self.user.pk],
+            UserSerializer(User.objects.get(pk=self.user.pk), context=context).data
+        )
+
+
+class ClaimsAuthenticationTestCase(APITestCase):
+    """ Тестирование аутентификации по данным токена без запроса пользователя к БД """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        cache.clear()
+        self.user = User(email='user@lms.local', first_name='User')
+        self.user.set_password('password')
+        self.user.save()
+
+        response = self.client.post(reverse('users:token_obtain_pair'),
+                                    data={'email': 'user@lms.local', 'password': 'password'})
+        self.tokens = response.json()
+        self.token = f'Bearer {self.tokens["access"]}'
+
+    def get_user_list(self, token=None):
+        return self.client.get(reverse('users:users-list'), HTTP_AUTHORIZATION=token or self.token)
+
+    def test_no_user_query(self):
+        """ Тестирование запроса без чтения пользователя из БД для аутентификации """
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('education:courses-list'), HTTP_AUTHORIZATION=self.token)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Имя владельца в курсах читается соединением с таблицей пользователей, отдельного запроса нет
+        self.assertFalse([query for query in context.captured_queries if 'FROM "users_user"' in query['sql']])
+
+    def test_lazy_user_fields(self):
+        """ Тестирование пользователя из токена: роль без запроса, остальные поля - одним запросом """
+
+        authentication = ClaimsJWTAuthentication()
+        token = authentication.get_validated_token(self.tokens['access'])
+
+        with self.assertNumQueries(0):
+            user = authentication.get_user(token)
+            self.assertEqual((user.pk, user.role, user.is_active), (self.user.pk, UserRoles.MEMBER, True))
+
+        with self.assertNumQueries(1):
+            self.assertEqual((user.email, user.first_name), ('user@lms.local', 'User'))
+
+    def test_role_change_revokes_tokens(self):
+        """ Тестирование отзыва токенов при смене роли в ту же секунду, что и вход: старые токены не принимаются """
+
+        self.user.role = UserRoles.MODERATOR
+        self.user.save()
+
+        self.assertEqual(self.get_user_list().status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post(reverse('users:token_refresh'), data={'refresh': self.tokens['refresh']})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_ban_revokes_tokens(self):
+        """ Тестирование отзыва токенов при блокировке: токен с активностью в данных больше не принимается """
+
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertEqual(self.get_user_list().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_relogin_after_revoke(self):
+        """ Тестирование нового входа сразу после отзыва токенов и проверки токенов без точного времени выдачи """
+
+        revoked_at = int(time.time()) + 0.5
+        with mock.patch('users.authentication.time', time=mock.Mock(return_value=revoked_at)):
+            self.user.role = UserRoles.MODERATOR
+            self.user.save()
+
+        # iat округлен вниз до секунды: токен, выданный в секунду отзыва, отозван
+        self.assertTrue(is_token_revoked(self.user.pk, int(revoked_at)))
+        self.assertTrue(is_token_revoked(self.user.pk, revoked_at - 0.1))
+        self.assertFalse(is_token_revoked(self.user.pk, revoked_at + 0.1))
+        with mock.patch('users.authentication.time', time=mock.Mock(return_value=revoked_at + 0.1)):
+            response = self.client.post(reverse('users:token_obtain_pair'),
+                                        data={'email': 'user@lms.local', 'password': 'password'})
+        self.assertEqual(self.get_user_list(f'Bearer {response.json()["access"]}').status_code, status.HTTP_200_OK)
+
+    def test_unchanged_save_keeps_tokens(self):
+        """ Тестирование сохранения пользователя без смены роли и активности - токены действуют """
+
+        self.user.first_name = 'Renamed'
+        self.user.save()
+
+        self.assertEqual(self.get_user_list().status_code, status.HTTP_200_OK)
+        response = self.client.post(reverse('users:token_refresh'), data={'refresh': self.tokens['refresh']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class UserBanTestCase(APITestCase):
+    """ Тестирование блокировки неактивных пользователей """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        cache.clear()
+        now = datetime.now(MOSCOW_TIMEZONE)
+        self.inactive = User.objects.create(email='inactive', last_login=now - timedelta(days=32))
+        self.active = User.objects.create(email='active', last_login=now - timedelta(days=2))
+        self.new = User.objects.create(email='new', last_login=None)
+
+    def test_check_user(self):
+        """ Тестирование блокировки, продления времени и метрик двумя запросами UPDATE """
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(check_user(), (1, 1))
+
+        updates = [query for query in context.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2)
+
+        self.assertFalse(User.objects.get(pk=self.inactive.pk).is_active)
+        self.assertTrue(User.objects.get(pk=self.active.pk).is_active)
+        self.assertIsNotNone(User.objects.get(pk=self.new.pk).last_login)
+        self.assertTrue(is_token_revoked(self.inactive.pk, None))
+        self.assertFalse(is_token_revoked(self.active.pk, None))
+
+        values = metrics.get_metrics()
+        self.assertEqual(values['user_ban.deactivated'], 1)
+        self.assertEqual(values['user_ban.last_login_backfilled'], 1)
+        self.assertEqual(values['user_ban.rows_affected'], 2)
+        self.assertIsNone(cache.get(USER_BAN_LOCK))
+
+    def test_inactive_cutoff(self):
+        """ Тестирование границы по московским календарным дням: ровно 30 дней назад - еще активен """
+
+        now = datetime(2024, 3, 31, 1, 0, tzinfo=MOSCOW_TIMEZONE)
+        cutoff = get_inactive_cutoff(now)
+
+        self.assertEqual(cutoff, datetime(2024, 3, 1, tzinfo=MOSCOW_TIMEZONE))
+        self.assertLess(datetime(2024, 2, 29, 23, 59, tzinfo=MOSCOW_TIMEZONE), cutoff)
+
+    def test_locked_run_skipped(self):
+        """ Тестирование пропуска запуска, пока не закончился предыдущий """
+
+        cache.add(USER_BAN_LOCK, 'other', 60)
+
+        with self.assertNumQueries(0):
+            self.assertIsNone(check_user())
+
+        self.assertTrue(User.objects.get(pk=self.inactive.pk).is_active)
+        self.assertEqual(metrics.get_metrics()['user_ban.skipped'], 1)
+
+
+class LastSeenTestCase(APITestCase):
+    """ Тестирование отметок о последнем заходе пользователя """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        cache.clear()
+        self.last_login = datetime.now(MOSCOW_TIMEZONE) - timedelta(days=40)
+        self.user = User.objects.create(email='user', last_login=self.last_login)
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+
+    def flush_next_interval(self):
+        """ Запись отметок после закрытия текущей корзины """
+
+        with mock.patch('users.activity.time.time', return_value=time.time() + settings.LAST_SEEN_INTERVAL):
+            return flush_last_seen()
+
+    def test_requests_throttled(self):
+        """ Тестирование одной отметки на пользователя за интервал и записи одним UPDATE """
+
+        for _ in range(3):
+            response = self.client.get(reverse('education:courses-list'), HTTP_AUTHORIZATION=self.token)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(User.objects.get(pk=self.user.pk).last_login, self.last_login)
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.flush_next_interval(), 1)
+
+        updates = [query for query in context.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('FROM (VALUES', updates[0]['sql'])
+        self.assertGreater(User.objects.get(pk=self.user.pk).last_login, self.last_login)
+        self.assertEqual(metrics.get_metrics()['last_seen.users_per_flush'], 1)
+        self.assertEqual(self.flush_next_interval(), 0)
+
+    def test_failed_save_keeps_marks(self):
+        """ Тестирование ошибки записи в БД: отметки остаются в кеше и записываются следующим запуском """
+
+        touch_last_seen(self.user.pk)
+        with mock.patch('users.activity.save_last_seen', side_effect=DatabaseError('down')), \
+                self.assertRaises(DatabaseError):
+            self.flush_next_interval()
+
+        self.assertEqual(self.flush_next_interval(), 1)
+        self.assertGreater(User.objects.get(pk=self.user.pk).last_login, self.last_login)
+
+    def test_last_login_not_decreased(self):
+        """ Тестирование отметки старше сохраненного входа - время входа не уменьшается """
+
+        touch_last_seen(self.user.pk, (self.last_login - timedelta(days=1)).timestamp())
+
+        self.assertEqual(self.flush_next_interval(), 0)
+        self.assertEqual(User.objects.get(pk=self.user.pk).last_login, self.last_login)
+
+    def test_recently_seen_not_banned(self):
+        """ Тестирование блокировки: пользователь с еще не записанной отметкой не блокируется """
+
+        response = self.client.get(reverse('education:courses-list'), HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(check_user(), (0, 0))
+        self.assertTrue(User.objects.get(pk=self.user.pk).is_active)
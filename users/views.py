@@ -1,8 +1,10 @@
 from rest_framework import viewsets, permissions
+from rest_framework.response import Response
 
+from education.compiled_serializers import compile_serializer
 from users.models import User
 from users.permissions import IsOwnerOrReadOnly
-from users.serializers import UserSerializer
+from users.serializers import UserSerializer, PublicUserSerializer
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -11,6 +13,28 @@ class UserViewSet(viewsets.ModelViewSet):
     serializer_class = UserSerializer
     queryset = User.objects.all()
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrReadOnly]
+    # Список выводится целиком, как и до включения PAGE_SIZE в настройках
+    pagination_class = None
+
+    def list(self, request, *args, **kwargs):
+        """
+        Список пользователей собираем быстрым CompiledSerializer по публичным полям,
+        полный сериализатор используем только для строки текущего пользователя
+        """
+
+        compiled = compile_serializer(PublicUserSerializer())
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = self.paginate_queryset(queryset.values(*compiled.lookups))
+        rows = page if page is not None else queryset.values(*compiled.lookups)
+        data = [
+            self.get_serializer(queryset.get(pk=row['id'])).data if row['id'] == request.user.pk
+            else compiled.to_representation(row)
+            for row in rows
+        ]
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
 
     def perform_create(self, serializer):
         """ Позволяем создавать и редактировать только свой профиль """